@@ -1,70 +1,279 @@
-from flask import Flask, render_template, request, redirect, url_for, send_file
+import logging
 import os
-import uuid
+import time
+from flask import Flask, Response, g, jsonify, render_template, request, redirect, send_file, url_for
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.utils import secure_filename
+from block import Block
 from imagechain import ImageChain
+from image_pipeline import spool_upload
+from ingest import IngestionPipeline
+from metrics import metrics
+from renditions import RENDITION_FORMATS
+
+STREAM_CHUNK_SIZE = 255 * 1024  # GridFS default chunk size
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+TRACE_REQUESTS = os.environ.get("IMAGECHAIN_TRACE") == "1"  # Log per-stage timings of every request
+
+trace_logger = logging.getLogger("imagechain.trace")
+
+class ChainJSONProvider(DefaultJSONProvider):
+    """Serializes Block objects (in jsonify and the tojson filter) as JSON objects."""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Block):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
 
 app = Flask(__name__)
+app.json = ChainJSONProvider(app)
 imagechain = ImageChain()
+pipeline = IngestionPipeline(imagechain)
+
+@app.before_request
+def start_request_timer():
+    if metrics.enabled:
+        g.request_started = time.perf_counter()
+        if TRACE_REQUESTS:
+            metrics.start_trace()
+
+@app.after_request
+def record_request_timing(response):
+    """Record the handling time (not the streaming of the body) of each request."""
+    started = g.get("request_started")
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    if TRACE_REQUESTS:
+        spans = " ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in metrics.end_trace())
+        trace_logger.info("%s %s %d %.1fms %s", request.method, request.full_path.rstrip("?"), response.status_code, elapsed * 1000, spans)
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.observe("imagechain_http_request_seconds", elapsed, method=request.method, route=route, status=response.status_code)
+    return response
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Expose counters and timing histograms in the Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/")
 def home():
-    """Render the home page with the imagechain."""
-    # Reload the blockchain from MongoDB
-    imagechain.chain = imagechain.load_from_mongodb()
-    
-    # Verify the blockchain integrity
-    is_valid = imagechain.verify_chain_real_time()
-    
-    return render_template("index.html", chain=imagechain.chain, is_valid=is_valid)
+    """Render the home page with the first page of blocks; the rest load on scroll."""
+    # A whole-chain audit only runs on request (?audit=1)
+    audited = request.args.get("audit") == "1"
+    is_valid = None
+    if audited:
+        imagechain.reload_chain()
+        is_valid = imagechain.verify_chain_real_time(full_audit=True)
+
+    return render_template(
+        "index.html",
+        page=imagechain.block_page(limit=PAGE_SIZE),
+        page_size=PAGE_SIZE,
+        audited=audited,
+        is_valid=is_valid,
+        job_id=request.args.get("job"),
+        webp="webp" in RENDITION_FORMATS
+    )
+
+@app.route("/api/blocks")
+def list_blocks():
+    """Return one page of blocks after the ?after= cursor, each with its verification status."""
+    after = request.args.get("after", -1, type=int)
+    limit = max(1, min(request.args.get("limit", PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    verify = request.args.get("verify") != "0"
+    return jsonify(imagechain.block_page(after, limit, verify))
 
 @app.route("/upload", methods=["POST"])
 def upload():
-    """Handle image upload and add it to the imagechain."""
+    """Queue an uploaded image for the imagechain and return its job id."""
     if "file" not in request.files:
         return redirect(url_for("home"))
     file = request.files["file"]
     if file.filename == "":
         return redirect(url_for("home"))
     
-    # Save the uploaded file temporarily
-    upload_dir = "uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, file.filename)
-    file.save(file_path)
-    
-    # Add the image to the blockchain
-    imagechain.add_block(file_path)
-    
-    # Clean up the temporary file
-    os.remove(file_path)
-    
-    return redirect(url_for("home"))
+    # Keep the upload in memory (spilling to a temp file only when very large)
+    # and hand it to the ingestion pipeline, which closes it when done
+    job = pipeline.submit(
+        spool_upload(file.stream),
+        signature=request.form.get("signature", ""),
+        message=request.form.get("message", ""),
+        filename=secure_filename(file.filename)
+    )
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(job.to_dict()), 202
+    return redirect(url_for("home", job=job.id))
+
+@app.route("/upload/batch", methods=["POST"])
+def upload_batch():
+    """Add many uploaded images as consecutive blocks in one pass."""
+    files = [file for file in request.files.getlist("files") if file.filename]
+    if not files:
+        return jsonify({"error": "No files uploaded"}), 400
+
+    metadata = {"signature": request.form.get("signature", ""), "message": request.form.get("message", "")}
+    try:
+        blocks = imagechain.add_blocks(files, metadata)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"blocks": blocks}), 201
+
+@app.route("/verify", methods=["POST"])
+def verify_image():
+    """Find the block an uploaded image belongs to (as uploaded or as stored)."""
+    if "file" not in request.files:
+        return jsonify({"error": "No file uploaded"}), 400
+    block = imagechain.find_block_by_image(request.files["file"].stream)
+    if block is None:
+        return jsonify({"found": False}), 404
+    try:
+        inclusion = imagechain.merkle_proof(block["index"])
+    except IndexError:
+        inclusion = None  # The block's chain changed under it (e.g. it was reloaded)
+    return jsonify({"found": True, "block": block, "inclusion": inclusion})
+
+@app.route("/merkle/root")
+def merkle_root():
+    """Return the Merkle root over all block headers."""
+    tree = imagechain.merkle_tree()
+    return jsonify({"root": tree.root, "size": len(tree)})
+
+@app.route("/merkle/proof/<int:index>")
+def merkle_proof(index):
+    """Return a block with its Merkle inclusion proof."""
+    try:
+        return jsonify(imagechain.merkle_proof(index))
+    except IndexError:
+        return jsonify({"error": "Unknown block"}), 404
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """Report the progress of a queued upload."""
+    status = pipeline.status(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(status)
+
+@app.route("/image/<file_id>/<size>.<format>")
+def get_rendition(file_id, size, format):
+    """Serve a resized copy (e.g. thumb.webp) of an image, generated on first request."""
+    etag = f"{imagechain.image_etag(file_id)}-{size}.{format}"
+    headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL}
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+
+    try:
+        data = imagechain.renditions.get(file_id, size, format)
+    except KeyError:
+        return "Unknown rendition", 404
+    except Exception as e:
+        return str(e), 404
+
+    response = Response(data, mimetype=imagechain.renditions.content_type(format), headers=headers)
+    response.set_etag(etag)
+    return response
 
 @app.route("/image/<file_id>")
 def get_image(file_id):
-    """Serve an image from MongoDB using its file_id."""
-    # Generate a unique filename for the temporary image
-    temp_image_path = f"temp_image_{uuid.uuid4().hex}.png"
+    """Stream an image from the blob store, honouring Range and If-None-Match."""
+    # Stored images never change, so they can be cached indefinitely
+    headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+
+    # A local blob is sent straight from its file (with sendfile where the server supports it)
     try:
-        # Retrieve the image from MongoDB
-        imagechain.get_image_from_mongodb(file_id, temp_image_path)
-        
-        # Serve the image
-        return send_file(temp_image_path, mimetype="image/png")
-    except Exception as e:
+        path = imagechain.image_path(file_id)
+    except KeyError as e:
         return str(e), 404
+    if path is not None:
+        response = send_file(path, mimetype="image/png", conditional=True, etag=imagechain.image_etag(file_id))
+        response.headers.update(headers)
+        return response
+
+    # Serve from the in-process cache when possible, otherwise stream the blob
+    image_bytes = imagechain.image_cache.get(file_id)
+    grid_out = None
+    if image_bytes is None:
+        try:
+            grid_out = imagechain.open_image_from_mongodb(file_id)
+        except Exception as e:
+            return str(e), 404
+
+    etag = imagechain.image_etag(file_id)
+    if request.if_none_match.contains(etag):
+        close_image(grid_out)
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+
+    length = len(image_bytes) if image_bytes is not None else grid_out.length
+    start, stop, status = 0, length, 200
+    if request.range:
+        byte_range = request.range.range_for_length(length)
+        if byte_range is None and len(request.range.ranges) == 1:
+            close_image(grid_out)
+            headers["Content-Range"] = f"bytes */{length}"
+            return Response(status=416, headers=headers)
+        if byte_range is not None:
+            start, stop = byte_range
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{stop - 1}/{length}"
+
+    if image_bytes is not None:
+        body = image_bytes[start:stop]
+    else:
+        # Only complete downloads are worth keeping in the cache
+        cache_key = file_id if status == 200 else None
+        body = stream_image(grid_out, start, stop - start, cache_key)
+
+    response = Response(
+        body,
+        status=status,
+        mimetype="image/png",
+        headers=headers
+    )
+    response.content_length = stop - start
+    response.set_etag(etag)
+    return response
+
+def stream_image(grid_out, start, length, cache_key=None):
+    """Yield a byte range of a stored image chunk by chunk.
+
+    With a cache_key, the streamed chunks are also collected and stored in the
+    image cache once the whole file has been sent (if it fits in the cache).
+    """
+    chunks = [] if cache_key and length <= imagechain.image_cache.max_size else None
+    try:
+        grid_out.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = grid_out.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            if chunks is not None:
+                chunks.append(chunk)
+            yield chunk
+        if chunks is not None and remaining == 0:
+            imagechain.image_cache.put(cache_key, b"".join(chunks))
     finally:
-        # Clean up the temporary file after it has been served
-        if os.path.exists(temp_image_path):
-            try:
-                os.remove(temp_image_path)
-            except PermissionError:
-                # If the file is still in use, skip deletion (it will be cleaned up later)
-                pass
+        grid_out.close()
+
+def close_image(grid_out):
+    if grid_out is not None:
+        grid_out.close()
 
 @app.route("/about")
 def about():
     return render_template("about.html")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("IMAGECHAIN_LOG_LEVEL", "INFO"), format="%(message)s")
     app.run(debug=True)
@@ -0,0 +1,316 @@
+"""Benchmarks for the ImageChain hot paths.
+
+Runs against an in-process mongomock database, so no MongoDB server (and no
+input() prompts) are needed, and writes the timings as JSON so runs on
+different commits can be compared:
+
+    python bench.py                          # full run, results in bench_output.txt
+    python bench.py --quick                  # smallest sizes only
+    python bench.py --compare old_output.txt # also print the change against an earlier run
+"""
+import argparse
+import contextlib
+from datetime import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+
+IMAGE_SIZES = [(640, 480), (1920, 1080), (4000, 3000)]
+CHAIN_LENGTHS = [10, 50, 200]
+DIFFICULTY_BITS = [8, 12, 16]
+QUICK_IMAGE_SIZES = [(640, 480)]
+QUICK_CHAIN_LENGTHS = [10]
+QUICK_DIFFICULTY_BITS = [8, 12]
+BLOCK_DIFFICULTY_BITS = 8  # Keeps mining from dominating the add_block and route timings
+CHAIN_IMAGE_SIZE = (320, 240)
+SAMPLE_BLOCK = {
+    "index": 1,
+    "file_hash": "0" * 64,
+    "previous_hash": "0" * 64,
+    "nonce": 0,
+    "timestamp": "2024-01-01 00:00:00",
+    "signature": "bench",
+    "message": "bench",
+}
+
+
+def mongomock_client():
+    try:
+        import mongomock
+        import mongomock.gridfs
+    except ImportError:
+        sys.exit("The benchmarks need mongomock: pip install mongomock")
+    mongomock.gridfs.enable_gridfs_integration()
+    return mongomock.MongoClient()
+
+
+def make_photo(size, seed):
+    """A reproducible photo-like RGB image: smooth gradients plus sensor noise."""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    gradient = np.add.outer(np.linspace(0, 160, height), np.linspace(0, 90, width))
+    channels = [gradient + offset for offset in rng.integers(0, 64, 3)]
+    pixels = np.stack(channels, axis=-1) + rng.normal(0, 12, (height, width, 3))
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def encoded(image, format):
+    buffer = io.BytesIO()
+    image.save(buffer, format)
+    buffer.seek(0)
+    return buffer
+
+
+def size_label(size):
+    return f"{size[0]}x{size[1]}"
+
+
+class Bench:
+    """Times callables and collects the results."""
+
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = []
+
+    def measure(self, name, params, function, setup=None, repeat=None):
+        """Time function repeat times; setup() (untimed) returns its argument."""
+        timings = []
+        for _ in range(repeat or self.repeat):
+            argument = setup() if setup else None
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                if setup:
+                    function(argument)
+                else:
+                    function()
+                timings.append((time.perf_counter() - start) * 1000)
+
+        result = {
+            "name": name,
+            "params": params,
+            "repeat": len(timings),
+            "min_ms": min(timings),
+            "median_ms": statistics.median(timings),
+            "mean_ms": statistics.fmean(timings),
+            "max_ms": max(timings),
+        }
+        self.results.append(result)
+        print(f"{name:<24} {format_params(params):<36} median {result['median_ms']:10.2f} ms   min {result['min_ms']:10.2f} ms")
+        return result
+
+
+def format_params(params):
+    return " ".join(f"{key}={value}" for key, value in params.items())
+
+
+def new_chain(client, name, length, seed=0):
+    """Create an ImageChain in its own mongomock database with length blocks."""
+    from imagechain import ImageChain
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        imagechain = ImageChain(client=client, db_name=name, snapshot_path=False)
+        imagechain.difficulty_bits = BLOCK_DIFFICULTY_BITS
+        if length:
+            imagechain.create_genesis_block(encoded(make_photo(CHAIN_IMAGE_SIZE, seed), "PNG"), "bench", "bench")
+        images = [encoded(make_photo(CHAIN_IMAGE_SIZE, seed + index), "PNG") for index in range(1, length)]
+        for start in range(0, len(images), 50):
+            imagechain.add_blocks(images[start:start + 50], {"signature": "bench", "message": "bench"})
+    return imagechain
+
+
+def bench_image_helpers(bench, imagechain, workdir, sizes):
+    """convert_to_png, embed_json_into_image and extract_json_from_image."""
+    for size in sizes:
+        params = {"size": size_label(size)}
+        source = os.path.join(workdir, f"photo_{size_label(size)}.jpg")
+        make_photo(size, seed=size[0]).save(source, "JPEG", quality=90)
+        bench.measure("convert_to_png", params, lambda: imagechain.convert_to_png(source))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            clean = imagechain.convert_to_png(source)
+        target = os.path.join(workdir, f"embedded_{size_label(size)}.png")
+
+        def fresh_copy():
+            shutil.copyfile(clean, target)
+            return target
+
+        bench.measure("embed_json_into_image", params, lambda path: imagechain.embed_json_into_image(path, SAMPLE_BLOCK), setup=fresh_copy)
+        bench.measure("extract_json_from_image", params, lambda: imagechain.extract_json_from_image(target))
+
+
+def bench_proof_of_work(bench, imagechain, difficulties):
+    counter = iter(range(1 << 30))
+    previous_hashes = lambda: f"{next(counter):064x}"
+    for bits in difficulties:
+        imagechain.difficulty_bits = bits
+        bench.measure("proof_of_work", {"difficulty_bits": bits}, imagechain.proof_of_work, setup=previous_hashes)
+    imagechain.difficulty_bits = BLOCK_DIFFICULTY_BITS
+
+
+def bench_add_block(bench, client, workdir, sizes, chain_lengths):
+    """add_block end to end, by image size (on the shortest chain) and by chain length."""
+    seeds = iter(range(10 ** 6, 10 ** 7))
+    cases = [(size, chain_lengths[0]) for size in sizes]
+    cases += [(sizes[0], length) for length in chain_lengths[1:]]
+    for size, length in cases:
+        imagechain = new_chain(client, f"bench_add_{size_label(size)}_{length}", length)
+
+        def new_upload():
+            # A new image every time, so deduplication never short-circuits
+            path = os.path.join(workdir, "upload.jpg")
+            make_photo(size, next(seeds)).save(path, "JPEG", quality=90)
+            return path
+
+        bench.measure(
+            "add_block",
+            {"size": size_label(size), "chain_length": length},
+            lambda path: imagechain.add_block(path, "bench", "bench"),
+            setup=new_upload
+        )
+
+
+def bench_verify_and_routes(bench, client, chain_lengths):
+    """verify_chain_real_time and the Flask / and /image/<id> routes."""
+    # app.py builds its ImageChain at import time; point it at the mongomock client first
+    import imagechain as imagechain_module
+    imagechain_module.MongoClient = lambda *args, **kwargs: client
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as app_module
+    test_client = app_module.app.test_client()
+
+    for length in chain_lengths:
+        imagechain = new_chain(client, f"bench_verify_{length}", length)
+        with contextlib.redirect_stdout(io.StringIO()):
+            imagechain.verify_chain_real_time()  # Record the checkpoint
+        bench.measure("verify_chain_real_time", {"chain_length": length, "full_audit": False}, imagechain.verify_chain_real_time)
+        bench.measure(
+            "verify_chain_real_time",
+            {"chain_length": length, "full_audit": True},
+            lambda: imagechain.verify_chain_real_time(full_audit=True)
+        )
+
+        app_module.imagechain = imagechain
+        bench.measure("GET /", {"chain_length": length}, lambda: _get(test_client, "/"))
+
+        file_id = imagechain.chain[-1]["file_id"]
+        bench.measure(
+            "GET /image/<id>",
+            {"chain_length": length, "cache": "cold"},
+            lambda _: _get(test_client, f"/image/{file_id}"),
+            setup=imagechain.image_cache.clear
+        )
+        bench.measure("GET /image/<id>", {"chain_length": length, "cache": "warm"}, lambda: _get(test_client, f"/image/{file_id}"))
+
+
+def bench_cold_start(bench, client, workdir, chain_lengths):
+    """A fresh ImageChain's first chain access, from MongoDB only and from a snapshot.
+
+    Reuses the chains bench_verify_and_routes built.
+    """
+    from imagechain import ImageChain
+
+    for length in chain_lengths:
+        name = f"bench_verify_{length}"
+        path = os.path.join(workdir, f"{name}.snapshot")
+        with contextlib.redirect_stdout(io.StringIO()):
+            ImageChain(client=client, db_name=name, snapshot_path=path).save_snapshot()
+        bench.measure(
+            "cold_start",
+            {"chain_length": length, "snapshot": False},
+            lambda: len(ImageChain(client=client, db_name=name, snapshot_path=False).chain)
+        )
+        bench.measure(
+            "cold_start",
+            {"chain_length": length, "snapshot": True},
+            lambda: len(ImageChain(client=client, db_name=name, snapshot_path=path).chain)
+        )
+
+
+def _get(test_client, path):
+    response = test_client.get(path)
+    response.get_data()  # Drain streamed bodies
+    if response.status_code != 200:
+        raise RuntimeError(f"GET {path} returned {response.status_code}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous_path, results):
+    """Print how each median changed against an earlier run's output file."""
+    with open(previous_path) as f:
+        previous = json.load(f)
+    key = lambda result: (result["name"], json.dumps(result["params"], sort_keys=True))
+    before = {key(result): result for result in previous["results"]}
+
+    print(f"\nCompared with {previous.get('commit') or previous_path}:")
+    for result in results:
+        old = before.get(key(result))
+        if old is None:
+            continue
+        change = (result["median_ms"] - old["median_ms"]) / old["median_ms"] * 100 if old["median_ms"] else 0
+        print(f"{result['name']:<24} {format_params(result['params']):<36} {old['median_ms']:10.2f} -> {result['median_ms']:10.2f} ms  ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ImageChain hot paths against mongomock.")
+    parser.add_argument("--quick", action="store_true", help="only the smallest image size and chain length")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark (default 5)")
+    parser.add_argument("--output", default="bench_output.txt", help="where to write the JSON results")
+    parser.add_argument("--compare", metavar="FILE", help="earlier results to compare against")
+    args = parser.parse_args(argv)
+
+    sizes = QUICK_IMAGE_SIZES if args.quick else IMAGE_SIZES
+    chain_lengths = QUICK_CHAIN_LENGTHS if args.quick else CHAIN_LENGTHS
+    difficulties = QUICK_DIFFICULTY_BITS if args.quick else DIFFICULTY_BITS
+
+    client = mongomock_client()
+    bench = Bench(args.repeat)
+    workdir = tempfile.mkdtemp(prefix="imagechain-bench-")
+    try:
+        imagechain = new_chain(client, "bench_helpers", 0)
+        bench_image_helpers(bench, imagechain, workdir, sizes)
+        bench_proof_of_work(bench, imagechain, difficulties)
+        bench_add_block(bench, client, workdir, sizes, chain_lengths)
+        bench_verify_and_routes(bench, client, chain_lengths)
+        bench_cold_start(bench, client, workdir, chain_lengths)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "quick": args.quick,
+        "repeat": args.repeat,
+        "results": bench.results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        compare(args.compare, bench.results)
+
+
+if __name__ == "__main__":
+    main()
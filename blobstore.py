@@ -0,0 +1,337 @@
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+import uuid
+from bson import ObjectId
+from bson.errors import InvalidId
+import gridfs
+from pymongo import ASCENDING
+
+READ_CHUNK_SIZE = 1024 * 1024
+_DIGEST = re.compile(r"[0-9a-f]{64}")
+_TAG_VALUE = re.compile(r"[A-Za-z0-9_-]{1,128}")
+
+
+class BlobStore:
+    """Where image bytes live. Blocks refer to their image by the blob id put() returns.
+
+    Backends store immutable blobs with optional string metadata (such as
+    the block's file_hash and the sha256 of the stored bytes), and find()
+    looks a blob up by one metadata value.
+    """
+
+    def put(self, data, filename=None, **metadata):
+        """Store bytes or a readable file object and return the blob id."""
+        writer = self.new_file(filename, **metadata)
+        try:
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                writer.write(data)
+            else:
+                for chunk in iter(lambda: data.read(READ_CHUNK_SIZE), b""):
+                    writer.write(chunk)
+        except Exception:
+            writer.abort()
+            raise
+        return writer.close()
+
+    def new_file(self, filename=None, **metadata):
+        """Return a writer (write/abort/close) whose close(**metadata) returns the blob id."""
+        raise NotImplementedError
+
+    def get(self, blob_id):
+        """Return a blob's bytes; raises KeyError if it does not exist."""
+        raise NotImplementedError
+
+    def open(self, blob_id):
+        """Open a blob for reading (read/seek/close and a length attribute)."""
+        raise NotImplementedError
+
+    def path(self, blob_id):
+        """Local file holding the blob, for zero-copy serving, or None."""
+        return None
+
+    def delete(self, blob_id):
+        raise NotImplementedError
+
+    def find(self, key, value):
+        """Return the id of a blob stored with metadata key == value, or None."""
+        raise NotImplementedError
+
+
+class _GridFSWriter:
+    def __init__(self, grid_in):
+        self.grid_in = grid_in
+
+    def write(self, data):
+        self.grid_in.write(data)
+
+    def abort(self):
+        self.grid_in.abort()
+
+    def close(self, **metadata):
+        for key, value in metadata.items():
+            setattr(self.grid_in, key, value)
+        self.grid_in.close()
+        return str(self.grid_in._id)
+
+
+class GridFSBlobStore(BlobStore):
+    """Blobs in a MongoDB GridFS bucket, identified by ObjectId strings."""
+
+    def __init__(self, db, collection="fs"):
+        self.fs = gridfs.GridFS(db, collection=collection)
+        self.files = db[f"{collection}.files"]
+        self.files.create_index([("sha256", ASCENDING)])
+        self.files.create_index([("file_hash", ASCENDING)])
+
+    def put(self, data, filename=None, **metadata):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            metadata.setdefault("sha256", hashlib.sha256(data).hexdigest())
+            data = bytes(data)
+        return str(self.fs.put(data, filename=filename, **metadata))
+
+    def new_file(self, filename=None, **metadata):
+        return _GridFSWriter(self.fs.new_file(filename=filename, **metadata))
+
+    def get(self, blob_id):
+        with self.open(blob_id) as grid_out:
+            return grid_out.read()
+
+    def open(self, blob_id):
+        try:
+            return self.fs.get(ObjectId(blob_id))
+        except (gridfs.NoFile, InvalidId, TypeError):
+            raise KeyError(blob_id)
+
+    def delete(self, blob_id):
+        self.fs.delete(ObjectId(blob_id))
+
+    def find(self, key, value):
+        document = self.files.find_one({key: value}, {"_id": 1})
+        return str(document["_id"]) if document is not None else None
+
+
+class MappedFile:
+    """Read-only file object over a memory-mapped local blob."""
+
+    def __init__(self, path):
+        self.name = path
+        with open(path, "rb") as f:
+            self.length = os.fstat(f.fileno()).st_size
+            # mmap cannot map an empty file
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.length else None
+        self._position = 0
+
+    def read(self, size=-1):
+        if self._map is None:
+            return b""
+        stop = self.length if size is None or size < 0 else min(self._position + size, self.length)
+        data = self._map[self._position:stop]
+        self._position = max(self._position, stop)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._position, os.SEEK_END: self.length}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+class _LocalWriter:
+    def __init__(self, store, metadata):
+        self.store = store
+        self.metadata = metadata
+        fd, self.temp_path = tempfile.mkstemp(dir=store.temp_dir, prefix=".blob-")
+        self.file = os.fdopen(fd, "wb")
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.file.write(data)
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+
+    def close(self, **metadata):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        digest = self.sha256.hexdigest()
+        path = self.store.object_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Same content, same name: replacing an existing copy is harmless
+        os.replace(self.temp_path, path)
+        for key, value in {**self.metadata, **metadata}.items():
+            self.store.tag(digest, key, value)
+        return digest
+
+
+class LocalBlobStore(BlobStore):
+    """Content-addressed blobs in a local directory, read through mmap.
+
+    A blob's id is the SHA-256 of its bytes and it lives at
+    objects/<id[:2]>/<id[2:4]>/<id>, so no directory grows too large. Blobs
+    are written to a temp file, fsynced and renamed into place, so readers
+    never see a partial blob. Metadata values are kept as symlinks under
+    tags/<key>/ pointing at the blob, which is what find() follows.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.temp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.temp_dir, exist_ok=True)
+
+    def object_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest[2:4], digest)
+
+    def _tag_path(self, key, value):
+        return os.path.join(self.root, "tags", key, value[-2:], value)
+
+    def new_file(self, filename=None, **metadata):
+        return _LocalWriter(self, metadata)
+
+    def tag(self, digest, key, value):
+        """Let find(key, value) return digest (values that are not plain names are skipped)."""
+        value = str(value)
+        if key == "sha256" or not _TAG_VALUE.fullmatch(key) or not _TAG_VALUE.fullmatch(value):
+            return
+        path = self._tag_path(key, value)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        os.symlink(os.path.relpath(self.object_path(digest), os.path.dirname(path)), temp_path)
+        os.replace(temp_path, path)
+
+    def get(self, blob_id):
+        with self.open(blob_id) as f:
+            return f.read()
+
+    def open(self, blob_id):
+        path = self.path(blob_id)
+        if path is None:
+            raise KeyError(blob_id)
+        try:
+            return MappedFile(path)
+        except FileNotFoundError:
+            raise KeyError(blob_id)
+
+    def path(self, blob_id):
+        if not _DIGEST.fullmatch(blob_id or ""):
+            return None
+        path = self.object_path(blob_id)
+        return path if os.path.exists(path) else None
+
+    def delete(self, blob_id):
+        try:
+            os.remove(self.object_path(blob_id))
+        except FileNotFoundError:
+            pass
+
+    def find(self, key, value):
+        if key == "sha256":
+            return value if self.path(value) else None
+        value = str(value)
+        if not _TAG_VALUE.fullmatch(key) or not _TAG_VALUE.fullmatch(value):
+            return None
+        try:
+            digest = os.path.basename(os.readlink(self._tag_path(key, value)))
+        except OSError:
+            return None
+        # Tags of deleted blobs are left dangling
+        return digest if self.path(digest) else None
+
+
+class _TeeWriter:
+    def __init__(self, writers):
+        self.writers = writers
+
+    def write(self, data):
+        for writer in self.writers:
+            writer.write(data)
+
+    def abort(self):
+        for writer in self.writers:
+            writer.abort()
+
+    def close(self, **metadata):
+        remote, local = self.writers
+        blob_id = remote.close(**metadata)
+        local.close(id=blob_id, **metadata)
+        return blob_id
+
+
+class TieredBlobStore(BlobStore):
+    """A LocalBlobStore in front of a shared remote store (GridFS).
+
+    The remote store is the system of record and hands out the blob ids.
+    New blobs are written to both; reads are served from the local copy,
+    tagged with the remote id, and a miss copies the blob down first, so
+    hot images never need a round trip to the remote store.
+    """
+
+    def __init__(self, local, remote):
+        self.local = local
+        self.remote = remote
+
+    def new_file(self, filename=None, **metadata):
+        return _TeeWriter([self.remote.new_file(filename, **metadata), self.local.new_file(filename, **metadata)])
+
+    def _local_id(self, blob_id):
+        digest = self.local.find("id", blob_id)
+        if digest is None:
+            with self.remote.open(blob_id) as source:
+                digest = self.local.put(source, id=blob_id)
+        return digest
+
+    def get(self, blob_id):
+        return self.local.get(self._local_id(blob_id))
+
+    def open(self, blob_id):
+        return self.local.open(self._local_id(blob_id))
+
+    def path(self, blob_id):
+        return self.local.path(self._local_id(blob_id))
+
+    def delete(self, blob_id):
+        digest = self.local.find("id", blob_id)
+        if digest is not None:
+            self.local.delete(digest)
+        self.remote.delete(blob_id)
+
+    def find(self, key, value):
+        return self.remote.find(key, value)
+
+
+def create_blob_store(db, kind=None, root=None):
+    """Build the configured backend: "gridfs" (default), "local" or "tiered".
+
+    Defaults come from IMAGECHAIN_BLOB_STORE and IMAGECHAIN_BLOB_DIR.
+    """
+    kind = kind or os.environ.get("IMAGECHAIN_BLOB_STORE", "gridfs")
+    root = root or os.environ.get("IMAGECHAIN_BLOB_DIR", "blobs")
+    if kind == "gridfs":
+        return GridFSBlobStore(db)
+    if kind == "local":
+        return LocalBlobStore(root)
+    if kind == "tiered":
+        return TieredBlobStore(LocalBlobStore(root), GridFSBlobStore(db))
+    raise ValueError(f"Unknown blob store {kind!r}")
@@ -0,0 +1,163 @@
+from collections.abc import MutableMapping
+import hashlib
+import json
+
+# Block fields in their stored (and blockchain.json) order; file_id is local and never embedded
+FIELDS = ("index", "file_hash", "previous_hash", "nonce", "timestamp", "signature", "message", "file_id")
+HEADER_HASH_PREFIX = b"\x00"  # Also the Merkle leaf prefix, so a header hash is its leaf hash
+
+_FIELD_SET = frozenset(FIELDS)
+
+
+def _dumps(document):
+    # The exact encoding embedded into images since the first block; do not change
+    return json.dumps(document, sort_keys=True).encode()
+
+
+class Block(MutableMapping):
+    """A chain block that behaves like the dict it replaces.
+
+    Fields live in slots rather than a per-block dict. The header hash used
+    as the Merkle leaf is computed once and cached (32 bytes per block); the
+    canonical encodings it is derived from are recomputed when asked for,
+    since keeping them would roughly double the memory of a loaded chain.
+    Any assignment other than file_id, which is not part of the header,
+    drops the cached hash. Keys other than FIELDS are kept in a side dict,
+    so documents round-trip unchanged.
+    """
+
+    __slots__ = FIELDS + ("_extra", "_header_hash")
+
+    def __init__(self, fields=(), **kwargs):
+        self._extra = None
+        self._header_hash = None
+        if isinstance(fields, Block):
+            for name in FIELDS:
+                if hasattr(fields, name):
+                    setattr(self, name, getattr(fields, name))
+            self._extra = dict(fields._extra) if fields._extra else None
+            self._header_hash = fields._header_hash
+        else:
+            for key, value in dict(fields).items():
+                self._set(key, value)
+        for key, value in kwargs.items():
+            self[key] = value
+
+    @classmethod
+    def from_dict(cls, document):
+        """Wrap a block read from MongoDB, a peer or blockchain.json (Blocks pass through)."""
+        return document if isinstance(document, cls) else cls(document)
+
+    @classmethod
+    def from_encoding(cls, encoding):
+        """Decode a block from its canonical encoding."""
+        return cls(json.loads(encoding))
+
+    def _set(self, key, value):
+        if key in _FIELD_SET:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        self._set(key, value)
+        self._invalidate(key)
+
+    def __delitem__(self, key):
+        if key in _FIELD_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+        self._invalidate(key)
+
+    def __iter__(self):
+        for name in FIELDS:
+            if hasattr(self, name):
+                yield name
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for name in FIELDS if hasattr(self, name)) + len(self._extra or ())
+
+    def __contains__(self, key):
+        if key in _FIELD_SET:
+            return hasattr(self, key)
+        return bool(self._extra) and key in self._extra
+
+    def __repr__(self):
+        return f"Block({self.to_dict()!r})"
+
+    def _invalidate(self, key):
+        if key != "file_id":
+            self._header_hash = None
+
+    def copy(self):
+        return Block(self)
+
+    def to_dict(self):
+        """Plain dict for MongoDB, JSON and msgpack, in the stored field order."""
+        document = {name: getattr(self, name) for name in FIELDS if hasattr(self, name)}
+        if self._extra:
+            document.update(self._extra)
+        return document
+
+    def header(self):
+        """The block as embedded in its image: everything but file_id."""
+        document = self.to_dict()
+        document.pop("file_id", None)
+        return document
+
+    @property
+    def encoding(self):
+        """Canonical JSON bytes of the whole block (sorted keys, file_id included)."""
+        return _dumps(self.to_dict())
+
+    @property
+    def header_bytes(self):
+        """Canonical JSON bytes of the header, exactly as embedded in the image."""
+        return _dumps(self.header())
+
+    @property
+    def header_hash(self):
+        """SHA-256 (raw digest) of the prefixed header bytes, the block's Merkle leaf."""
+        if self._header_hash is None:
+            self._header_hash = hashlib.sha256(HEADER_HASH_PREFIX + self.header_bytes).digest()
+        return self._header_hash
+
+
+def encode(block):
+    """Canonical encoding of a Block or plain dict block."""
+    if isinstance(block, Block):
+        return block.encoding
+    return _dumps(block)
+
+
+def encode_header(block):
+    """Canonical header encoding of a Block or plain dict block."""
+    if isinstance(block, Block):
+        return block.header_bytes
+    return _dumps({key: value for key, value in block.items() if key != "file_id"})
+
+
+def header_hash(block):
+    if isinstance(block, Block):
+        return block.header_hash
+    return hashlib.sha256(HEADER_HASH_PREFIX + encode_header(block)).digest()
@@ -0,0 +1,200 @@
+from collections import OrderedDict
+import os
+import tempfile
+import threading
+from metrics import metrics
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by the total size of its values.
+
+    sizeof(value) gives each entry's weight; by default every entry weighs 1,
+    so max_size is an entry count. Values heavier than max_size are not cached.
+    A named cache reports its hits, misses, evictions and size to metrics.
+    """
+
+    def __init__(self, max_size, sizeof=None, name=None):
+        self.name = name
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if name:
+            metrics.gauge("imagechain_cache_bytes", self._size, cache=name)
+            metrics.gauge("imagechain_cache_entries", self.__len__, cache=name)
+
+    def get(self, key):
+        """Return the cached value for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            self._count("imagechain_cache_hits_total")
+            return entry[0]
+        value = self._miss(key)
+        if value is None:
+            with self._lock:
+                self.misses += 1
+            self._count("imagechain_cache_misses_total")
+        return value
+
+    def _count(self, name, amount=1):
+        if self.name:
+            metrics.inc(name, amount, cache=self.name)
+
+    def _size(self):
+        return self.size
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                old_key, (old_value, old_size) = self._entries.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+                evicted.append((old_key, old_value))
+        if evicted:
+            self._count("imagechain_cache_evictions_total", len(evicted))
+        for old_key, old_value in evicted:
+            self._evicted(old_key, old_value)
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "size": self.size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _miss(self, key):
+        """Hook for subclasses to recover a value not held in memory."""
+        return None
+
+    def _evicted(self, key, value):
+        """Hook called (outside the lock) for each value evicted from memory."""
+
+
+class ImageCache(LRUCache):
+    """Byte-bounded LRU cache for immutable image bytes keyed by file_id.
+
+    With a spill_dir, images evicted from memory are written there (up to
+    spill_max_bytes, oldest first out) and promoted back on the next hit.
+    """
+
+    def __init__(self, max_bytes, spill_dir=None, spill_max_bytes=None, name=None):
+        super().__init__(max_bytes, sizeof=len, name=name)
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.spill_size = 0
+        self.spill_hits = 0
+        self._spilled = OrderedDict()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            with os.scandir(spill_dir) as entries:
+                for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+                    if entry.is_file() and not entry.name.startswith("."):
+                        self._spilled[entry.name] = entry.stat().st_size
+                        self.spill_size += entry.stat().st_size
+            # The cap may have been lowered since the files were written
+            self._remove_spilled(self._trim_spill())
+            if name:
+                metrics.gauge("imagechain_cache_spill_bytes", self._spill_size, cache=name)
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({"spilled": len(self._spilled), "spill_size": self.spill_size, "spill_hits": self.spill_hits})
+        return stats
+
+    def _spill_size(self):
+        return self.spill_size
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, key)
+
+    def _miss(self, key):
+        if not self.spill_dir:
+            return None
+        with self._lock:
+            if key not in self._spilled:
+                return None
+        try:
+            with open(self._spill_path(key), "rb") as f:
+                value = f.read()
+        except OSError:
+            return None
+        with self._lock:
+            self.spill_hits += 1
+        self._count("imagechain_cache_spill_hits_total")
+        self.put(key, value)
+        return value
+
+    def _evicted(self, key, value):
+        if not self.spill_dir:
+            return
+        if self.spill_max_bytes is not None and len(value) > self.spill_max_bytes:
+            return
+        with self._lock:
+            if key in self._spilled:
+                return
+        # Write atomically so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=self.spill_dir, prefix=".spill-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(value)
+        os.replace(temp_path, self._spill_path(key))
+
+        with self._lock:
+            previous = self._spilled.pop(key, None)
+            if previous is not None:
+                # Spilled by another thread meanwhile; it wrote the same bytes
+                self.spill_size -= previous
+            self._spilled[key] = len(value)
+            self.spill_size += len(value)
+            trimmed = self._trim_spill()
+        self._count("imagechain_cache_spills_total")
+        self._remove_spilled(trimmed)
+
+    def _trim_spill(self):
+        """Forget the oldest spilled images over spill_max_bytes; returns their keys."""
+        trimmed = []
+        while self.spill_max_bytes is not None and self.spill_size > self.spill_max_bytes:
+            old_key, old_size = self._spilled.popitem(last=False)
+            self.spill_size -= old_size
+            trimmed.append(old_key)
+        return trimmed
+
+    def _remove_spilled(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._spill_path(key))
+            except OSError:
+                pass
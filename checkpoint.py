@@ -0,0 +1,79 @@
+from datetime import datetime
+import hashlib
+import logging
+from block import encode
+from snapshot import chain_encodings
+
+GENESIS_DIGEST = "0"
+
+logger = logging.getLogger(__name__)
+
+
+def block_digest(previous_digest, block):
+    """Fold a block into the running digest of a verified chain prefix."""
+    return hashlib.sha256(previous_digest.encode() + encode(block)).hexdigest()
+
+
+def _fold(encodings, digest=GENESIS_DIGEST):
+    for encoding in encodings:
+        digest = hashlib.sha256(digest.encode() + encoding).hexdigest()
+    return digest
+
+
+class VerificationCheckpoint:
+    """Remembers how far the chain has been verified in MongoDB.
+
+    The checkpoint stores the index of the last verified block together with
+    the digest of the verified prefix, so a later verification only has to
+    re-hash the stored block metadata instead of re-decoding every image.
+    The prefix digest last computed for an in-memory chain is remembered as
+    well, so checking the same chain again only hashes the blocks added since.
+    """
+
+    def __init__(self, collection, key="imagechain"):
+        self.collection = collection
+        self.key = key
+        self._folded = None  # (chain, block count, digest) last computed in this process
+
+    def load(self):
+        """Return (last verified index, prefix digest), or (-1, "0") if unset."""
+        checkpoint = self.collection.find_one({"_id": self.key})
+        if not checkpoint:
+            return -1, GENESIS_DIGEST
+        return checkpoint["index"], checkpoint["digest"]
+
+    def save(self, index, digest, chain=None):
+        """Record that blocks 0..index (of chain, if given) are verified and hash to digest."""
+        if chain is not None:
+            self._folded = (chain, index + 1, digest)
+        self.collection.update_one(
+            {"_id": self.key},
+            {"$set": {"index": index, "digest": digest, "verified_at": str(datetime.now())}},
+            upsert=True
+        )
+
+    def clear(self):
+        """Forget the checkpoint so the next verification is a full audit."""
+        self._folded = None
+        self.collection.delete_one({"_id": self.key})
+
+    def resume_point(self, chain):
+        """Return (start index, prefix digest) to continue verifying chain from.
+
+        Falls back to (0, "0") when there is no checkpoint or when the stored
+        prefix no longer matches the chain, which forces a full re-verify.
+        """
+        index, digest = self.load()
+        if index < 0 or index >= len(chain):
+            return 0, GENESIS_DIGEST
+        # Continue from the prefix already hashed for this very chain object
+        start, folded = 0, GENESIS_DIGEST
+        if self._folded is not None and self._folded[0] is chain and self._folded[1] <= index + 1:
+            _, start, folded = self._folded
+        folded = _fold(chain_encodings(chain, index + 1, start), folded)
+        if folded != digest:
+            self._folded = None
+            logger.warning("⚠️ Checkpoint at block %d does not match the stored chain, re-verifying from genesis.", index)
+            return 0, GENESIS_DIGEST
+        self._folded = (chain, index + 1, digest)
+        return index + 1, digest
@@ -9,15 +9,6 @@ PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
 
 IPFS_API_URL = "http://127.0.0.1:5001/api/v0/add"
 
-def str_to_bin(data):
-    """Convert string to binary format"""
-    return ''.join(format(ord(char), '08b') for char in data)
-
-def bin_to_str(binary_data):
-    """Convert binary format to string"""
-    chars = [binary_data[i:i+8] for i in range(0, len(binary_data), 8)]
-    return ''.join(chr(int(char, 2)) for char in chars if int(char, 2) != 0)
-
 def embed_json(image_path, json_data, output_path):
     """Embed JSON data into an image using LSB steganography"""
     # Convert to absolute path
@@ -35,21 +26,18 @@ def embed_json(image_path, json_data, output_path):
         raise ValueError(f"❌ Unable to read image file: {image_path}")
 
     json_str = json.dumps(json_data) + "###"  # Append end marker
-    json_bin = str_to_bin(json_str)  # Convert JSON to binary
+    json_bits = np.unpackbits(np.frombuffer(json_str.encode(), dtype=np.uint8))  # Convert JSON to binary
 
     height, width, channels = img.shape
     total_pixels = height * width * 3  # RGB channels
 
-    if len(json_bin) > total_pixels:
+    if len(json_bits) > total_pixels:
         raise ValueError("❌ JSON data is too large to fit inside the image.")
 
-    index = 0
-    for row in range(height):
-        for col in range(width):
-            for channel in range(3):  # Iterate over RGB channels
-                if index < len(json_bin):
-                    img[row, col, channel] = (img[row, col, channel] & ~1) | int(json_bin[index])
-                    index += 1
+    # Write the bits into the LSBs of the leading channel values in one pass
+    channel_values = img[:, :, :3].reshape(-1)
+    channel_values[:len(json_bits)] = (channel_values[:len(json_bits)] & 0xFE) | json_bits
+    img[:, :, :3] = channel_values.reshape(height, width, 3)
 
     cv2.imwrite(output_path, img)
     print(f"✅ JSON data embedded successfully in {output_path}")
@@ -69,17 +57,16 @@ def extract_json(image_path):
     if img is None:
         raise ValueError(f"❌ Unable to read image file: {image_path}")
 
-    height, width, channels = img.shape
-    binary_data = ""
-
-    # Extract LSBs from the image
-    for row in range(height):
-        for col in range(width):
-            for channel in range(3):  # Iterate over RGB channels
-                binary_data += str(img[row, col, channel] & 1)
-
-    # Convert binary data to string
-    json_str = bin_to_str(binary_data)
+    # Extract LSBs from the image a chunk at a time, stopping at the end marker
+    channel_values = img[:, :, :3].reshape(-1)
+    usable_bits = len(channel_values) - len(channel_values) % 8
+    chunk_bits = 8 * 4096
+    json_str = ""
+    for start in range(0, usable_bits, chunk_bits):
+        chunk = channel_values[start:min(start + chunk_bits, usable_bits)] & 1
+        json_str += np.packbits(chunk).tobytes().replace(b"\x00", b"").decode("latin-1")
+        if "###" in json_str:
+            break
 
     # Find the end marker and extract JSON
     end_marker = "###"
@@ -0,0 +1,139 @@
+from collections import namedtuple
+from miner import check_proof
+
+# The fields needed to check a block's place in the chain, without its image
+BlockHeader = namedtuple("BlockHeader", ["index", "file_hash", "previous_hash", "nonce", "file_id"])
+
+
+def _check_link(index, previous_hash, nonce, previous, difficulty_bits):
+    if previous is None:
+        if index != 0 or previous_hash != "0":
+            return "Genesis block must have index 0 and previous_hash \"0\""
+        return None
+
+    if index != previous.index + 1:
+        return f"Block {index} does not follow block {previous.index}"
+    if previous_hash != previous.file_hash:
+        return f"Block {index} previous_hash does not match block {previous.index}'s file_hash"
+    if not check_proof(previous_hash, nonce, difficulty_bits):
+        return f"Block {index} nonce does not satisfy the proof of work"
+    return None
+
+
+def to_header(block):
+    return BlockHeader(block["index"], block["file_hash"], block["previous_hash"], block["nonce"], block.get("file_id"))
+
+
+def check_header(header, previous, difficulty_bits):
+    """Check that header can follow previous (None for the genesis block).
+
+    Only the block's JSON fields are used, so this needs no image: index
+    continuity, the previous_hash link and the proof-of-work nonce. The
+    genesis block predates mining (its nonce is 0) and is not PoW-checked.
+    Returns an error message, or None if the header is valid.
+    """
+    return _check_link(
+        header.get("index"),
+        header.get("previous_hash"),
+        header.get("nonce"),
+        to_header(previous) if previous is not None else None,
+        difficulty_bits
+    )
+
+
+class HeaderIndex:
+    """Compact in-memory headers of the chain, looked up by index, file_hash or file_id.
+
+    update() follows the in-memory chain incrementally, and validate()
+    remembers how far it has checked, so structural checks and "is this image
+    already on the chain?" lookups stay cheap however long the chain gets.
+    The blocks of a chain loaded from a snapshot are looked up through the
+    snapshot's tables and only decoded when asked for, so indexing them
+    costs nothing up front.
+    """
+
+    def __init__(self, blocks=()):
+        self._validated_bits = None
+        self.clear()
+        self.update(blocks)
+
+    def __len__(self):
+        return self._base + len(self.headers)
+
+    @property
+    def tip(self):
+        return self.get(len(self) - 1)
+
+    def get(self, index):
+        if not 0 <= index < len(self):
+            return None
+        if index < self._base:
+            return to_header(self._snapshot.block(index))
+        return self.headers[index - self._base]
+
+    def find(self, file_hash):
+        """Return the header of the block holding the image with file_hash, or None."""
+        return self._find("file_hash", file_hash, self.by_hash)
+
+    def find_file_id(self, file_id):
+        """Return the header of the block whose stored image is file_id, or None."""
+        return self._find("file_id", file_id, self.by_file_id)
+
+    def _find(self, field, value, headers):
+        if self._base:
+            index = self._snapshot.find(field, value)
+            if index is not None:
+                return self.get(index)
+        return headers.get(value)
+
+    def __contains__(self, file_hash):
+        return self.find(file_hash) is not None
+
+    def append(self, block):
+        header = to_header(block)
+        self.headers.append(header)
+        self.by_hash.setdefault(header.file_hash, header)
+        if header.file_id is not None:
+            self.by_file_id.setdefault(header.file_id, header)
+
+    def update(self, chain):
+        """Bring the index in line with chain, rebuilding it if the chain was replaced."""
+        count = len(self)
+        if count > len(chain) or (count and chain[count - 1]["file_hash"] != self.tip.file_hash):
+            self.clear()
+        snapshot = getattr(chain, "snapshot", None)
+        if not len(self) and snapshot is not None:
+            self._snapshot = snapshot
+            self._base = len(snapshot)
+        for block in chain[len(self):]:
+            self.append(block)
+
+    def clear(self):
+        self.headers = []  # Headers of the blocks after the snapshot (if any)
+        self.by_hash = {}
+        self.by_file_id = {}
+        self._snapshot = None
+        self._base = 0
+        self._validated = 0
+        self._errors = {}
+
+    def validate(self, difficulty_bits):
+        """Check linkage, index continuity and nonces; returns {index: error message}.
+
+        Headers checked by an earlier call with the same difficulty are not
+        checked again.
+        """
+        if difficulty_bits != self._validated_bits:
+            self._validated = 0
+            self._validated_bits = difficulty_bits
+            self._errors = {}
+
+        previous = self.get(self._validated - 1) if self._validated else None
+        for position in range(self._validated, len(self)):
+            header = self.get(position)
+            error = _check_link(header.index, header.previous_hash, header.nonce, previous, difficulty_bits)
+            if error:
+                self._errors[header.index] = error
+            previous = header
+        self._validated = len(self)
+        return dict(self._errors)
@@ -0,0 +1,102 @@
+import hashlib
+import time
+from tempfile import SpooledTemporaryFile
+from PIL import Image
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+READ_CHUNK_SIZE = 1024 * 1024
+SPOOL_MAX_BYTES = 16 * 1024 * 1024  # Uploads larger than this spill to a temp file
+
+
+class HashingWriter:
+    """Write-only file object that hashes everything written to it.
+
+    Writes are forwarded to target when one is given, so an encoder can stream
+    into GridFS and be hashed in the same pass; target_seconds is the time
+    spent inside the target's writes.
+    """
+
+    def __init__(self, target=None):
+        self.target = target
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.target_seconds = 0.0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        if self.target is not None:
+            start = time.perf_counter()
+            self.target.write(data)
+            self.target_seconds += time.perf_counter() - start
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+def spool_upload(stream):
+    """Copy an upload stream into a SpooledTemporaryFile positioned at its start."""
+    spool = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    for chunk in iter(lambda: stream.read(READ_CHUNK_SIZE), b""):
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def upload_digest(source):
+    """SHA-256 of the raw bytes of a path or seekable stream, read in chunks.
+
+    Streams are left at the position they were in.
+    """
+    sha256 = hashlib.sha256()
+    if isinstance(source, str):
+        with open(source, "rb") as stream:
+            for chunk in iter(lambda: stream.read(READ_CHUNK_SIZE), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    start = source.tell()
+    for chunk in iter(lambda: source.read(READ_CHUNK_SIZE), b""):
+        sha256.update(chunk)
+    source.seek(start)
+    return sha256.hexdigest()
+
+
+def load_image(source):
+    """Decode an image (path or seekable stream) once and compute its file_hash.
+
+    file_hash is the SHA-256 of the image's PNG encoding before anything is
+    embedded: the file's own bytes for PNG uploads, otherwise the PNG that
+    convert_to_png would have written, hashed while it is encoded and never
+    stored. Returns (decoded image, file_hash).
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as stream:
+            return _load_stream(stream, source.lower().endswith(".png"))
+
+    start = source.tell()
+    is_png = source.read(len(PNG_SIGNATURE)) == PNG_SIGNATURE
+    source.seek(start)
+    return _load_stream(source, is_png)
+
+
+def _load_stream(stream, is_png):
+    if is_png:
+        start = stream.tell()
+        sha256 = hashlib.sha256()
+        for chunk in iter(lambda: stream.read(READ_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+        stream.seek(start)
+        image = Image.open(stream)
+        image.load()
+        return image, sha256.hexdigest()
+
+    image = Image.open(stream)
+    image.load()
+    sink = HashingWriter()
+    image.save(sink, "PNG")
+    return image, sink.hexdigest()
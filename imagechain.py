@@ -1,192 +1,769 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
-import hashlib
+from functools import cached_property
 import json
+import logging
 import os
-from bson import ObjectId
+import shutil
+import threading
+import time
 from pymongo import MongoClient
-import gridfs
 from PIL import Image
-from stegano import lsb
+import lsb_codec
+from miner import INLINE_BITS, Miner
+from block import Block, encode, encode_header
+from blobstore import create_blob_store
+from checkpoint import GENESIS_DIGEST, VerificationCheckpoint, block_digest
+from verifier import INVALID_HEADER, ChainVerifier
+from storage import BlockStore, ChainConflictError, JobStore, UploadIndex
+from cache import ImageCache, LRUCache
+from image_pipeline import HashingWriter, load_image, upload_digest
+from headers import HeaderIndex, check_header
+from merkle import MerkleTree
+from renditions import RenditionStore
+from snapshot import SNAPSHOT_INTERVAL, SnapshotChain, chain_encodings, open_snapshot, write_snapshot
+from metrics import metrics
+
+IMAGE_CACHE_BYTES = 256 * 1024 * 1024
+IMAGE_SPILL_BYTES = 2 * 1024 * 1024 * 1024  # Disk used by IMAGECHAIN_CACHE_DIR unless IMAGECHAIN_CACHE_DIR_BYTES is set
+METADATA_CACHE_ENTRIES = 100000
+CONFLICT_ATTEMPTS = 3  # Times a block is built again after another writer moved the tip
+
+logger = logging.getLogger(__name__)
 
 class ImageChain:
-    def __init__(self):
-        # Connect to MongoDB
-        self.client = MongoClient("mongodb://localhost:27017/")
-        self.db = self.client["imagechain_db"]  # Database
-        self.fs = gridfs.GridFS(self.db)  # GridFS instance
-        
-        self.chain = self.load_from_mongodb()
-        self.difficulty = 4
+    """The chain of images, its MongoDB storage and the in-memory indexes over it.
+
+    Nothing is connected or loaded when an ImageChain is built: MongoDB, the
+    blob store and the chain itself are set up on first use, so importing
+    the Flask app or starting a P2P node is instant. The chain is loaded
+    from a memory-mapped snapshot plus the blocks stored after it, and a new
+    snapshot is written every SNAPSHOT_INTERVAL blocks.
+    """
+
+    def __init__(self, client=None, db_name="imagechain_db", blobs=None, snapshot_path=None):
+        # MongoDB client (or the given one, e.g. a mongomock one for benchmarks), connected on first use
+        self._client = client
+        self.db_name = db_name
+        if blobs is not None:
+            self.blobs = blobs
+        # Pass snapshot_path=False (or set IMAGECHAIN_SNAPSHOT_DIR to "") to load the whole chain from MongoDB
+        if snapshot_path is None:
+            snapshot_dir = os.environ.get("IMAGECHAIN_SNAPSHOT_DIR", "snapshots")
+            snapshot_path = os.path.join(snapshot_dir, f"{db_name}.snapshot") if snapshot_dir else False
+        self.snapshot_path = snapshot_path
+        self.snapshot_count = 0  # Blocks in the last snapshot written or loaded
+        self._snapshot_checked = False  # Whether the loaded snapshot was compared with MongoDB
+
+        # Stored images are immutable, so their bytes and embedded JSON can be cached
+        self.image_cache = ImageCache(
+            IMAGE_CACHE_BYTES,
+            spill_dir=os.environ.get("IMAGECHAIN_CACHE_DIR"),
+            spill_max_bytes=int(os.environ.get("IMAGECHAIN_CACHE_DIR_BYTES", IMAGE_SPILL_BYTES)),
+            name="images"
+        )
+        self.metadata_cache = LRUCache(METADATA_CACHE_ENTRIES, name="metadata")
+        self.eager_renditions = os.environ.get("IMAGECHAIN_EAGER_RENDITIONS") == "1"
+
+        self._chain = None
+        self.headers = HeaderIndex()  # Compact headers for cheap lookups and checks, filled on first use
+        self.merkle = MerkleTree()  # Built on first use, then extended block by block
+        self.difficulty = 4  # Leading zero hex digits of the proof-of-work hash
+        self.difficulty_bits = None  # Optional bit-level target overriding difficulty
+        self.miner = Miner(
+            workers=int(os.environ.get("IMAGECHAIN_MINER_WORKERS", 0)) or None,
+            inline_bits=int(os.environ.get("IMAGECHAIN_MINER_INLINE_BITS", INLINE_BITS))
+        )
+        self.last_mining_result = None
+        self.verify_processes = None  # Defaults to one worker per CPU
         self.peers = set()
+        self.lock = threading.RLock()  # Serializes appends to the chain tip; never held while mining
+        self._index_lock = threading.Lock()  # Guards the header index and Merkle tree, so readers skip self.lock
+
+    @cached_property
+    def client(self):
+        return self._client if self._client is not None else MongoClient("mongodb://localhost:27017/")
+
+    @cached_property
+    def db(self):
+        return self.client[self.db_name]
+
+    @cached_property
+    def blobs(self):
+        # Image bytes: GridFS, a local content-addressed directory or both (IMAGECHAIN_BLOB_STORE)
+        return create_blob_store(self.db)
+
+    @cached_property
+    def checkpoint(self):
+        return VerificationCheckpoint(self.db["verification"])
+
+    @cached_property
+    def store(self):
+        return BlockStore(self.db)  # One document per block
+
+    @cached_property
+    def uploads(self):
+        return UploadIndex(self.db)  # Raw upload digest -> file_hash, for deduplication
+
+    @cached_property
+    def jobs(self):
+        return JobStore(self.db)  # Upload job status, readable from every worker
+
+    @cached_property
+    def renditions(self):
+        return RenditionStore(self)  # Thumbnails in their own GridFS bucket
+
+    @property
+    def chain(self):
+        """The in-memory chain, loaded on first access."""
+        if self._chain is None:
+            with self.lock:
+                if self._chain is None:
+                    self._chain = self.load_chain()
+        return self._chain
+
+    @chain.setter
+    def chain(self, chain):
+        self._chain = chain
+
+    def load_chain(self):
+        """Load the chain from the snapshot plus the blocks stored after it.
+
+        The snapshot is only used if its last block is still the stored block
+        at that index; otherwise the whole chain is read from MongoDB (and a
+        fresh snapshot written).
+        """
+        snapshot = open_snapshot(self.snapshot_path) if self.snapshot_path else None
+        if snapshot is not None and len(snapshot):
+            tip = self.store.get(len(snapshot) - 1)
+            if tip is not None and tip.encoding == snapshot.encoding(len(snapshot) - 1):
+                tail = self.store.range(len(snapshot))
+                self.snapshot_count = len(snapshot)
+                self._snapshot_checked = False
+                logger.info("⚡ Loaded %d blocks from %s and %d from MongoDB", len(snapshot), self.snapshot_path, len(tail))
+                return SnapshotChain(snapshot, tail)
+            logger.warning("⚠️ Snapshot %s does not match the stored chain, loading the chain from MongoDB.", self.snapshot_path)
+
+        chain = self.load_from_mongodb()
+        self.snapshot_count = 0
+        self.maybe_snapshot(chain)
+        return chain
+
+    def reload_chain(self):
+        """Replace the in-memory chain with the stored one (e.g. after another writer moved the tip)."""
+        with self.lock:
+            self._chain = self.load_chain()
+        return self._chain
+
+    def catch_up(self):
+        """Append the blocks other writers stored after the in-memory tip; returns how many.
+
+        If the stored chain no longer extends the in-memory one, it is reloaded instead.
+        """
+        with self.lock:
+            chain = self.chain
+            if chain:
+                stored = self.store.get(len(chain) - 1)
+                if stored is None or stored["file_hash"] != chain[-1]["file_hash"]:
+                    count = len(chain)
+                    return len(self.reload_chain()) - count
+            added = self.store.range(len(chain))
+            chain.extend(added)
+            return len(added)
+
+    def check_loaded_chain(self, stored=None):
+        """Compare the in-memory chain with the blocks stored in MongoDB; returns the indexes that differ.
+
+        load_chain only checks a snapshot's last block, so verification calls
+        this before trusting a snapshot-loaded chain. By default the snapshot
+        blocks the verification checkpoint covers are trusted if their digest
+        matches it (hashing the mapped encodings, without reading MongoDB),
+        and only the snapshot blocks after the checkpoint are read back; a
+        full audit passes the whole stored chain. If any block differs, the
+        snapshot is discarded and the chain reloaded from MongoDB, so the
+        chain, its checkpoint digest, Merkle root and tip all match what is
+        stored again.
+        """
+        with self.lock:
+            chain = self.chain
+            start = 0
+            if stored is None:
+                count = len(chain.snapshot) if isinstance(chain, SnapshotChain) else 0
+                if count:
+                    start = min(self.checkpoint.resume_point(chain)[0], count)
+                stored = self.store.range(start, count) if start < count else []
+            else:
+                count = len(chain)
+            count = min(count, len(chain))
+            differing = [
+                block["index"]
+                for block, encoding in zip(stored, chain_encodings(chain, min(count, start + len(stored)), start))
+                if block.encoding != encoding
+            ]
+            # Blocks held in memory but missing from MongoDB
+            differing.extend(range(start + len(stored), count))
+            self._snapshot_checked = True
+            if not differing:
+                return differing
+
+            logger.warning("⚠️ %d blocks of the loaded chain differ from MongoDB (first: %d), reloading the chain.", len(differing), differing[0])
+            if self.snapshot_path:
+                # The snapshot was taken from the same data, so it is stale too
+                try:
+                    os.remove(self.snapshot_path)
+                except FileNotFoundError:
+                    pass
+            with self._index_lock:
+                self.headers.clear()
+                self.merkle = MerkleTree()
+            self._chain = self.load_chain()
+            self._snapshot_checked = True
+            return differing
+
+    def save_snapshot(self, chain=None):
+        """Write chain (default: the in-memory chain) to the snapshot file; returns its block count.
+
+        Blocks appended while it is written are left for the next snapshot.
+        """
+        count = write_snapshot(self.snapshot_path, self.chain if chain is None else chain)
+        self.snapshot_count = count
+        logger.info("📸 Wrote a snapshot of %d blocks to %s", count, self.snapshot_path)
+        return count
+
+    def maybe_snapshot(self, chain=None):
+        """Write a snapshot if SNAPSHOT_INTERVAL blocks were added since the last one."""
+        chain = self._chain if chain is None else chain
+        if not self.snapshot_path or chain is None or len(chain) - self.snapshot_count < SNAPSHOT_INTERVAL:
+            return
+        try:
+            self.save_snapshot(chain)
+        except OSError as e:
+            logger.warning("⚠️ Could not write snapshot %s: %s", self.snapshot_path, e)
 
     def load_from_mongodb(self):
         """Retrieve the latest blockchain from MongoDB."""
-        blockchain_data = self.db["blockchain"].find_one({"_id": "imagechain"})
-        return blockchain_data["chain"] if blockchain_data else []
-    
-    def update_mongodb(self):
-        """Update the blockchain in MongoDB."""
-        self.db["blockchain"].update_one(
-            {"_id": "imagechain"},
-            {"$set": {"chain": self.chain}},
-            upsert=True
-        )
+        if not self.store.migrated():
+            # One-shot migration from the old single-document layout
+            self.store.migrate_from_single_document()
+        return self.store.load_all()
+
+    def save_block(self, block):
+        """Append a block to MongoDB and the in-memory chain.
+
+        If the block no longer extends the stored tip (another writer got there
+        first), its image is removed from the blob store and ChainConflictError is raised.
+        """
+        try:
+            with metrics.timer("imagechain_block_stage_seconds", stage="commit"):
+                self.store.append(block)
+        except ValueError:
+            self.discard_image(block["file_id"])
+            raise
+        self.chain.append(Block.from_dict(block))
+        metrics.inc("imagechain_blocks_added_total")
+        self.maybe_snapshot()
+
+    def discard_image(self, file_id):
+        """Remove a stored image whose block never made it onto the chain, with its eager renditions."""
+        self.blobs.delete(file_id)
+        if self.eager_renditions:
+            self.renditions.delete(file_id)
 
     def save_image_to_mongodb(self, file_path):
-        """Store image in MongoDB GridFS and return the file ID."""
+        """Store image in the blob store and return the file ID."""
         with open(file_path, "rb") as f:
-            file_id = self.fs.put(f, filename=file_path)
-        return str(file_id)  # Return as a string
+            return self.blobs.put(f, filename=file_path)
+
+    def read_image_from_mongodb(self, file_id, use_cache=True):
+        """Retrieve an image's bytes from the blob store (through the image cache)."""
+        if use_cache:
+            cached = self.image_cache.get(file_id)
+            if cached is not None:
+                return cached
+        image_bytes = self.blobs.get(file_id)
+        if use_cache:
+            self.image_cache.put(file_id, image_bytes)
+        return image_bytes
+
+    def open_image_from_mongodb(self, file_id):
+        """Open a stored image for streaming, chunked reads."""
+        return self.blobs.open(file_id)
+
+    def image_path(self, file_id):
+        """Local file holding a stored image (local and tiered blob stores), or None."""
+        return self.blobs.path(file_id)
 
     def get_image_from_mongodb(self, file_id, output_path):
-        """Retrieve an image from MongoDB GridFS and save it locally."""
-        file_id = ObjectId(file_id)  # Ensure ObjectId format
-        file_data = self.fs.get(file_id).read()
-        with open(output_path, "wb") as f:
-            f.write(file_data)
+        """Retrieve a stored image and save it locally."""
+        with self.open_image_from_mongodb(file_id) as grid_out, open(output_path, "wb") as f:
+            shutil.copyfileobj(grid_out, f)
         return output_path
 
-    def create_genesis_block(self, file_path):
-        """Create the first block with an image stored in MongoDB."""
-        signature = input("Enter your signature for the genesis block: ")
-        message = input("Enter the message to hide in the image: ")
-        png_path = self.convert_to_png(file_path)
-
-        # Hash the image
-        with open(png_path, "rb") as f:
-            image_hash = hashlib.sha256(f.read()).hexdigest()
-
-        # Create JSON block (without file_id)
-        genesis_block = {
-            "index": 0,
-            "file_hash": image_hash,
-            "previous_hash": "0",
-            "nonce": 0,
-            "timestamp": str(datetime.now()),
-            "signature": signature,
-            "message": message,
-        }
-
-        # Embed JSON data into the image
-        self.embed_json_into_image(png_path, genesis_block)
-
-        # Store Image in MongoDB
-        file_id = self.save_image_to_mongodb(png_path)
-
-        # Add file_id to the block (not part of the embedded JSON)
-        genesis_block["file_id"] = file_id
-
-        self.chain.append(genesis_block)
-        self.update_mongodb()
-
-    def add_block(self, file_path):
-        """Add a new block containing an image's MongoDB ID."""
-        signature = input("Enter your signature for the new block: ")
-        message = input("Enter the message to hide in the image: ")
-        png_path = self.convert_to_png(file_path)
+    def image_etag(self, file_id):
+        """Return a strong ETag for a stored image: its block's file_hash."""
+        header = self.header_index().find_file_id(file_id)
+        if header is not None:
+            return header.file_hash
+        block = self.store.find_by_file_id(file_id)
+        return block["file_hash"] if block else file_id
 
-        # Hash the image
-        with open(png_path, "rb") as f:
-            image_hash = hashlib.sha256(f.read()).hexdigest()
-
-        previous_hash = self.chain[-1]["file_hash"] if self.chain else "0"
+    def create_genesis_block(self, source, signature=None, message=None):
+        """Create the first block with an image stored in MongoDB."""
+        if signature is None:
+            signature = input("Enter your signature for the genesis block: ")
+        if message is None:
+            message = input("Enter the message to hide in the image: ")
+        digest = self.upload_digest(source)
+        existing = self.find_block_by_digest(digest)
+        if existing is not None:
+            return self._duplicate(existing)
+        image, image_hash = self.prepare_image(source)
+
+        with self.lock:
+            existing = self.find_block_by_hash(image_hash)
+            if existing is not None:
+                self.uploads.add(digest, image_hash)
+                return self._duplicate(existing)
+
+            # Create JSON block (without file_id)
+            genesis_block = Block(
+                index=0,
+                file_hash=image_hash,
+                previous_hash="0",
+                nonce=0,
+                timestamp=str(datetime.now()),
+                signature=signature,
+                message=message,
+            )
+            self.seal_block(image, genesis_block, _source_name(source))
+            self.save_block(genesis_block)
+            self.uploads.add(digest, image_hash)
+        return genesis_block
+
+    def add_block(self, source, signature=None, message=None):
+        """Add a new block containing an image's MongoDB ID.
+
+        source is a file path or a seekable stream; the image is decoded once
+        and never written to local disk.
+        """
+        if signature is None:
+            signature = input("Enter your signature for the new block: ")
+        if message is None:
+            message = input("Enter the message to hide in the image: ")
+        # An image that is already on the chain is not mined or stored again
+        digest = self.upload_digest(source)
+        existing = self.find_block_by_digest(digest)
+        if existing is not None:
+            return self._duplicate(existing)
+        image, image_hash = self.prepare_image(source)
+
+        attempt = 1
+        while True:
+            with self.lock:
+                existing = self.find_block_by_hash(image_hash)
+                if existing is not None:
+                    self.uploads.add(digest, image_hash)
+                    return self._duplicate(existing)
+                tip = self.chain[-1] if self.chain else None
+
+            # Mine and store the image without the lock, then save only if the tip has not moved
+            new_block = self.build_block(image_hash, signature, message, tip)
+            self.seal_block(image, new_block, _source_name(source))
+            with self.lock:
+                current = self.chain[-1] if self.chain else None
+                if (current and current["file_hash"]) != (tip and tip["file_hash"]):
+                    # Another caller in this process got there first: build on its block
+                    self.discard_image(new_block["file_id"])
+                    continue
+                try:
+                    self.save_block(new_block)
+                except ChainConflictError as e:
+                    # Another process moved the stored tip: catch up and mine again
+                    if attempt == CONFLICT_ATTEMPTS:
+                        raise
+                    attempt += 1
+                    logger.warning("⚠️ %s; reloading the chain", e)
+                    self.reload_chain()
+                    continue
+                self.uploads.add(digest, image_hash)
+            return new_block
+
+    def add_blocks(self, sources, metadata=None, workers=4):
+        """Add many images (paths or file-like streams) as consecutive blocks.
+
+        Images are decoded a few at a time (no more than workers * 2 are held
+        decoded at once), chained in the given order, embedded and stored in
+        parallel and committed with one bulk insert. metadata is either one
+        dict of signature/message for every image or a list with one dict per
+        image. Returns one block per source; images already on the chain (or
+        repeated in the batch) get the existing block instead of a new one.
+        If another writer moves the tip first, the chain is reloaded and the
+        batch built again, up to CONFLICT_ATTEMPTS times. If anything fails,
+        no block is added and stored images are removed.
+        """
+        sources = list(sources)
+        if metadata is None or isinstance(metadata, dict):
+            metadata = [metadata or {}] * len(sources)
+        if len(metadata) != len(sources):
+            raise ValueError("Expected one metadata entry per image")
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            digests = list(pool.map(self.upload_digest, sources))
+            results = [self.find_block_by_digest(digest) for digest in digests]
+            first_seen = {}
+            for position, digest in enumerate(digests):
+                if results[position] is None:
+                    first_seen.setdefault(digest, position)
+            new = sorted(first_seen.values())
+
+            for attempt in range(1, CONFLICT_ATTEMPTS + 1):
+                try:
+                    added, blocks = self._add_batch(pool, sources, new, metadata, window=workers * 2)
+                    break
+                except ChainConflictError as e:
+                    if attempt == CONFLICT_ATTEMPTS:
+                        raise
+                    logger.warning("⚠️ %s; reloading the chain and building the batch again", e)
+                    self.reload_chain()
+
+        # Later copies of an upload in the batch resolve to the first copy's block
+        for position, digest in enumerate(digests):
+            if results[position] is None:
+                results[position] = added.get(position) or results[first_seen[digest]]
+            self.uploads.add(digest, results[position]["file_hash"])
+        logger.info("✅ Added %d blocks in one batch", len(blocks))
+        return results
+
+    def _add_batch(self, pool, sources, positions, metadata, window):
+        """Chain sources[positions] onto the current tip, seal them and commit them in one insert.
+
+        At most window images are decoded or being sealed at any time.
+        Returns ({position: block}, new blocks); images already on the chain
+        get their existing block. Raises ChainConflictError if the tip moved.
+        """
+        with self.lock:
+            tip = self.chain[-1] if self.chain else None
+        added = {}
+        blocks = []
+        by_hash = {}
+        previous_block = tip
+        pending = deque(positions)
+        decoding = deque()  # (position, future of (image, image_hash)) in chain order
+        sealing = []
+        try:
+            while pending or decoding:
+                unsealed = sum(not future.done() for future in sealing)
+                while pending and len(decoding) + unsealed < window:
+                    position = pending.popleft()
+                    decoding.append((position, pool.submit(self.prepare_image, sources[position])))
+                if not decoding:
+                    wait([future for future in sealing if not future.done()], return_when=FIRST_COMPLETED)
+                    continue
+
+                position, prepared = decoding.popleft()
+                image, image_hash = prepared.result()
+                existing = by_hash.get(image_hash) or self.find_block_by_hash(image_hash)
+                if existing is not None:
+                    added[position] = existing
+                    continue
+                previous_block = self.build_block(
+                    image_hash,
+                    metadata[position].get("signature", ""),
+                    metadata[position].get("message", ""),
+                    previous_block
+                )
+                added[position] = by_hash[image_hash] = previous_block
+                blocks.append(previous_block)
+                # The seal holds the only reference to the decoded image from here on
+                sealing.append(pool.submit(self.seal_block, image, previous_block, _source_name(sources[position])))
+                prepared = image = None
+
+            for future in sealing:
+                future.result()
+            with self.lock:
+                current = self.chain[-1] if self.chain else None
+                if (current and current["file_hash"]) != (tip and tip["file_hash"]):
+                    raise ChainConflictError("The chain tip moved while the batch was being built")
+                with metrics.timer("imagechain_block_stage_seconds", stage="commit"):
+                    self.store.append_many(blocks)
+                self.chain.extend(blocks)
+                metrics.inc("imagechain_blocks_added_total", len(blocks))
+                self.maybe_snapshot()
+        except Exception:
+            # Let the other seals finish, then remove every image that was stored
+            wait(sealing)
+            for future, block in zip(sealing, blocks):
+                if future.exception() is None:
+                    self.discard_image(block["file_id"])
+            raise
+        return added, blocks
+
+    def upload_digest(self, source):
+        """SHA-256 of an upload's raw bytes, used to find duplicates."""
+        with metrics.timer("imagechain_block_stage_seconds", stage="digest"):
+            return upload_digest(source)
+
+    def prepare_image(self, source):
+        """Decode an upload once and hash its PNG form. Returns (image, image_hash)."""
+        with metrics.timer("imagechain_block_stage_seconds", stage="decode"):
+            return load_image(source)
+
+    def build_block(self, image_hash, signature, message, previous_block=None):
+        """Create the JSON block (without file_id) on top of previous_block.
+
+        previous_block defaults to the current chain tip; the ingestion
+        pipeline passes a block that has been sequenced but not yet saved.
+        """
+        if previous_block is None and self.chain:
+            previous_block = self.chain[-1]
+        previous_hash = previous_block["file_hash"] if previous_block else "0"
         nonce = self.proof_of_work(previous_hash)
 
-        # Create JSON block (without file_id)
-        new_block = {
-            "index": len(self.chain),
-            "file_hash": image_hash,
-            "previous_hash": previous_hash,
-            "nonce": nonce,
-            "timestamp": str(datetime.now()),
-            "signature": signature,
-            "message": message,
-        }
-
-        # Embed JSON data into the image
-        self.embed_json_into_image(png_path, new_block)
-
-        # Store Image in MongoDB
-        file_id = self.save_image_to_mongodb(png_path)
-
-        # Add file_id to the block (not part of the embedded JSON)
-        new_block["file_id"] = file_id
+        return Block(
+            index=previous_block["index"] + 1 if previous_block else 0,
+            file_hash=image_hash,
+            previous_hash=previous_hash,
+            nonce=nonce,
+            timestamp=str(datetime.now()),
+            signature=signature,
+            message=message,
+        )
 
-        self.chain.append(new_block)
-        self.update_mongodb()
+    def seal_block(self, image, block, filename=None):
+        """Embed a block into its decoded image, store it and set block["file_id"].
 
-    def proof_of_work(self, previous_hash):
-        nonce = 0
-        while True:
-            hash_attempt = hashlib.sha256(f"{previous_hash}{nonce}".encode()).hexdigest()
-            if hash_attempt[:self.difficulty] == "0" * self.difficulty:
-                return nonce
-            nonce += 1
+        The PNG is encoded once, straight into the blob store, and hashed on
+        the way; the digest of the stored bytes is kept as its sha256 field.
+        """
+        try:
+            with metrics.timer("imagechain_block_stage_seconds", stage="lsb_embed"):
+                hidden_image = lsb_codec.hide(image, encode_header(block).decode())
+        except Exception as e:
+            raise ValueError(f"Failed to embed JSON into image: {e}")
 
-    def verify_chain_real_time(self):
-        """Retrieve images from MongoDB, extract JSON, and verify integrity."""
-        previous_hash = "0"
+        start = time.perf_counter()
+        writer = self.blobs.new_file(filename, file_hash=block["file_hash"])
+        sink = HashingWriter(writer)
+        try:
+            hidden_image.save(sink, "PNG")
+        except Exception:
+            writer.abort()
+            raise
+        encoded = time.perf_counter()
+        file_id = writer.close(sha256=sink.hexdigest())
 
-        for block in self.chain:
-            index = block["index"]
-            file_id = block["file_id"]
+        # Encoding streams into the blob store, so split the time by what the writes took
+        metrics.observe("imagechain_block_stage_seconds", encoded - start - sink.target_seconds, stage="png_encode")
+        metrics.observe("imagechain_block_stage_seconds", time.perf_counter() - encoded + sink.target_seconds, stage="gridfs_write")
 
-            print(f"\n🔍 Verifying Block {index}...")
+        # Add file_id to the block (not part of the embedded JSON)
+        block["file_id"] = file_id
 
-            # Retrieve image from MongoDB
-            temp_image_path = f"temp_{index}.png"
+        if self.eager_renditions:
+            # Resize from the decoded image instead of reading the PNG back
             try:
-                self.get_image_from_mongodb(file_id, temp_image_path)
+                self.renditions.create_all(block["file_id"], image)
             except Exception as e:
-                print(f"❌ Retrieval Failed: {e}")
-                return False
+                logger.warning("⚠️ Could not create renditions for %s: %s", block["file_id"], e)
+        return block
 
-            # Extract JSON from image
-            try:
-                extracted_json = self.extract_json_from_image(temp_image_path)
-                print(f"✅ Extracted JSON: {extracted_json}")
-            except ValueError as e:
-                print(f"❌ Extraction Failed: {e}")
-                return False
-
-            # Verify the file_hash from extracted JSON matches the stored file_hash
-            if extracted_json["file_hash"] != block["file_hash"]:
-                print(f"❌ Image hash mismatch for block {index}!")
-                print(f"Stored Hash: {block['file_hash']}")
-                print(f"Extracted Hash: {extracted_json['file_hash']}")
-                return False
-
-            # Create a copy of the block without file_id for comparison
-            block_without_file_id = block.copy()
-            del block_without_file_id["file_id"]
-
-            # Normalize JSON data for comparison
-            extracted_json_normalized = json.dumps(extracted_json, sort_keys=True)
-            block_normalized = json.dumps(block_without_file_id, sort_keys=True)
-
-            # Verify extracted JSON matches stored block data
-            if extracted_json_normalized != block_normalized:
-                print(f"❌ Integrity Check Failed: Block {index} has been tampered with!")
-                print(f"Stored Block: {block_normalized}")
-                print(f"Extracted JSON: {extracted_json_normalized}")
-                return False
-
-            # Update previous hash for next block
-            previous_hash = block["file_hash"]
-
-            # Cleanup temporary file
-            os.remove(temp_image_path)
-
-        print("\n✅ ImageChain integrity is intact.\n")
+    def target_bits(self):
+        """Number of leading zero bits a proof-of-work hash must have."""
+        return self.difficulty_bits if self.difficulty_bits is not None else self.difficulty * 4
+
+    def proof_of_work(self, previous_hash):
+        with metrics.timer("imagechain_block_stage_seconds", stage="proof_of_work"):
+            result = self.miner.mine(previous_hash, self.target_bits())
+        self.last_mining_result = result
+        logger.debug("⛏️ Mined nonce %d in %.2fs (%.0f H/s)", result.nonce, result.elapsed, result.hashes_per_second)
+        return result.nonce
+
+    def validate_block(self, block):
+        """Cheaply check that block extends the chain tip (linkage and proof of work)."""
+        previous = self.chain[-1] if self.chain else None
+        return check_header(block, previous, self.target_bits()) is None
+
+    def header_index(self):
+        """Return the header index, brought up to date with the in-memory chain."""
+        chain = self.chain
+        with self._index_lock:
+            self.headers.update(chain)
+        return self.headers
+
+    def merkle_tree(self):
+        """Return the Merkle tree over block headers, brought up to date with the chain."""
+        chain = self.chain
+        with self._index_lock:
+            self.merkle.update(chain)
+        return self.merkle
+
+    def merkle_root(self):
+        return self.merkle_tree().root
+
+    def merkle_proof(self, index):
+        """Return block index with an inclusion proof against the current Merkle root.
+
+        A client holding the root can check it with merkle.verify_proof.
+        Raises IndexError if no block index is stored.
+        """
+        with self.lock:
+            if index >= len(self.chain):
+                # Possibly stored by another worker since this one loaded the chain
+                self.catch_up()
+            tree = self.merkle_tree()
+            return {
+                "index": index,
+                "block": self.chain[index],
+                "root": tree.root,
+                "size": len(tree),
+                "proof": tree.proof(index),
+            }
+
+    def validate_headers(self):
+        """Check linkage, index continuity and every nonce without reading any image.
+
+        Returns {index: error message} for the blocks that fail.
+        """
+        return self.header_index().validate(self.target_bits())
+
+    def find_block_by_hash(self, file_hash):
+        """Return the block whose image has file_hash, or None."""
+        header = self.header_index().find(file_hash)
+        if header is not None:
+            return self.chain[header.index]
+        # Another process may have added it since the chain was loaded
+        return self.store.find_by_file_hash(file_hash)
+
+    def find_block_by_digest(self, digest):
+        """Return the block for the SHA-256 of an image's raw bytes, or None.
+
+        The digest may be of the image as it was uploaded or of the stored
+        image with its block embedded (the blob store keeps that as sha256).
+        """
+        block = self.find_block_by_hash(self.uploads.get(digest) or digest)
+        if block is None:
+            file_id = self.blobs.find("sha256", digest)
+            if file_id is not None:
+                block = self.store.find_by_file_id(file_id)
+        return block
+
+    def find_block_by_image(self, stream):
+        """Return the block an image (path or seekable stream) belongs to, or None.
+
+        The image is hashed in one streaming pass and never decoded.
+        """
+        return self.find_block_by_digest(self.upload_digest(stream))
+
+    def _duplicate(self, block):
+        metrics.inc("imagechain_duplicate_uploads_total")
+        logger.info("♻️ Image is already on the chain as block %d", block["index"])
+        return block
+
+    def add_peer(self, address):
+        self.peers.add(address)
+
+    def verify_chain_real_time(self, full_audit=False):
+        """Check block headers, then retrieve images, extract JSON and verify integrity.
+
+        By default only blocks added since the last verification checkpoint are
+        decoded; the already verified prefix is checked against its stored
+        digest. Pass full_audit=True to re-verify every block from genesis.
+        """
+        report = self.verify_chain_report(full_audit=full_audit)
+        if not report.ok:
+            return False
+
+        logger.info("✅ ImageChain integrity is intact.")
         return True
 
+    def verify_chain_report(self, full_audit=False):
+        """Verify the chain in parallel and return a per-block VerificationReport.
+
+        A full audit verifies the blocks stored in MongoDB rather than the
+        in-memory chain, and reloads the chain if the two differ.
+        """
+        if full_audit:
+            chain = self.store.load_all()
+            self.check_loaded_chain(chain)
+            start, digest = 0, GENESIS_DIGEST
+        else:
+            if not self._snapshot_checked:
+                self.check_loaded_chain()
+            chain = self.chain
+            with metrics.timer("imagechain_verify_stage_seconds", stage="checkpoint"):
+                start, digest = self.checkpoint.resume_point(chain)
+
+        if start:
+            logger.info("⏩ Blocks 0-%d match the verification checkpoint.", start - 1)
+
+        pending = chain[start:]
+        # A full audit re-reads every image instead of trusting the caches
+        verifier = ChainVerifier(self, processes=self.verify_processes, use_cache=not full_audit)
+        with metrics.timer("imagechain_verify_stage_seconds", stage="images"):
+            report = verifier.verify(pending)
+        # Linkage and nonces are always checked for the whole chain; it costs no image reads
+        with metrics.timer("imagechain_verify_stage_seconds", stage="headers"):
+            if full_audit:
+                header_errors = HeaderIndex(chain).validate(self.target_bits())
+            else:
+                header_errors = self.validate_headers()
+        for index, error in header_errors.items():
+            report.flag(index, INVALID_HEADER, error)
+        for result in report.results:
+            metrics.inc("imagechain_verify_blocks_total", status=result["status"])
+        for result in report.failures:
+            logger.error("❌ Block %s %s: %s", result["index"], result["status"], result["detail"])
+
+        # Advance the checkpoint over the blocks that verified in order
+        verified = report.verified_prefix()
+        for block in pending[:verified]:
+            digest = block_digest(digest, block)
+        if start + verified:
+            self.checkpoint.save(start + verified - 1, digest, None if full_audit else chain)
+        return report
+
+    def verify_blocks(self, blocks, previous=None):
+        """Verify a run of consecutive blocks (e.g. one page) on its own.
+
+        previous is the block before blocks[0] (None when blocks[0] is the
+        genesis block). Extraction runs on I/O threads rather than a process
+        pool, and extracted JSON is cached, so re-checking a page is cheap.
+        """
+        verifier = ChainVerifier(self, processes=self.verify_processes, parallel_threshold=len(blocks) + 1)
+        report = verifier.verify(blocks)
+        bits = self.target_bits()
+        for block in blocks:
+            error = check_header(block, previous, bits)
+            if error:
+                report.flag(block["index"], INVALID_HEADER, error)
+            previous = block
+        return report
+
+    def block_page(self, after=-1, limit=24, verify=True):
+        """Return up to limit blocks after index after, each with its verification status.
+
+        Returns {"blocks": [...], "next": cursor for the following page or None}.
+        """
+        blocks = self.store.page(after, limit + 1)
+        has_more = len(blocks) > limit
+        blocks = blocks[:limit]
+        if verify and blocks:
+            previous = self.store.get(blocks[0]["index"] - 1) if blocks[0]["index"] else None
+            results = {result["index"]: result for result in self.verify_blocks(blocks, previous).results}
+            blocks = [
+                dict(block, status=results[block["index"]]["status"], detail=results[block["index"]]["detail"])
+                for block in blocks
+            ]
+        return {"blocks": blocks, "next": blocks[-1]["index"] if has_more else None}
+
     def convert_to_png(self, image_path):
         """Convert an image to PNG format."""
         png_path = os.path.splitext(image_path)[0] + ".png"
         if not image_path.lower().endswith(".png"):
             image = Image.open(image_path)
             image.save(png_path, "PNG")
-            print(f"✅ Converted {image_path} to {png_path}")
+            logger.info("✅ Converted %s to %s", image_path, png_path)
         else:
             png_path = image_path
         return png_path
@@ -195,16 +772,16 @@ class ImageChain:
         """Embed JSON data into an image using steganography."""
         try:
             image = Image.open(image_path)
-            hidden_image = lsb.hide(image, json.dumps(json_data, sort_keys=True))
+            hidden_image = lsb_codec.hide(image, encode(json_data).decode())
             hidden_image.save(image_path)
-            print(f"✅ JSON data embedded into {image_path}")
+            logger.info("✅ JSON data embedded into %s", image_path)
         except Exception as e:
             raise ValueError(f"Failed to embed JSON into image: {e}")
 
     def extract_json_from_image(self, image_path):
         """Extract hidden JSON metadata from an image."""
         try:
-            hidden_data = lsb.reveal(image_path)
+            hidden_data = lsb_codec.reveal(image_path)
             if hidden_data is None:
                 raise ValueError("No hidden data found in image!")
 
@@ -213,7 +790,15 @@ class ImageChain:
         except Exception as e:
             raise ValueError(f"Failed to extract JSON: {e}")
 
+def _source_name(source):
+    """Best-effort file name for a path, Werkzeug FileStorage or open file."""
+    if isinstance(source, str):
+        return source
+    name = getattr(source, "filename", None) or getattr(source, "name", None)
+    return name if isinstance(name, str) else None
+
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("IMAGECHAIN_LOG_LEVEL", "INFO"), format="%(message)s")
     imagechain = ImageChain()
 
     if not imagechain.chain:
@@ -230,4 +815,4 @@ if __name__ == "__main__":
         print("\n❌ ImageChain is corrupted.\n")
 
     print("\n🖼️ ImageChain Blocks:\n")
-    print(json.dumps(imagechain.chain, indent=4))
\ No newline at end of file
+    print(json.dumps([block.to_dict() for block in imagechain.chain], indent=4))
\ No newline at end of file
@@ -0,0 +1,275 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+import logging
+import queue
+import threading
+import time
+import uuid
+from storage import ChainConflictError
+from metrics import metrics
+
+QUEUED = "queued"
+PREPARING = "preparing"
+MINING = "mining"
+SEALING = "sealing"
+COMMITTED = "committed"
+FAILED = "failed"
+
+SEQUENCER_ERROR_DELAY = 0.5  # Seconds to back off after an unexpected sequencer error
+
+logger = logging.getLogger(__name__)
+
+
+class IngestJob:
+    """An upload waiting to become a block."""
+
+    def __init__(self, source, signature, message, filename=None, store=None):
+        self.id = uuid.uuid4().hex
+        self.store = store  # JobStore the status is published to, for other workers
+        self.source = source  # File path or seekable stream (e.g. a spooled upload)
+        self.filename = filename
+        self.signature = signature
+        self.message = message
+        self.status = QUEUED
+        self.error = None
+        self.block = None
+        self.digest = None  # SHA-256 of the raw upload
+        self.duplicate = False  # Set when the image was already on the chain
+        self.attempts = 0
+        self.prepared = None  # Future of (decoded image, image_hash)
+        self.created = str(datetime.now())
+        self.updated = self.created
+
+    def set_status(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.updated = str(datetime.now())
+        self.publish()
+
+    def publish(self):
+        if self.store is None:
+            return
+        try:
+            self.store.save(self.to_dict())
+        except Exception as e:
+            # Ingestion goes on; only other workers' view of the job is stale
+            logger.warning("⚠️ Could not record the status of upload %s: %s", self.id, e)
+
+    @property
+    def done(self):
+        return self.status in (COMMITTED, FAILED)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "duplicate": self.duplicate,
+            "index": self.block["index"] if self.block and self.status == COMMITTED else None,
+            "file_id": self.block.get("file_id") if self.block and self.status == COMMITTED else None,
+            "created": self.created,
+            "updated": self.updated,
+        }
+
+
+class IngestionPipeline:
+    """Turns uploads into blocks in the background.
+
+    A thread pool decodes and hashes the next few queued uploads ahead of the
+    sequencer (bounded, so queued uploads are not all decoded into memory). A
+    single sequencer thread takes jobs in arrival order, assigns each one
+    its index and previous_hash on top of the last sequenced block and mines
+    its nonce. Embedding and the GridFS put go back to the pool, and the
+    sequencer saves finished blocks strictly in index order. If a block fails
+    after later blocks were built on it, those later blocks are discarded and
+    re-sequenced, so the chain never forks and never has gaps.
+
+    Job status is kept in memory for the jobs this process ingests and
+    published to the chain's JobStore, so any worker can report on any job.
+    """
+
+    def __init__(self, imagechain, workers=4, max_in_flight=8, max_jobs=10000, max_attempts=3, lookahead=None):
+        self.imagechain = imagechain
+        self.lookahead = lookahead or workers
+        self.max_in_flight = max_in_flight
+        self.max_jobs = max_jobs
+        self.max_attempts = max_attempts
+        self.jobs = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._queue = queue.Queue()
+        self._retry = deque()
+        self._lookahead = deque()
+        self._sequencer = threading.Thread(target=self._run_sequencer, daemon=True)
+        self._sequencer.start()
+
+    def submit(self, source, signature="", message="", filename=None):
+        """Queue an upload for ingestion and return its IngestJob immediately.
+
+        source is a path or a seekable stream; streams are closed once the job
+        has finished.
+        """
+        job = IngestJob(source, signature, message, filename, self.imagechain.jobs)
+        with self._jobs_lock:
+            self.jobs[job.id] = job
+            self._trim_jobs()
+        job.publish()
+        self._queue.put(job)
+        return job
+
+    def status(self, job_id):
+        """Return the job's status dictionary, or None for unknown jobs."""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        # Queued on another worker, or this one has forgotten it
+        return self.imagechain.jobs.get(job_id)
+
+    def _trim_jobs(self):
+        # Forget the oldest finished jobs once the table is full
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= self.max_jobs:
+                break
+            if self.jobs[job_id].done:
+                del self.jobs[job_id]
+
+    def _prepare(self, job):
+        job.set_status(PREPARING)
+        job.digest = self.imagechain.upload_digest(job.source)
+        existing = self.imagechain.find_block_by_digest(job.digest)
+        if existing is not None:
+            # Already on the chain: skip decoding, the sequencer resolves it by hash
+            return None, existing["file_hash"]
+        return self.imagechain.prepare_image(job.source)
+
+    def _next_job(self, wait_for_job):
+        if self._retry:
+            return self._retry.popleft()
+
+        # Keep a bounded window of upcoming jobs decoding in the pool
+        while len(self._lookahead) < self.lookahead:
+            try:
+                if self._lookahead:
+                    job = self._queue.get_nowait()
+                else:
+                    job = self._queue.get(timeout=None if wait_for_job else 0.05)
+            except queue.Empty:
+                break
+            job.prepared = self._pool.submit(self._prepare, job)
+            self._lookahead.append(job)
+        return self._lookahead.popleft() if self._lookahead else None
+
+    def _run_sequencer(self):
+        in_flight = deque()  # (job, block, seal future) in index order
+        while True:
+            try:
+                self._sequence_next(in_flight)
+            except Exception as e:
+                # Never let the sequencer die: later uploads would stay queued forever
+                logger.exception("❌ Ingestion sequencer error")
+                self._abort(in_flight, f"Ingestion failed: {e}")
+                time.sleep(SEQUENCER_ERROR_DELAY)
+
+    def _sequence_next(self, in_flight):
+        # Save every leading block whose image has been sealed
+        while in_flight and in_flight[0][2].done():
+            self._commit(in_flight)
+
+        if len(in_flight) >= self.max_in_flight:
+            wait([in_flight[0][2]])
+            return
+
+        job = self._next_job(wait_for_job=not in_flight)
+        if job is None:
+            return
+
+        job.attempts += 1
+        try:
+            image, image_hash = job.prepared.result()
+            existing = self.imagechain.find_block_by_hash(image_hash)
+            if existing is not None:
+                job.block = existing
+                job.duplicate = True
+                metrics.inc("imagechain_duplicate_uploads_total")
+                self.imagechain.uploads.add(job.digest, image_hash)
+                self._finish(job, COMMITTED)
+                return
+            job.set_status(MINING)
+            previous_block = in_flight[-1][1] if in_flight else None
+            block = self.imagechain.build_block(image_hash, job.signature, job.message, previous_block)
+            job.block = block
+            job.set_status(SEALING)
+            sealed = self._pool.submit(self.imagechain.seal_block, image, block, job.filename)
+        except Exception as e:
+            self._finish(job, FAILED, str(e))
+            return
+        in_flight.append((job, block, sealed))
+
+    def _commit(self, in_flight):
+        job, block, sealed = in_flight.popleft()
+        try:
+            self._save(job, block, sealed, in_flight)
+        except Exception as e:
+            # Recovering from a failed save failed too (e.g. MongoDB is unreachable)
+            if not job.done and job.status != QUEUED:
+                self._finish(job, FAILED, str(e))
+            raise
+
+    def _save(self, job, block, sealed, in_flight):
+        try:
+            sealed.result()
+            with self.imagechain.lock:
+                self.imagechain.save_block(block)
+            self.imagechain.uploads.add(job.digest, block["file_hash"])
+        except ChainConflictError as e:
+            # Another writer moved the tip: reload it and sequence this job again
+            self.imagechain.reload_chain()
+            self._rewind(in_flight)
+            if job.attempts < self.max_attempts:
+                job.block = None
+                job.set_status(QUEUED)
+                self._retry.appendleft(job)
+            else:
+                self._finish(job, FAILED, str(e))
+            return
+        except Exception as e:
+            self._finish(job, FAILED, str(e))
+            self._rewind(in_flight)
+            return
+        self._finish(job, COMMITTED)
+
+    def _abort(self, in_flight, error):
+        """Fail every sequenced job after an unexpected error and remove their stored images."""
+        while in_flight:
+            job, block, sealed = in_flight.popleft()
+            try:
+                sealed.result()
+                self.imagechain.discard_image(block["file_id"])
+            except Exception:
+                pass
+            self._finish(job, FAILED, error)
+
+    def _rewind(self, in_flight):
+        """Discard blocks sequenced on top of a failed one and queue them again."""
+        retry = []
+        while in_flight:
+            job, block, sealed = in_flight.popleft()
+            try:
+                sealed.result()
+                self.imagechain.discard_image(block["file_id"])
+            except Exception:
+                pass
+            job.block = None
+            job.set_status(QUEUED)
+            retry.append(job)
+        self._retry.extendleft(reversed(retry))
+
+    def _finish(self, job, status, error=None):
+        job.set_status(status, error)
+        if status == FAILED:
+            logger.error("❌ Upload %s failed: %s", job.id, error)
+        # Release the spooled upload and the decoded image
+        if hasattr(job.source, "close"):
+            job.source.close()
+        job.prepared = None
@@ -0,0 +1,94 @@
+"""Vectorized LSB steganography codec.
+
+The on-image layout is the one written by ``stegano.lsb.hide``: the payload
+``"<byte length>:<message>"`` is written MSB first into the least significant
+bit of the R, G and B components of consecutive pixels in row-major order
+(alpha is left untouched), padded with zero bits to a whole pixel. Images
+produced by either implementation can be read by the other, so existing
+blocks need no migration.
+"""
+from PIL import Image
+import numpy as np
+
+ENCODING = "UTF-8"
+MAX_HEADER_BYTES = 24  # Enough for any length prefix plus the ":" separator
+
+
+def _open(image):
+    """Return a PIL image in RGB or RGBA mode from a path, file or image."""
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+    return image
+
+
+def _pixels(array):
+    """View an HxWxC array as one row of channel values per pixel."""
+    return array.reshape(-1, array.shape[-1])
+
+
+def hide_array(array, message, encoding=ENCODING):
+    """Embed message into the RGB least significant bits of array in place."""
+    message_bytes = message.encode(encoding)
+    if not message_bytes:
+        raise ValueError("Message length is zero")
+    payload = f"{len(message_bytes)}:".encode("ascii") + message_bytes
+
+    bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))
+    bits = np.pad(bits, (0, -len(bits) % 3))
+    pixel_count = len(bits) // 3
+
+    if not array.flags.c_contiguous:
+        raise ValueError("Image array must be C-contiguous to embed in place")
+    pixels = _pixels(array)
+    if pixel_count > pixels.shape[0]:
+        raise ValueError(f"The message you want to hide is too long: {len(message_bytes)} bytes")
+
+    region = pixels[:pixel_count, :3]
+    region &= 0xFE
+    region |= bits.reshape(-1, 3)
+    return array
+
+
+def _read_bytes(pixels, byte_count):
+    """Read byte_count bytes from the leading pixels' RGB least significant bits."""
+    pixel_count = -(-byte_count * 8 // 3)
+    if pixel_count > pixels.shape[0]:
+        raise ValueError("Impossible to detect message.")
+    bits = (pixels[:pixel_count, :3] & 1).reshape(-1)[:byte_count * 8]
+    return np.packbits(bits).tobytes()
+
+
+def reveal_array(array, encoding=ENCODING):
+    """Extract the message hidden in an HxWxC array.
+
+    Only the pixels covering the length prefix and the message are read.
+    """
+    pixels = _pixels(array)
+    header = _read_bytes(pixels, min(MAX_HEADER_BYTES, pixels.shape[0] * 3 // 8))
+    separator = header.find(b":")
+    if separator <= 0 or not header[:separator].isdigit():
+        raise ValueError("Impossible to detect message.")
+
+    length = int(header[:separator])
+    payload = _read_bytes(pixels, separator + 1 + length)
+    try:
+        return payload[separator + 1:].decode(encoding)
+    except UnicodeDecodeError as e:
+        raise ValueError("Impossible to detect message.") from e
+
+
+def hide(image, message, encoding=ENCODING):
+    """Return a copy of image with message hidden in it (like lsb.hide)."""
+    image = _open(image)
+    array = np.array(image)
+    hide_array(array, message, encoding)
+    encoded = Image.fromarray(array, image.mode)
+    encoded.info = dict(image.info)
+    return encoded
+
+
+def reveal(image, encoding=ENCODING):
+    """Return the message hidden in image (like lsb.reveal)."""
+    return reveal_array(np.asarray(_open(image)), encoding)
@@ -0,0 +1,139 @@
+import hashlib
+from block import HEADER_HASH_PREFIX, header_hash
+
+LEAF_PREFIX = HEADER_HASH_PREFIX
+NODE_PREFIX = b"\x01"
+EMPTY_ROOT = hashlib.sha256(b"").hexdigest()
+
+
+def leaf_hash(block):
+    """Hash a block's header: the JSON embedded in its image (everything but file_id)."""
+    return header_hash(block)
+
+
+def _node_hash(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def build_levels(leaves):
+    """Every level of the tree over leaves (raw digests), leaves first."""
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        nodes = levels[-1]
+        levels.append([
+            _node_hash(nodes[left], nodes[left + 1]) if left + 1 < len(nodes) else nodes[left]
+            for left in range(0, len(nodes), 2)
+        ])
+    return levels
+
+
+class StoredLevel:
+    """A tree level read from a buffer of 32-byte nodes (a snapshot), plus nodes changed or added since."""
+
+    def __init__(self, buffer, count):
+        self._buffer = buffer
+        self._count = count
+        self._changed = {}
+        self._added = []
+
+    def __len__(self):
+        return self._count + len(self._added)
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        if position >= self._count:
+            return self._added[position - self._count]
+        node = self._changed.get(position)
+        return node if node is not None else bytes(self._buffer[position * 32:(position + 1) * 32])
+
+    def __setitem__(self, position, node):
+        if position >= self._count:
+            self._added[position - self._count] = node
+        else:
+            self._changed[position] = node
+
+    def append(self, node):
+        self._added.append(node)
+
+
+def verify_proof(block, proof, root):
+    """Check an inclusion proof from MerkleTree.proof() against a root (hex)."""
+    digest = leaf_hash(block)
+    for step in proof:
+        sibling = bytes.fromhex(step["hash"])
+        digest = _node_hash(sibling, digest) if step["side"] == "left" else _node_hash(digest, sibling)
+    return digest.hex() == root
+
+
+class MerkleTree:
+    """Append-only Merkle tree over block headers.
+
+    Every level of the tree is kept, so appending a block only rehashes the
+    path from its leaf to the root (O(log n)) and any block's inclusion
+    proof can be read straight off the levels. A node without a right
+    sibling is carried up unchanged. Leaves and inner nodes are hashed with
+    different prefixes so a leaf can never pass for an inner node. The
+    levels of a chain loaded from a snapshot are read from the snapshot
+    instead of being rehashed.
+    """
+
+    def __init__(self, blocks=()):
+        self.levels = [[]]
+        self.update(blocks)
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    @property
+    def root(self):
+        """Hex root of the tree (EMPTY_ROOT for an empty chain)."""
+        return self.levels[-1][0].hex() if self.levels[0] else EMPTY_ROOT
+
+    def append(self, block):
+        self.levels[0].append(leaf_hash(block))
+        position = len(self.levels[0]) - 1
+        level = 0
+        while len(self.levels[level]) > 1:
+            nodes = self.levels[level]
+            left = position - position % 2
+            parent = _node_hash(nodes[left], nodes[left + 1]) if left + 1 < len(nodes) else nodes[left]
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            parents = self.levels[level + 1]
+            position //= 2
+            if position < len(parents):
+                parents[position] = parent
+            else:
+                parents.append(parent)
+            level += 1
+
+    def update(self, chain):
+        """Bring the tree in line with chain, rebuilding it if the chain was replaced."""
+        count = len(self)
+        if count > len(chain) or (count and leaf_hash(chain[count - 1]) != self.levels[0][count - 1]):
+            self.levels = [[]]
+        snapshot = getattr(chain, "snapshot", None)
+        if not len(self) and snapshot is not None and len(snapshot):
+            self.levels = [StoredLevel(buffer, size) for buffer, size in snapshot.merkle_levels()]
+        for block in chain[len(self):]:
+            self.append(block)
+
+    def proof(self, index):
+        """Return the sibling hashes linking block index to the root.
+
+        Each step is {"hash": hex, "side": "left" | "right"}, giving the side
+        the sibling sits on; levels where the node has no sibling are skipped.
+        """
+        if not 0 <= index < len(self):
+            raise IndexError(f"No block {index} in a tree of {len(self)} blocks")
+        steps = []
+        position = index
+        for nodes in self.levels[:-1]:
+            sibling = position ^ 1
+            if sibling < len(nodes):
+                steps.append({"hash": nodes[sibling].hex(), "side": "left" if sibling < position else "right"})
+            position //= 2
+        return steps
@@ -0,0 +1,197 @@
+from bisect import bisect_left
+import os
+import threading
+import time
+import weakref
+
+# Upper bounds (seconds) of the timing histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Metrics:
+    """Process-wide counters and timing histograms in the Prometheus text format.
+
+    Series are keyed by metric name and label values. When disabled, timer()
+    returns a shared no-op context manager and inc()/observe() return
+    straight away, so instrumented code only pays for one attribute check.
+    Between start_trace() and end_trace() the timings a thread observes are
+    also collected, for a per-request trace log. Gauges are read from their
+    objects when rendered.
+    """
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}  # key -> [bucket counts, sum, count]
+        self._gauges = {}  # key -> weak reference to a bound method returning the value
+        self._help = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        """Record one timing in the histogram name{labels}."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            if bucket < len(self.buckets):
+                histogram[0][bucket] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+        spans = getattr(self._local, "spans", None)
+        if spans is not None:
+            spans.append((labels.get("stage") or labels.get("type") or name, seconds))
+
+    def gauge(self, name, method, **labels):
+        """Report method() as gauge name{labels} on every render.
+
+        method is a bound method held weakly, so registering a gauge does not
+        keep its object alive; a later registration with the same labels wins.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = weakref.WeakMethod(method)
+
+    def timer(self, name, **labels):
+        """Context manager that observes the duration of its block."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def start_trace(self):
+        self._local.spans = []
+
+    def end_trace(self):
+        """Stop tracing this thread and return its [(stage, seconds)] spans."""
+        spans = getattr(self._local, "spans", None) or []
+        self._local.spans = None
+        return spans
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """Return every series in the Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(value[0]), value[1], value[2]) for key, value in self._histograms.items()}
+            gauge_methods = dict(self._gauges)
+
+        gauges = {}
+        for key, reference in gauge_methods.items():
+            method = reference()
+            if method is None:
+                with self._lock:
+                    if self._gauges.get(key) is reference:
+                        del self._gauges[key]
+            else:
+                gauges[key] = method()
+
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            self._header(lines, name, "counter")
+            for (series, labels), value in sorted(counters.items()):
+                if series == name:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+
+        for name in sorted({name for name, _ in gauges}):
+            self._header(lines, name, "gauge")
+            for (series, labels), value in sorted(gauges.items()):
+                if series == name:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+
+        for name in sorted({name for name, _ in histograms}):
+            self._header(lines, name, "histogram")
+            for (series, labels), (buckets, total, count) in sorted(histograms.items()):
+                if series != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, buckets):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {total}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines, name, kind):
+        if name in self._help:
+            lines.append(f"# HELP {name} {self._help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+# Shared registry; set IMAGECHAIN_METRICS=0 to turn instrumentation off
+metrics = Metrics(enabled=os.environ.get("IMAGECHAIN_METRICS", "1") != "0")
+metrics.describe("imagechain_block_stage_seconds", "Time spent in each stage of adding a block.")
+metrics.describe("imagechain_blocks_added_total", "Blocks committed to the chain.")
+metrics.describe("imagechain_duplicate_uploads_total", "Uploads that were already on the chain.")
+metrics.describe("imagechain_verify_stage_seconds", "Time spent in each step of chain verification.")
+metrics.describe("imagechain_verify_blocks_total", "Blocks checked by chain verification, by outcome.")
+metrics.describe("imagechain_rendition_seconds", "Time spent resizing and encoding image renditions.")
+metrics.describe("imagechain_http_request_seconds", "Flask request handling time (excluding streamed bodies).")
+metrics.describe("imagechain_p2p_message_seconds", "Time spent handling P2P messages, by type.")
+metrics.describe("imagechain_cache_hits_total", "Cache lookups answered from memory, by cache.")
+metrics.describe("imagechain_cache_misses_total", "Cache lookups that found nothing, by cache.")
+metrics.describe("imagechain_cache_evictions_total", "Entries evicted from memory, by cache.")
+metrics.describe("imagechain_cache_spill_hits_total", "Cache lookups answered from the spill directory, by cache.")
+metrics.describe("imagechain_cache_spills_total", "Evicted entries written to the spill directory, by cache.")
+metrics.describe("imagechain_cache_bytes", "Size of the entries held in memory (entry count for unweighted caches).")
+metrics.describe("imagechain_cache_entries", "Entries held in memory, by cache.")
+metrics.describe("imagechain_cache_spill_bytes", "Bytes held in the spill directory, by cache.")
+metrics.describe("imagechain_p2p_broadcast_failures_total", "Block broadcasts that failed to reach a peer.")
@@ -0,0 +1,138 @@
+import hashlib
+import multiprocessing
+import os
+import time
+
+# Below this many bits of work, starting worker processes costs more than the search.
+# 12 bits is about 4k hashes; the default difficulty (16 bits) is mined on every core.
+INLINE_BITS = 12
+
+
+def difficulty_target(difficulty_bits):
+    """Return the 32-byte big-endian target a digest must stay below."""
+    if difficulty_bits <= 0:
+        return None
+    return (1 << (256 - difficulty_bits)).to_bytes(32, "big")
+
+
+def check_proof(previous_hash, nonce, difficulty_bits):
+    """Check that sha256(previous_hash + nonce) has difficulty_bits leading zero bits."""
+    target = difficulty_target(difficulty_bits)
+    if target is None:
+        return True
+    return hashlib.sha256(f"{previous_hash}{nonce}".encode()).digest() < target
+
+
+def _search(previous_hash, start, step, difficulty_bits, batch_size, stop):
+    """Try nonces start, start + step, ... until one meets the target or stop is set.
+
+    Returns (nonce or None, attempts). The previous hash is absorbed into the
+    SHA-256 state once and copied for every attempt.
+    """
+    target = difficulty_target(difficulty_bits)
+    if target is None:
+        return start, 1
+
+    prefix = hashlib.sha256(previous_hash.encode())
+    nonce = start
+    attempts = 0
+    while not stop.is_set():
+        for _ in range(batch_size):
+            attempt = prefix.copy()
+            attempt.update(b"%d" % nonce)
+            if attempt.digest() < target:
+                return nonce, attempts + 1
+            nonce += step
+            attempts += 1
+    return None, attempts
+
+
+def _mine_worker(previous_hash, start, step, difficulty_bits, batch_size, found, results):
+    """Worker process entry point: search one stride of the nonce space."""
+    nonce, attempts = _search(previous_hash, start, step, difficulty_bits, batch_size, found)
+    if nonce is not None:
+        found.set()
+    results.put((nonce, attempts))
+
+
+class _NeverStop:
+    def is_set(self):
+        return False
+
+
+class MiningResult:
+    """Outcome of a proof-of-work search."""
+
+    def __init__(self, nonce, attempts, elapsed):
+        self.nonce = nonce
+        self.attempts = attempts
+        self.elapsed = elapsed
+
+    @property
+    def hashes_per_second(self):
+        return self.attempts / self.elapsed if self.elapsed > 0 else float("inf")
+
+    def __repr__(self):
+        return f"MiningResult(nonce={self.nonce}, attempts={self.attempts}, hashes_per_second={self.hashes_per_second:.0f})"
+
+
+class Miner:
+    """Proof-of-work miner that splits the nonce space across worker processes.
+
+    Worker i tries nonces i, i + workers, i + 2 * workers, ... and all workers
+    stop at the next batch boundary once any of them finds a valid nonce.
+    Targets of at most `inline_bits` are mined in-process, where starting
+    workers would cost more than the search itself.
+    """
+
+    def __init__(self, workers=None, batch_size=20000, inline_bits=INLINE_BITS):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.inline_bits = inline_bits
+
+    def mine(self, previous_hash, difficulty_bits):
+        """Find a nonce for previous_hash and return a MiningResult."""
+        started = time.perf_counter()
+        if self.workers == 1 or difficulty_bits <= self.inline_bits:
+            nonce, attempts = _search(previous_hash, 0, 1, difficulty_bits, self.batch_size, _NeverStop())
+            return MiningResult(nonce, attempts, time.perf_counter() - started)
+
+        context = multiprocessing.get_context()
+        found = context.Event()
+        results = context.Queue()
+        processes = [
+            context.Process(
+                target=_mine_worker,
+                args=(previous_hash, start, self.workers, difficulty_bits, self.batch_size, found, results),
+                daemon=True
+            )
+            for start in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+
+        nonces = []
+        attempts = 0
+        for _ in processes:
+            nonce, worker_attempts = results.get()
+            attempts += worker_attempts
+            if nonce is not None:
+                nonces.append(nonce)
+        for process in processes:
+            process.join()
+
+        return MiningResult(min(nonces), attempts, time.perf_counter() - started)
+
+    def measure_hashrate(self, duration=1.0):
+        """Estimate single-core hashes per second for tuning the difficulty."""
+        prefix = hashlib.sha256(b"0" * 64)
+        attempts = 0
+        started = time.perf_counter()
+        deadline = started + duration
+        while time.perf_counter() < deadline:
+            for nonce in range(attempts, attempts + 10000):
+                attempt = prefix.copy()
+                attempt.update(b"%d" % nonce)
+                attempt.digest()
+            attempts += 10000
+        return attempts / (time.perf_counter() - started)
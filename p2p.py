@@ -1,17 +1,44 @@
 import hashlib
 import json
+import logging
+import os
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import cached_property
+import queue
+import selectors
 import socket
 import threading
+import time
 from imagechain import ImageChain
+from metrics import metrics
+from sync import ChainSync, handle_sync_message
+from wire import ConnectionPool, encode_frame, recv_message, send_message
+
+IDLE_SWEEP_SECONDS = 5  # How often connections idle for longer than idle_timeout are closed
+MESSAGE_TIMEOUT = 30  # Seconds a peer may take to send the rest of a frame it started
+
+logger = logging.getLogger(__name__)
 
 class P2PNode:
-    def __init__(self, host, port):
+    def __init__(self, host, port, max_connections=64, idle_timeout=300, imagechain=None):
         self.host = host
         self.port = port
-        self.imagechain = ImageChain()
+        self.imagechain = imagechain if imagechain is not None else ImageChain()
         self.peers = set()
+        self.pool = ConnectionPool()  # One persistent connection per peer
+        self.idle_timeout = idle_timeout
+        # Only connections with a message to handle take one of the max_connections threads
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._workers = ThreadPoolExecutor(max_workers=max_connections)
+        self._selector = selectors.DefaultSelector()
+        self._returned = queue.SimpleQueue()  # Connections workers hand back to the selector
+        self._wakeup, self._waker = socket.socketpair()
+
+    @cached_property
+    def chain_sync(self):
+        return ChainSync(self.imagechain, self.pool)  # Shared by gossip and sync
 
     def start(self):
         """Start the P2P node."""
@@ -19,53 +46,112 @@ class P2PNode:
         server_thread.start()
 
     def _run_server(self):
-        """Run a server to accept connections from peers."""
+        """Run a server to accept connections from peers.
+
+        Idle connections wait in a selector without holding a thread; when
+        one has a message, a worker takes it (once a slot is free), handles
+        the message and hands the connection back. Connections idle for
+        idle_timeout are closed.
+        """
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             s.bind((self.host, self.port))
             s.listen()
-            print(f"Node listening on {self.host}:{self.port}")
+            logger.info("Node listening on %s:%s", self.host, self.port)
+            self._selector.register(s, selectors.EVENT_READ)
+            self._selector.register(self._wakeup, selectors.EVENT_READ)
+            idle = {}  # connection -> time of its last message
             while True:
-                conn, addr = s.accept()
-                print(f"Connected to {addr}")
-                threading.Thread(target=self._handle_connection, args=(conn,)).start()
+                for key, _ in self._selector.select(timeout=IDLE_SWEEP_SECONDS):
+                    if key.fileobj is s:
+                        conn, addr = s.accept()
+                        logger.info("Connected to %s", addr)
+                        idle[conn] = time.monotonic()
+                        self._selector.register(conn, selectors.EVENT_READ)
+                    elif key.fileobj is self._wakeup:
+                        self._wakeup.recv(4096)
+                    else:
+                        conn = key.fileobj
+                        self._selector.unregister(conn)
+                        del idle[conn]
+                        # Further messages wait (in their sockets) until a worker is free
+                        self._slots.acquire()
+                        self._workers.submit(self._handle_connection, conn)
+
+                while not self._returned.empty():
+                    conn = self._returned.get()
+                    idle[conn] = time.monotonic()
+                    self._selector.register(conn, selectors.EVENT_READ)
+
+                expired = time.monotonic() - self.idle_timeout
+                for conn in [conn for conn, last in idle.items() if last < expired]:
+                    self._selector.unregister(conn)
+                    del idle[conn]
+                    conn.close()
 
     def _handle_connection(self, conn):
-        """Handle incoming connections."""
-        with conn:
-            data = conn.recv(1024).decode()
-            if data:
-                message = json.loads(data)
-                if message["type"] == "block":
-                    block = message["data"]
-                    if self.imagechain.validate_block(block):
-                        self.imagechain.chain.append(block)
-                        print(f"New block added: {block}")
-                    else:
-                        print("Invalid block received")
-                elif message["type"] == "peer":
-                    self.imagechain.add_peer(message["data"])
+        """Handle the message waiting on a connection, then hand it back to the selector.
+
+        The connection is closed instead if the peer hung up or sent a malformed frame.
+        """
+        keep = False
+        try:
+            conn.settimeout(MESSAGE_TIMEOUT)
+            message = recv_message(conn)
+            try:
+                with metrics.timer("imagechain_p2p_message_seconds", type=message.get("type")):
+                    reply = self._handle_message(message)
+            except Exception as e:
+                logger.error("❌ Failed to handle %s message: %s", message.get("type"), e)
+                reply = None
+            if reply is not None:
+                send_message(conn, reply)
+            keep = True
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._slots.release()
+            if keep:
+                self._returned.put(conn)
+                self._waker.send(b"\0")
+            else:
+                conn.close()
+
+    def _handle_message(self, message):
+        """Dispatch one message; returns a reply message or None."""
+        if message["type"] == "block":
+            self.chain_sync.accept_gossip(message["data"], message.get("from"), self.peers | self.imagechain.peers)
+        elif message["type"] == "peer":
+            self.imagechain.add_peer(message["data"])
+        else:
+            return handle_sync_message(self.imagechain, message)
+        return None
 
     def connect_to_peer(self, peer_host, peer_port):
         """Connect to another peer."""
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((peer_host, int(peer_port)))
-            self.peers.add(f"{peer_host}:{peer_port}")
-            self.imagechain.add_peer(f"{peer_host}:{peer_port}")
-            s.send(json.dumps({"type": "peer", "data": f"{self.host}:{self.port}"}).encode())
-            print(f"Connected to peer {peer_host}:{peer_port}")
+        address = f"{peer_host}:{peer_port}"
+        self.pool.send(address, {"type": "peer", "data": f"{self.host}:{self.port}"})
+        self.peers.add(address)
+        self.imagechain.add_peer(address)
+        logger.info("Connected to peer %s:%s", peer_host, peer_port)
+
+    def sync(self, workers=8):
+        """Catch up with the longest chain among the known peers (headers first)."""
+        self.chain_sync.workers = workers
+        return self.chain_sync.sync(self.peers)
 
     def broadcast_block(self, block):
-        """Broadcast a new block to all peers."""
+        """Broadcast a new block to all peers over their pooled connections."""
+        frame = encode_frame({"type": "block", "data": block, "from": f"{self.host}:{self.port}"})
         for peer in self.peers:
             try:
-                host, port = peer.split(":")
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.connect((host, int(port)))
-                    s.send(json.dumps({"type": "block", "data": block}).encode())
-            except:
-                print(f"Failed to broadcast to {peer}")
+                self.pool.send_frame(peer, frame)
+            except (OSError, ValueError) as e:
+                metrics.inc("imagechain_p2p_broadcast_failures_total")
+                logger.warning("Failed to broadcast to %s: %s", peer, e)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("IMAGECHAIN_LOG_LEVEL", "INFO"), format="%(message)s")
     # Initialize the P2P node
     node1 = P2PNode("127.0.0.1", 5000)
     node1.start()
@@ -86,4 +172,4 @@ if __name__ == "__main__":
 
     # Print the blockchain
     print("🖼️ ImageChain Blocks:\n")
-    print(json.dumps(node1.imagechain.chain, indent=4))
\ No newline at end of file
+    print(json.dumps([block.to_dict() for block in node1.imagechain.chain], indent=4))
\ No newline at end of file
@@ -0,0 +1,178 @@
+import asyncio
+from collections import OrderedDict
+from functools import cached_property
+import logging
+import os
+from metrics import metrics
+from sync import ChainSync, handle_sync_message
+from wire import ConnectionPool, encode_frame, read_message, write_message
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncP2PNode:
+    """asyncio implementation of the P2P node that gossips blocks to its peers.
+
+    Blocks are sent to all peers concurrently, at most max_concurrency at a
+    time and each bounded by peer_timeout, so a slow or dead peer only delays
+    itself. Every block is relayed at most once: blocks are remembered by
+    file_hash (up to seen_limit of them) and never sent back to the peer
+    they came from. A received block is stored like a synced one: its image
+    is fetched from the sender and checked before the block is appended.
+    """
+
+    def __init__(self, host, port, imagechain=None, max_concurrency=32, peer_timeout=5.0, seen_limit=100000):
+        if imagechain is None:
+            from imagechain import ImageChain
+            imagechain = ImageChain()
+        self.host = host
+        self.port = port
+        self.address = f"{host}:{port}"
+        self.imagechain = imagechain
+        self.peers = set()
+        self.peer_timeout = peer_timeout
+        self.seen_limit = seen_limit
+        self._seen = OrderedDict()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._connections = {}  # peer address -> StreamWriter
+        self._peer_locks = {}
+        self._server = None
+        self.pool = ConnectionPool()  # Blocking requests (images, headers) made from executor threads
+
+    @cached_property
+    def chain_sync(self):
+        return ChainSync(self.imagechain, self.pool)  # Shared by every received block
+
+    async def start(self):
+        """Start accepting peer connections."""
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info("Node listening on %s:%s", self.host, self.port)
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for peer in list(self._connections):
+            await self._drop(peer)
+        self.pool.close_all()
+
+    async def _handle_connection(self, reader, writer):
+        """Handle framed messages from one peer until it disconnects."""
+        try:
+            while True:
+                try:
+                    message = await read_message(reader)
+                except (asyncio.IncompleteReadError, OSError, ValueError):
+                    return
+                try:
+                    with metrics.timer("imagechain_p2p_message_seconds", type=message.get("type")):
+                        reply = await self.handle_message(message)
+                except Exception as e:
+                    logger.error("❌ Failed to handle %s message: %s", message.get("type"), e)
+                    continue
+                if reply is not None:
+                    await write_message(writer, reply)
+        finally:
+            writer.close()
+
+    async def handle_message(self, message):
+        """Dispatch one message; returns a reply message or None."""
+        if message["type"] == "block":
+            block = message["data"]
+            if not self._mark_seen(block):
+                return None
+            loop = asyncio.get_running_loop()
+            accepted = await loop.run_in_executor(
+                None, self.chain_sync.accept_gossip, block, message.get("from"), set(self.peers)
+            )
+            if accepted:
+                # Relay to everyone except the peer that sent it
+                await self.broadcast_block(block, exclude={message.get("from")})
+        elif message["type"] == "peer":
+            self.peers.add(message["data"])
+            self.imagechain.add_peer(message["data"])
+        else:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, handle_sync_message, self.imagechain, message)
+        return None
+
+    def _mark_seen(self, block):
+        """Remember a block; returns False if it has been seen before."""
+        key = block["file_hash"]
+        if key in self._seen:
+            return False
+        self._seen[key] = None
+        if len(self._seen) > self.seen_limit:
+            self._seen.popitem(last=False)
+        return True
+
+    async def connect_to_peer(self, peer_host, peer_port):
+        """Connect to another peer and announce this node to it."""
+        address = f"{peer_host}:{peer_port}"
+        await self._send(address, encode_frame({"type": "peer", "data": self.address}))
+        self.peers.add(address)
+        self.imagechain.add_peer(address)
+        logger.info("Connected to peer %s", address)
+
+    async def broadcast_block(self, block, exclude=()):
+        """Gossip a block to all peers concurrently.
+
+        Returns a dict of peer address -> exception for peers that failed.
+        """
+        self._mark_seen(block)
+        frame = encode_frame({"type": "block", "data": block, "from": self.address})
+        targets = [peer for peer in self.peers if peer not in exclude]
+        results = await asyncio.gather(*(self._send(peer, frame) for peer in targets), return_exceptions=True)
+
+        failures = {}
+        for peer, result in zip(targets, results):
+            if isinstance(result, Exception):
+                failures[peer] = result
+                metrics.inc("imagechain_p2p_broadcast_failures_total")
+                logger.warning("Failed to broadcast to %s: %s: %s", peer, type(result).__name__, result)
+        return failures
+
+    async def _send(self, peer, frame):
+        async with self._semaphore:
+            try:
+                await asyncio.wait_for(self._write(peer, frame), self.peer_timeout)
+            except BaseException:
+                await self._drop(peer)
+                raise
+
+    async def _write(self, peer, frame):
+        lock = self._peer_locks.setdefault(peer, asyncio.Lock())
+        async with lock:
+            writer = self._connections.get(peer)
+            if writer is None or writer.is_closing():
+                host, port = peer.rsplit(":", 1)
+                _, writer = await asyncio.open_connection(host, int(port))
+                self._connections[peer] = writer
+            writer.write(frame)
+            await writer.drain()
+
+    async def _drop(self, peer):
+        writer = self._connections.pop(peer, None)
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("IMAGECHAIN_LOG_LEVEL", "INFO"), format="%(message)s")
+
+    async def main():
+        node = AsyncP2PNode("127.0.0.1", 5000)
+        await node.start()
+        await node.serve_forever()
+
+    asyncio.run(main())
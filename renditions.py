@@ -0,0 +1,136 @@
+from contextlib import contextmanager
+from io import BytesIO
+import logging
+import threading
+import gridfs
+from PIL import Image, features
+from metrics import metrics
+
+# Rendition name -> longest side in pixels
+RENDITION_SIZES = {"thumb": 320, "medium": 1024}
+# Format name -> (PIL format, content type)
+RENDITION_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+if not features.check("webp"):
+    del RENDITION_FORMATS["webp"]
+
+RENDITION_QUALITY = 80
+RENDITION_MAX_BYTES = 512 * 1024 * 1024
+CLEANUP_INTERVAL = 64  # Check the bucket size after this many new renditions
+
+logger = logging.getLogger(__name__)
+
+
+def rendition_key(file_id, size, format):
+    return f"{file_id}-{size}.{format}"
+
+
+class RenditionStore:
+    """Resized copies of chain images, kept in their own GridFS bucket.
+
+    Renditions are generated from the stored original on first request (or
+    eagerly from the decoded image when a block is sealed) and never modify
+    the original, whose embedded JSON must stay intact for verification.
+    They are only derived data, so the bucket is bounded: once it grows past
+    max_bytes the oldest renditions are deleted and regenerated on demand.
+    """
+
+    def __init__(self, imagechain, collection="renditions", max_bytes=RENDITION_MAX_BYTES, quality=RENDITION_QUALITY):
+        self.imagechain = imagechain
+        self.fs = gridfs.GridFS(imagechain.db, collection=collection)
+        self.files = imagechain.db[f"{collection}.files"]
+        self.files.create_index("filename")
+        self.files.create_index("file_id")
+        self.files.create_index("uploadDate")
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self._created = 0
+        self._locks = {}  # rendition key -> [lock, number of requests holding or waiting for it]
+        self._locks_lock = threading.Lock()
+
+    def get(self, file_id, size, format):
+        """Return the rendition's bytes, generating and storing it on first use.
+
+        Raises KeyError for unknown sizes or formats and gridfs.NoFile when
+        the original image does not exist.
+        """
+        if size not in RENDITION_SIZES or format not in RENDITION_FORMATS:
+            raise KeyError(f"Unknown rendition {size}.{format}")
+        key = rendition_key(file_id, size, format)
+        cached = self.imagechain.image_cache.get(key)
+        if cached is not None:
+            return cached
+
+        # One generator per rendition; concurrent requests wait for its result
+        with self._locked(key):
+            data = self._load(key)
+            if data is None:
+                original = Image.open(BytesIO(self.imagechain.read_image_from_mongodb(file_id)))
+                data = self._store(file_id, size, format, original)
+        self.imagechain.image_cache.put(key, data)
+        return data
+
+    def create_all(self, file_id, image):
+        """Store every rendition of a freshly sealed image (eager generation)."""
+        for size in RENDITION_SIZES:
+            for format in RENDITION_FORMATS:
+                self._store(file_id, size, format, image)
+
+    def delete(self, file_id):
+        """Delete every rendition of an image (e.g. one whose block was rolled back)."""
+        for document in self.files.find({"file_id": file_id}, {"filename": 1}):
+            self.fs.delete(document["_id"])
+            self.imagechain.image_cache.discard(document["filename"])
+
+    def content_type(self, format):
+        return RENDITION_FORMATS[format][1]
+
+    def cleanup(self):
+        """Delete the oldest renditions until the bucket is under 90% of max_bytes."""
+        totals = list(self.files.aggregate([{"$group": {"_id": None, "total": {"$sum": "$length"}}}]))
+        total = totals[0]["total"] if totals else 0
+        if total <= self.max_bytes:
+            return 0
+
+        removed = 0
+        for document in self.files.find({}, {"length": 1, "filename": 1}).sort("uploadDate", 1):
+            if total <= self.max_bytes * 0.9:
+                break
+            self.fs.delete(document["_id"])
+            self.imagechain.image_cache.discard(document["filename"])
+            total -= document["length"]
+            removed += 1
+        logger.info("🧹 Removed %d old renditions", removed)
+        return removed
+
+    def _load(self, key):
+        grid_out = self.fs.find_one({"filename": key})
+        return grid_out.read() if grid_out is not None else None
+
+    def _store(self, file_id, size, format, image):
+        with metrics.timer("imagechain_rendition_seconds", size=size, format=format):
+            rendition = image.convert("RGB")
+            rendition.thumbnail((RENDITION_SIZES[size],) * 2, Image.LANCZOS)
+            buffer = BytesIO()
+            rendition.save(buffer, RENDITION_FORMATS[format][0], quality=self.quality)
+        data = buffer.getvalue()
+        self.fs.put(data, filename=rendition_key(file_id, size, format), file_id=file_id, rendition=size, format=format)
+
+        self._created += 1
+        if self._created % CLEANUP_INTERVAL == 0:
+            self.cleanup()
+        return data
+
+    @contextmanager
+    def _locked(self, key):
+        """Hold key's lock; it is forgotten only once no request holds or waits for it."""
+        with self._locks_lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._locks_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
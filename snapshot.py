@@ -0,0 +1,273 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
+import hashlib
+import heapq
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from block import Block, encode, header_hash
+from merkle import build_levels
+
+# Layout: header; (count + 1) little-endian uint64 offsets into the data
+# section; every level of the Merkle tree over the block headers (32-byte
+# nodes, leaves first); the file_hash and file_id lookup tables; then each
+# block's canonical encoding back to back
+MAGIC = b"ICSNAP"
+VERSION = 2
+PREFIX = struct.Struct("<6sH")  # magic, version
+HEADER = struct.Struct("<6sHQQQ")  # magic, version, block count, file_hash and file_id table entries
+OFFSET = struct.Struct("<Q")
+ENTRY = struct.Struct("<8sQ")  # lookup key, block index; tables are sorted by key, then index
+NODE_SIZE = 32
+LOOKUP_FIELDS = ("file_hash", "file_id")
+SNAPSHOT_INTERVAL = 1000  # Write a new snapshot once this many blocks were added
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot file is truncated, foreign or of another version."""
+
+
+def lookup_key(value):
+    """The 8-byte key a file_hash or file_id is filed under in a snapshot's lookup tables."""
+    return hashlib.sha256(str(value).encode()).digest()[:8]
+
+
+def level_sizes(count):
+    """Node counts of the Merkle tree levels over count leaves, leaves first."""
+    sizes = [count] if count else []
+    while sizes and sizes[-1] > 1:
+        sizes.append((sizes[-1] + 1) // 2)
+    return sizes
+
+
+class _TableKeys:
+    """The keys of a lookup table, as a sequence bisect can search."""
+
+    def __init__(self, buffer, start, entries):
+        self._buffer = buffer
+        self._start = start
+        self._entries = entries
+
+    def __len__(self):
+        return self._entries
+
+    def __getitem__(self, position):
+        offset = self._start + position * ENTRY.size
+        return self._buffer[offset:offset + 8]
+
+
+class ChainSnapshot:
+    """Read-only, memory-mapped view of a snapshot file.
+
+    Opening one only reads the header; each block's encoding, the Merkle
+    tree levels and the file_hash / file_id lookups are read out of the
+    mapping when they are asked for, so neither opening the snapshot nor
+    indexing the chain it holds grows with the chain.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < PREFIX.size:
+                raise SnapshotError(f"{path} is too short to be a snapshot")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = PREFIX.unpack_from(self._map)
+        if magic != MAGIC:
+            raise SnapshotError(f"{path} is not a chain snapshot")
+        if version != VERSION:
+            raise SnapshotError(f"{path} is snapshot version {version}, expected {VERSION}")
+        if size < HEADER.size:
+            raise SnapshotError(f"{path} is truncated")
+        _, _, self.count, hash_entries, id_entries = HEADER.unpack_from(self._map)
+
+        position = HEADER.size + (self.count + 1) * OFFSET.size
+        self._levels = []
+        for nodes in level_sizes(self.count):
+            self._levels.append((position, nodes))
+            position += nodes * NODE_SIZE
+        self._tables = {}
+        for field, entries in zip(LOOKUP_FIELDS, (hash_entries, id_entries)):
+            self._tables[field] = (position, entries)
+            position += entries * ENTRY.size
+        self._data = position
+        if size < self._data:
+            raise SnapshotError(f"{path} is truncated")
+        if self._data + self._offset(self.count) != size:
+            raise SnapshotError(f"{path} is truncated")
+
+    def __len__(self):
+        return self.count
+
+    def _offset(self, index):
+        return OFFSET.unpack_from(self._map, HEADER.size + index * OFFSET.size)[0]
+
+    def merkle_levels(self):
+        """(buffer of 32-byte nodes, node count) for each Merkle tree level, leaves first."""
+        view = memoryview(self._map)
+        return [(view[start:start + nodes * NODE_SIZE], nodes) for start, nodes in self._levels]
+
+    def leaves(self, count):
+        """Yield the Merkle leaves (header hashes) of the first count blocks."""
+        start = self._levels[0][0] if self._levels else 0
+        for position in range(count):
+            yield self._map[start + position * NODE_SIZE:start + (position + 1) * NODE_SIZE]
+
+    def entries(self, field):
+        """Yield the (key, index) entries of a lookup table in sorted order."""
+        start, entries = self._tables[field]
+        return ENTRY.iter_unpack(self._map[start:start + entries * ENTRY.size])
+
+    def find(self, field, value):
+        """Return the lowest index of a block whose field (file_hash or file_id) is value, or None."""
+        start, entries = self._tables[field]
+        key = lookup_key(value)
+        position = bisect_left(_TableKeys(self._map, start, entries), key)
+        while position < entries:
+            entry_key, index = ENTRY.unpack_from(self._map, start + position * ENTRY.size)
+            if entry_key != key:
+                break
+            # Keys are truncated hashes: confirm against the block itself
+            if self.block(index).get(field) == value:
+                return index
+            position += 1
+        return None
+
+    def encoding(self, index):
+        """Canonical encoding (Block.encoding) of block index."""
+        return self._map[self._data + self._offset(index):self._data + self._offset(index + 1)]
+
+    def block(self, index):
+        return Block.from_encoding(self.encoding(index))
+
+
+def open_snapshot(path):
+    """Open the snapshot at path, or return None if it is missing or unreadable."""
+    try:
+        return ChainSnapshot(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, SnapshotError) as e:
+        logger.warning("⚠️ Ignoring chain snapshot %s: %s", path, e)
+        return None
+
+
+def chain_encodings(chain, count, start=0):
+    """Yield the canonical encodings of chain's blocks start..count-1 (snapshot blocks stay undecoded)."""
+    if isinstance(chain, SnapshotChain):
+        return chain.encodings(count, start)
+    return (encode(block) for block in chain[start:count])
+
+
+def chain_index(chain, count):
+    """Merkle leaves and sorted lookup tables for the first count blocks of chain.
+
+    The blocks of a snapshot chain's snapshot are taken from its own leaves
+    and tables, so only the blocks added since are hashed.
+    """
+    snapshot = chain.snapshot if isinstance(chain, SnapshotChain) else None
+    reused = min(len(snapshot), count) if snapshot is not None else 0
+    leaves = [bytes(leaf) for leaf in snapshot.leaves(reused)] if reused else []
+    added = {field: [] for field in LOOKUP_FIELDS}
+    for position in range(reused, count):
+        block = chain[position]
+        leaves.append(header_hash(block))
+        for field in LOOKUP_FIELDS:
+            if block.get(field) is not None:
+                added[field].append((lookup_key(block[field]), position))
+
+    tables = {}
+    for field in LOOKUP_FIELDS:
+        stored = (entry for entry in snapshot.entries(field) if entry[1] < reused) if reused else ()
+        tables[field] = list(heapq.merge(stored, sorted(added[field])))
+    return leaves, tables
+
+
+def write_snapshot(path, chain, count=None):
+    """Write the first count blocks of chain (default: all) to path atomically."""
+    count = len(chain) if count is None else count
+    leaves, tables = chain_index(chain, count)
+    levels = build_levels(leaves) if count else []
+    encodings = chain_encodings(chain, count)
+    offsets = array("Q", [0])
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # The offsets are only known once the data is written; leave room for them
+            f.seek(
+                HEADER.size + (count + 1) * OFFSET.size
+                + sum(len(level) for level in levels) * NODE_SIZE
+                + sum(len(table) for table in tables.values()) * ENTRY.size
+            )
+            for encoding in encodings:
+                f.write(encoding)
+                offsets.append(offsets[-1] + len(encoding))
+            if sys.byteorder != "little":
+                offsets.byteswap()
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, count, *(len(tables[field]) for field in LOOKUP_FIELDS)))
+            f.write(offsets.tobytes())
+            for level in levels:
+                f.write(b"".join(level))
+            for field in LOOKUP_FIELDS:
+                f.write(b"".join(ENTRY.pack(*entry) for entry in tables[field]))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return count
+
+
+class SnapshotChain(Sequence):
+    """The in-memory chain: a mapped snapshot followed by the blocks added since.
+
+    Snapshot blocks are decoded on first access and then kept, so loading a
+    chain of any length costs one header read plus the newer blocks.
+    """
+
+    def __init__(self, snapshot, tail=()):
+        self.snapshot = snapshot
+        self._blocks = [None] * len(snapshot)
+        self._blocks.extend(tail)
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self._blocks)))]
+        block = self._blocks[index]
+        if block is None:
+            if index < 0:
+                index += len(self._blocks)
+            block = self._blocks[index] = self.snapshot.block(index)
+        return block
+
+    def __iter__(self):
+        for position in range(len(self._blocks)):
+            yield self[position]
+
+    def append(self, block):
+        self._blocks.append(block)
+
+    def extend(self, blocks):
+        self._blocks.extend(blocks)
+
+    def encodings(self, count, start=0):
+        """Yield the canonical encodings of blocks start..count-1 without decoding them."""
+        for position in range(start, count):
+            block = self._blocks[position]
+            yield encode(block) if block is not None else self.snapshot.encoding(position)
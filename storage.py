@@ -0,0 +1,298 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+import logging
+import time
+import uuid
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from block import Block
+
+LEGACY_CHAIN_ID = "imagechain"
+LEGACY_MIGRATION_ID = "single_document_chain"
+MIGRATION_LEASE_SECONDS = 300  # A claim older than this is taken to be from a crashed migration
+MIGRATION_POLL_SECONDS = 0.5
+# A re-uploaded image in a legacy chain repeats its file_hash and the next block's previous_hash
+LINK_FIELDS = ("file_hash", "previous_hash")
+JOB_RETENTION_SECONDS = 7 * 24 * 3600  # Finished upload jobs are forgotten after a week
+
+logger = logging.getLogger(__name__)
+
+
+class ChainConflictError(ValueError):
+    """Raised when a block does not extend the stored chain tip."""
+
+
+class LegacyChainError(ValueError):
+    """Raised when the legacy single-document chain cannot be migrated as it is."""
+
+
+class BlockStore:
+    """Stores the chain in MongoDB as one document per block.
+
+    Unique indexes on index, file_hash and previous_hash mean two writers that
+    both try to extend the same tip cannot both succeed, so the chain cannot
+    fork even when several processes append concurrently. Blocks are read
+    back as Block objects and written as plain documents.
+
+    Legacy chains may hold the same image twice; when they do, the migrated
+    blocks are exempt from the file_hash and previous_hash indexes (which
+    then only cover blocks added after them).
+    """
+
+    def __init__(self, db, collection="blocks"):
+        self.db = db
+        self.collection = db[collection]
+        self.migrations = db["migrations"]
+        migration = self.migrations.find_one({"_id": LEGACY_MIGRATION_ID}) or {}
+        self._migrated = migration.get("state", "done") == "done" if migration else False
+        self.ensure_indexes(exempt=migration.get("exempt", 0))
+
+    def ensure_indexes(self, collection=None, exempt=0):
+        """Create missing indexes; the first exempt blocks are left out of the file_hash and previous_hash ones."""
+        collection = self.collection if collection is None else collection
+        existing = collection.index_information()
+        indexes = [("index", {"unique": True})]
+        partial = {"partialFilterExpression": {"index": {"$gte": exempt}}} if exempt else {}
+        indexes += [(field, dict(unique=True, **partial)) for field in LINK_FIELDS]
+        indexes.append(("file_id", {}))
+        for field, options in indexes:
+            if f"{field}_1" not in existing:
+                collection.create_index([(field, ASCENDING)], **options)
+
+    def count(self):
+        return self.collection.count_documents({})
+
+    def get(self, index):
+        """Return the block at index, or None."""
+        return self._find_one({"index": index})
+
+    def find_by_file_id(self, file_id):
+        return self._find_one({"file_id": file_id})
+
+    def find_by_file_hash(self, file_hash):
+        return self._find_one({"file_hash": file_hash})
+
+    def _find_one(self, query):
+        # The first block holding an image, should a legacy chain hold it twice
+        document = self.collection.find_one(query, {"_id": 0}, sort=[("index", ASCENDING)])
+        return Block(document) if document is not None else None
+
+    def range(self, start=0, stop=None):
+        """Return blocks with start <= index < stop in chain order."""
+        query = {"index": {"$gte": start}}
+        if stop is not None:
+            query["index"]["$lt"] = stop
+        return [Block(document) for document in self.collection.find(query, {"_id": 0}).sort("index", ASCENDING)]
+
+    def page(self, after=-1, limit=50):
+        """Return up to limit blocks with index > after in chain order (cursor paging)."""
+        cursor = self.collection.find({"index": {"$gt": after}}, {"_id": 0}).sort("index", ASCENDING)
+        return [Block(document) for document in cursor.limit(limit)]
+
+    def tail(self, count=1):
+        """Return the last count blocks in chain order."""
+        blocks = self.collection.find({}, {"_id": 0}).sort("index", DESCENDING).limit(count)
+        return [Block(document) for document in blocks][::-1]
+
+    def load_all(self):
+        return self.range(0)
+
+    def append(self, block):
+        """Insert block if it extends the current tip, else raise ChainConflictError."""
+        tip = self.tail(1)
+        expected_index = tip[0]["index"] + 1 if tip else 0
+        expected_previous = tip[0]["file_hash"] if tip else "0"
+        if block["index"] != expected_index or block["previous_hash"] != expected_previous:
+            raise ChainConflictError(
+                f"Block {block['index']} does not extend the chain tip (expected index {expected_index})"
+            )
+
+        try:
+            self.collection.insert_one(Block.from_dict(block).to_dict())
+        except DuplicateKeyError as e:
+            raise ChainConflictError(f"Block {block['index']} conflicts with a stored block: {e}")
+
+    def append_many(self, blocks):
+        """Insert consecutive blocks extending the tip with a single bulk write.
+
+        Either every block is stored or none is: if the insert fails part way,
+        the blocks it did store are removed before ChainConflictError is raised.
+        """
+        if not blocks:
+            return
+        tip = self.tail(1)
+        previous = tip[0] if tip else None
+        for block in blocks:
+            expected_index = previous["index"] + 1 if previous else 0
+            expected_previous = previous["file_hash"] if previous else "0"
+            if block["index"] != expected_index or block["previous_hash"] != expected_previous:
+                raise ChainConflictError(
+                    f"Block {block['index']} does not extend the chain tip (expected index {expected_index})"
+                )
+            previous = block
+
+        try:
+            self.collection.insert_many([Block.from_dict(block).to_dict() for block in blocks], ordered=True)
+        except BulkWriteError as e:
+            self.collection.delete_many({
+                "index": {"$in": [block["index"] for block in blocks]},
+                "file_id": {"$in": [block.get("file_id") for block in blocks]}
+            })
+            errors = e.details.get("writeErrors") or [{}]
+            raise ChainConflictError(f"Batch of {len(blocks)} blocks conflicts with stored blocks: {errors[0].get('errmsg')}")
+
+    def migrated(self):
+        """True once the legacy single-document chain has been migrated (or found absent)."""
+        if not self._migrated:
+            migration = self.migrations.find_one({"_id": LEGACY_MIGRATION_ID}, {"state": 1})
+            self._migrated = migration is not None and migration.get("state", "done") == "done"
+        return self._migrated
+
+    def migrate_from_single_document(self, legacy_collection="blockchain"):
+        """Copy blocks from the legacy {"_id": "imagechain"} chain document.
+
+        Only one process migrates: it claims the migration in the migrations
+        collection first, and the others wait for it to finish. A legacy
+        chain holding the same image twice is migrated with those blocks
+        exempt from the file_hash and previous_hash indexes; one that forked
+        (two blocks with one index) raises LegacyChainError naming them, as
+        nothing is copied that would not fit the index unique index. Blocks
+        are inserted into a temporary collection that is renamed over this
+        one, so an interrupted migration is simply run again. Returns the
+        number of blocks copied.
+        """
+        if self.migrated():
+            return 0
+        claim = self._claim_migration()
+        if claim is None:
+            self._wait_for_migration()
+            return 0
+        try:
+            copied, exempt = self._migrate(legacy_collection)
+        except BaseException:
+            self.migrations.delete_one({"_id": LEGACY_MIGRATION_ID, "owner": claim})
+            raise
+        self.migrations.update_one(
+            {"_id": LEGACY_MIGRATION_ID, "owner": claim},
+            {"$set": {"state": "done", "exempt": exempt, "completed": str(datetime.now())}}
+        )
+        self._migrated = True
+        return copied
+
+    def _claim_migration(self):
+        """Atomically claim the migration; returns the claim token, or None if another process holds it."""
+        token = uuid.uuid4().hex
+        now = time.time()
+        try:
+            self.migrations.insert_one(
+                {"_id": LEGACY_MIGRATION_ID, "state": "running", "owner": token, "expires": now + MIGRATION_LEASE_SECONDS}
+            )
+            return token
+        except DuplicateKeyError:
+            pass
+        # Take over a claim whose owner died mid-migration
+        taken = self.migrations.find_one_and_update(
+            {"_id": LEGACY_MIGRATION_ID, "state": "running", "expires": {"$lt": now}},
+            {"$set": {"owner": token, "expires": now + MIGRATION_LEASE_SECONDS}}
+        )
+        return token if taken is not None else None
+
+    def _wait_for_migration(self):
+        deadline = time.monotonic() + MIGRATION_LEASE_SECONDS
+        while not self.migrated():
+            if self.migrations.find_one({"_id": LEGACY_MIGRATION_ID}) is None:
+                # The other process failed and released its claim
+                raise LegacyChainError("The single-document chain migration failed in another process")
+            if time.monotonic() > deadline:
+                raise LegacyChainError("Timed out waiting for another process to migrate the single-document chain")
+            time.sleep(MIGRATION_POLL_SECONDS)
+        self.ensure_indexes(exempt=self.migrations.find_one({"_id": LEGACY_MIGRATION_ID}).get("exempt", 0))
+
+    def _migrate(self, legacy_collection):
+        """Copy the legacy chain under a claim; returns (blocks copied, blocks exempt from the link indexes)."""
+        legacy = self.db[legacy_collection].find_one({"_id": LEGACY_CHAIN_ID})
+        blocks = [Block.from_dict(block).to_dict() for block in (legacy or {}).get("chain") or []]
+
+        forks = [(value, positions) for field, value, positions in legacy_conflicts(blocks) if field == "index"]
+        if forks:
+            raise LegacyChainError(
+                "Cannot migrate the single-document chain, it forked: "
+                + "; ".join(f"index {value!r} at positions {positions}" for value, positions in forks)
+            )
+        exempt = len(blocks) if legacy_conflicts(blocks) else 0
+        if exempt:
+            logger.warning("⚠️ The single-document chain holds the same image more than once; keeping those blocks as they are.")
+
+        # Blocks stored earlier (by an interrupted migration or an older release) must agree with it
+        stored = self.load_all()
+        if any(
+            block["file_hash"] != blocks[position].get("file_hash")
+            for position, block in enumerate(stored[:len(blocks)])
+        ):
+            raise LegacyChainError(
+                f"The {self.collection.name} collection does not match the single-document chain; not migrating"
+            )
+
+        copied = max(len(blocks) - len(stored), 0)
+        if copied:
+            temp = self.db[f"{self.collection.name}_migration_{uuid.uuid4().hex}"]
+            self.ensure_indexes(temp, exempt)
+            try:
+                temp.insert_many(blocks, ordered=True)
+                temp.rename(self.collection.name, dropTarget=True)
+            except Exception:
+                temp.drop()
+                raise
+            logger.info("✅ Migrated %d blocks from the single-document chain", copied)
+        return copied, exempt
+
+
+def legacy_conflicts(blocks):
+    """Return (field, value, positions) for every unique field value shared by several blocks."""
+    conflicts = []
+    for field in ("index",) + LINK_FIELDS:
+        positions = defaultdict(list)
+        for position, block in enumerate(blocks):
+            if field in block:
+                positions[block[field]].append(position)
+        conflicts.extend((field, value, found) for value, found in positions.items() if len(found) > 1)
+    return conflicts
+
+
+class UploadIndex:
+    """Maps the SHA-256 of an upload's raw bytes to its block's file_hash.
+
+    Only uploads whose bytes differ from their PNG form (JPEGs and the like)
+    need an entry: for a PNG upload the raw digest is the file_hash itself.
+    """
+
+    def __init__(self, db, collection="uploads"):
+        self.collection = db[collection]
+
+    def get(self, digest):
+        document = self.collection.find_one({"_id": digest})
+        return document["file_hash"] if document else None
+
+    def add(self, digest, file_hash):
+        if digest != file_hash:
+            self.collection.update_one({"_id": digest}, {"$set": {"file_hash": file_hash}}, upsert=True)
+
+
+class JobStore:
+    """Upload job status shared by every worker process.
+
+    Each job's status dictionary is upserted whenever it changes, so
+    /jobs/<id> can be answered by a worker other than the one ingesting the
+    upload. MongoDB removes jobs JOB_RETENTION_SECONDS after their last update.
+    """
+
+    def __init__(self, db, collection="jobs"):
+        self.collection = db[collection]
+        self.collection.create_index([("expires", ASCENDING)], expireAfterSeconds=0)
+
+    def get(self, job_id):
+        return self.collection.find_one({"_id": job_id}, {"_id": 0, "expires": 0})
+
+    def save(self, status):
+        expires = datetime.fromtimestamp(time.time() + JOB_RETENTION_SECONDS, timezone.utc)
+        self.collection.replace_one({"_id": status["job_id"]}, dict(status, expires=expires), upsert=True)
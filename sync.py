@@ -0,0 +1,263 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+from itertools import cycle
+from pymongo import ASCENDING, DESCENDING
+from block import Block
+from headers import check_header
+from verifier import OK, check_block, extract_json_from_bytes
+
+HEADER_BATCH_SIZE = 2000  # Headers per get_headers request
+IMAGE_BATCH_SIZE = 256  # Images fetched in parallel before committing their blocks
+
+logger = logging.getLogger(__name__)
+
+
+class SyncError(Exception):
+    """Raised when a chain cannot be synced from the available peers."""
+
+
+def block_header(block):
+    """The block as embedded in its image: everything except the local file_id."""
+    return Block.from_dict(block).header()
+
+
+def handle_sync_message(imagechain, message):
+    """Answer a sync request from a peer; returns the reply, or None if not a sync message."""
+    kind = message["type"]
+    if kind == "get_tip":
+        tip = imagechain.chain[-1] if imagechain.chain else None
+        return {"type": "tip", "data": {
+            "index": tip["index"] if tip else -1,
+            "hash": tip["file_hash"] if tip else None,
+            "root": imagechain.merkle_root(),
+        }}
+    if kind == "get_headers":
+        start = int(message["data"]["start"])
+        count = min(int(message["data"].get("count", HEADER_BATCH_SIZE)), HEADER_BATCH_SIZE)
+        blocks = imagechain.store.range(start, start + count)
+        return {"type": "headers", "data": [block_header(block) for block in blocks]}
+    if kind == "get_image":
+        file_hash = message["data"]["file_hash"]
+        block = imagechain.store.find_by_file_hash(file_hash)
+        if block is None:
+            return {"type": "error", "data": f"No block with file_hash {file_hash}"}
+        image_bytes = imagechain.read_image_from_mongodb(block["file_id"])
+        return {"type": "image", "data": {"file_hash": file_hash, "image": image_bytes}}
+    if kind == "get_proof":
+        index = int(message["data"]["index"])
+        if not 0 <= index < len(imagechain.chain):
+            return {"type": "error", "data": f"No block {index}"}
+        return {"type": "proof", "data": imagechain.merkle_proof(index)}
+    return None
+
+
+class ChainSync:
+    """Headers-first catch-up of a local chain from its peers.
+
+    The longest peer's block headers are downloaded in batches and checked for
+    linkage and proof of work without touching any image. Validated headers
+    are kept in a staging collection, and their images are then fetched in
+    parallel, spread over every peer that has them, and checked against the
+    JSON embedded in them before the blocks are committed in index order.
+    Staged headers and fetched images (tagged with their file_hash in the blob store)
+    survive an interruption, so a later sync resumes where this one stopped.
+    """
+
+    def __init__(self, imagechain, pool, workers=8, collection="sync_headers"):
+        self.imagechain = imagechain
+        self.pool = pool  # wire.ConnectionPool
+        self.workers = workers
+        self.peer_roots = {}  # Merkle root each peer reported with its tip
+        self.pending = imagechain.db[collection]
+        self.pending.create_index([("index", ASCENDING)], unique=True)
+
+    def sync(self, peers):
+        """Catch up with the longest of peers. Returns the number of blocks added."""
+        tips = self.peer_tips(peers)
+        tip = self._local_tip()
+        local_index = tip["index"] if tip else -1
+
+        # Equal roots mean identical chains; equal lengths with different roots mean a fork
+        local_root = self.imagechain.merkle_root()
+        for peer, index in tips.items():
+            if index == local_index and self.peer_roots.get(peer) not in (None, local_root):
+                logger.warning("⚠️ %s has a chain of the same length with a different Merkle root", peer)
+
+        if not tips or max(tips.values()) <= local_index:
+            self._discard_pending(local_index)
+            return 0
+
+        source = max(tips, key=tips.get)
+        self.download_headers(source, tips[source])
+        return self.download_images(tips)
+
+    def accept_block(self, block, peers):
+        """Commit a block gossiped by a peer the same way sync commits blocks.
+
+        A block extending the local tip has its image fetched from peers (in
+        order, so put the sender first), checked against the embedded JSON
+        and stored before the block is appended; a block further ahead
+        triggers a full sync. Returns the number of blocks added.
+        """
+        header = block_header(block)
+        tip = self._local_tip()
+        local_index = tip["index"] if tip else -1
+        if header["index"] <= local_index:
+            return 0
+        if header["index"] > local_index + 1:
+            return self.sync(peers)
+
+        error = check_header(header, tip, self.imagechain.target_bits())
+        if error:
+            raise SyncError(f"Invalid block {header['index']}: {error}")
+        self._commit([dict(header, file_id=self._fetch_image(header, list(peers), 0))])
+        return 1
+
+    def accept_gossip(self, block, sender=None, peers=()):
+        """Store a block a node received from sender, fetching its image from sender first.
+
+        Other peers are asked for the image if sender cannot serve it. Blocks
+        that are invalid or whose image nobody serves are logged and refused.
+        Returns True if the block (and any blocks it needed) was added.
+        """
+        order = [sender] if sender else []
+        order += [peer for peer in peers if peer != sender]
+        try:
+            added = self.accept_block(block, order)
+        except (SyncError, ValueError, OSError) as e:
+            logger.warning("Invalid block received: %s", e)
+            return False
+        if added:
+            logger.info("New block added: %s", block["index"])
+        return bool(added)
+
+    def peer_tips(self, peers):
+        """Ask peers for their tip index; returns {address: index} for those that answered."""
+        def ask(peer):
+            try:
+                tip = self.pool.request(peer, {"type": "get_tip"})["data"]
+                self.peer_roots[peer] = tip.get("root")
+                return peer, tip["index"]
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning("⚠️ Could not get the chain tip from %s: %s", peer, e)
+                return peer, None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            answers = list(executor.map(ask, list(peers)))
+        return {peer: index for peer, index in answers if index is not None}
+
+    def download_headers(self, peer, tip_index):
+        """Stage and validate headers from peer up to tip_index."""
+        previous = self._last_pending() or self._local_tip()
+        bits = self.imagechain.target_bits()
+        start = previous["index"] + 1 if previous else 0
+
+        while start <= tip_index:
+            reply = self.pool.request(peer, {"type": "get_headers", "data": {"start": start, "count": HEADER_BATCH_SIZE}})
+            headers = reply.get("data") or []
+            if reply.get("type") != "headers" or not headers:
+                raise SyncError(f"{peer} sent no headers from block {start}")
+            for header in headers:
+                error = check_header(header, previous, bits)
+                if error:
+                    raise SyncError(f"Invalid header from {peer}: {error}")
+                previous = header
+            self.pending.insert_many([dict(header) for header in headers], ordered=True)
+            start = previous["index"] + 1
+            logger.info("📥 Headers up to block %d of %d", previous["index"], tip_index)
+
+    def download_images(self, tips):
+        """Fetch images for staged headers and commit their blocks in order."""
+        added = 0
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            while True:
+                headers = list(self.pending.find({}, {"_id": 0}).sort("index", ASCENDING).limit(IMAGE_BATCH_SIZE))
+                if not headers:
+                    return added
+
+                peers = [peer for peer, index in tips.items() if index >= headers[-1]["index"]]
+                if not peers:
+                    raise SyncError(f"No peer has block {headers[-1]['index']}")
+                futures = [
+                    executor.submit(self._fetch_image, header, peers, first)
+                    for header, first in zip(headers, cycle(range(len(peers))))
+                ]
+
+                blocks = []
+                error = None
+                for header, future in zip(headers, futures):
+                    try:
+                        blocks.append(dict(header, file_id=future.result()))
+                    except SyncError as e:
+                        error = e
+                        break
+                self._commit(blocks)
+                added += len(blocks)
+                if error:
+                    raise error
+        finally:
+            executor.shutdown(wait=True)
+
+    def _fetch_image(self, header, peers, first):
+        """Store a verified copy of header's image and return its file_id.
+
+        Peers are tried in turn starting at peers[first]; an image already
+        fetched by an interrupted sync is reused.
+        """
+        blobs = self.imagechain.blobs
+        existing = blobs.find("file_hash", header["file_hash"])
+        if existing is not None:
+            return existing
+
+        problems = []
+        for peer in peers[first:] + peers[:first]:
+            try:
+                reply = self.pool.request(peer, {"type": "get_image", "data": {"file_hash": header["file_hash"]}})
+                if reply.get("type") != "image":
+                    raise ValueError(reply.get("data"))
+                image_bytes = reply["data"]["image"]
+                status, detail = check_block(header, extract_json_from_bytes(image_bytes))
+                if status != OK:
+                    raise ValueError(detail)
+            except Exception as e:
+                problems.append(f"{peer}: {e}")
+                continue
+            return blobs.put(
+                image_bytes,
+                filename=f"{header['file_hash']}.png",
+                file_hash=header["file_hash"],
+                sha256=hashlib.sha256(image_bytes).hexdigest()
+            )
+        raise SyncError(f"Could not fetch the image for block {header['index']} ({'; '.join(problems)})")
+
+    def _commit(self, blocks):
+        if not blocks:
+            return
+        with self.imagechain.lock:
+            self.imagechain.store.append_many(blocks)
+            self.imagechain.chain.extend(Block.from_dict(block) for block in blocks)
+            self.imagechain.maybe_snapshot()
+        self.pending.delete_many({"index": {"$lte": blocks[-1]["index"]}})
+        logger.info("✅ Synced blocks up to %d", blocks[-1]["index"])
+
+    def _local_tip(self):
+        return self.imagechain.chain[-1] if self.imagechain.chain else None
+
+    def _last_pending(self):
+        """Return the newest staged header, dropping staged headers that no longer fit the chain."""
+        tip = self._local_tip()
+        local_index = tip["index"] if tip else -1
+        self._discard_pending(local_index)
+        first = self.pending.find_one({}, {"_id": 0}, sort=[("index", ASCENDING)])
+        if first is None:
+            return None
+        if check_header(first, tip, self.imagechain.target_bits()) is not None:
+            # The local chain moved since these headers were staged
+            self.pending.delete_many({})
+            return None
+        return self.pending.find_one({}, {"_id": 0}, sort=[("index", DESCENDING)])
+
+    def _discard_pending(self, local_index):
+        self.pending.delete_many({"index": {"$lte": local_index}})
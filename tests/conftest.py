@@ -0,0 +1,45 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+mongomock = pytest.importorskip("mongomock")
+import mongomock.gridfs  # noqa: E402
+
+mongomock.gridfs.enable_gridfs_integration()
+
+
+@pytest.fixture
+def client():
+    return mongomock.MongoClient()
+
+
+@pytest.fixture
+def db(client):
+    return client["imagechain_test"]
+
+
+@pytest.fixture
+def imagechain(client, db):
+    from imagechain import ImageChain
+
+    chain = ImageChain(client=client, db_name=db.name, snapshot_path=False)
+    chain.difficulty_bits = 4  # Keep proof of work instant
+    chain.verify_processes = 1
+    return chain
+
+
+@pytest.fixture
+def make_image(tmp_path):
+    """Write a small random PNG and return its path; each seed gives a different image."""
+    import numpy as np
+    from PIL import Image
+
+    def make(seed, size=(32, 24)):
+        pixels = np.random.default_rng(seed).integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+        path = str(tmp_path / f"image{seed}.png")
+        Image.fromarray(pixels).save(path)
+        return path
+
+    return make
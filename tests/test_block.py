@@ -0,0 +1,34 @@
+import hashlib
+from block import HEADER_HASH_PREFIX, Block, encode, encode_header
+
+
+def make_block():
+    return Block(index=3, file_hash="ab" * 32, previous_hash="cd" * 32, nonce=7,
+                 timestamp="2024-01-01 00:00:00", signature="sig", message="msg", file_id="f1")
+
+
+def test_only_the_header_hash_is_cached():
+    assert "_encoding" not in Block.__slots__ and "_header_bytes" not in Block.__slots__
+    block = make_block()
+    assert block.header_hash is block.header_hash
+    assert block.header_hash == hashlib.sha256(HEADER_HASH_PREFIX + block.header_bytes).digest()
+
+
+def test_encodings_match_plain_dicts():
+    block = make_block()
+    assert encode(block) == encode(block.to_dict())
+    assert encode_header(block) == encode_header(block.to_dict())
+    assert b"file_id" in block.encoding and b"file_id" not in block.header_bytes
+    assert Block.from_encoding(block.encoding) == block
+
+
+def test_assignment_drops_the_hash_unless_file_id():
+    block = make_block()
+    digest = block.header_hash
+    block["file_id"] = "f2"
+    assert block.header_hash is digest
+    assert b'"f2"' in block.encoding
+
+    block["message"] = "other"
+    assert block.header_hash != digest
+    assert block.header_hash == Block(block.to_dict()).header_hash
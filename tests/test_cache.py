@@ -0,0 +1,46 @@
+import os
+from cache import ImageCache
+from metrics import metrics
+
+
+def spill_usage(directory):
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if not entry.name.startswith("."))
+
+
+def test_spill_dir_is_bounded(tmp_path):
+    cache = ImageCache(100, spill_dir=str(tmp_path), spill_max_bytes=250)
+    for number in range(10):
+        cache.put(f"image{number}", bytes([number]) * 60)
+
+    assert cache.spill_size <= 250
+    assert spill_usage(tmp_path) == cache.spill_size
+    # The most recently evicted images are the ones kept
+    assert cache.get("image7") == bytes([7]) * 60
+    assert cache.get("image0") is None
+
+
+def test_spill_dir_is_trimmed_to_a_lowered_cap(tmp_path):
+    cache = ImageCache(100, spill_dir=str(tmp_path))
+    for number in range(10):
+        cache.put(f"image{number}", bytes([number]) * 60)
+    assert spill_usage(tmp_path) == 540
+
+    reopened = ImageCache(100, spill_dir=str(tmp_path), spill_max_bytes=200)
+    assert reopened.spill_size <= 200
+    assert spill_usage(tmp_path) == reopened.spill_size
+
+
+def test_named_cache_reports_to_metrics(tmp_path):
+    cache = ImageCache(100, spill_dir=str(tmp_path), name="test_images")
+    for number in range(3):
+        cache.put(f"image{number}", bytes([number]) * 60)
+    cache.get("image2")
+    cache.get("image0")
+    cache.get("missing")
+
+    rendered = metrics.render()
+    assert 'imagechain_cache_hits_total{cache="test_images"} 1' in rendered
+    assert 'imagechain_cache_spill_hits_total{cache="test_images"} 1' in rendered
+    assert 'imagechain_cache_misses_total{cache="test_images"} 1' in rendered
+    assert f'imagechain_cache_bytes{{cache="test_images"}} {cache.size}' in rendered
+    assert f'imagechain_cache_spill_bytes{{cache="test_images"}} {cache.spill_size}' in rendered
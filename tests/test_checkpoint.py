@@ -0,0 +1,50 @@
+import checkpoint
+from checkpoint import GENESIS_DIGEST, VerificationCheckpoint, block_digest
+
+
+def make_chain(count):
+    return [{"index": index, "file_hash": f"h{index}", "previous_hash": f"h{index - 1}" if index else "0"} for index in range(count)]
+
+
+def verified(collection, chain):
+    digest = GENESIS_DIGEST
+    for block in chain:
+        digest = block_digest(digest, block)
+    saved = VerificationCheckpoint(collection)
+    saved.save(len(chain) - 1, digest)
+    return digest
+
+
+def test_resumes_after_the_verified_prefix(db):
+    chain = make_chain(5)
+    digest = verified(db["verification"], chain[:3])
+
+    assert VerificationCheckpoint(db["verification"]).resume_point(chain) == (3, digest)
+
+
+def test_changed_prefix_forces_a_full_verify(db):
+    chain = make_chain(5)
+    verified(db["verification"], chain[:3])
+    chain[1] = dict(chain[1], message="forged")
+
+    assert VerificationCheckpoint(db["verification"]).resume_point(chain) == (0, GENESIS_DIGEST)
+
+
+def test_same_chain_is_only_hashed_from_where_it_was_left(db, monkeypatch):
+    chain = make_chain(3)
+    digest = verified(db["verification"], chain)
+    saved = VerificationCheckpoint(db["verification"])
+    assert saved.resume_point(chain) == (3, digest)
+
+    starts = []
+    chain_encodings = checkpoint.chain_encodings
+    monkeypatch.setattr(checkpoint, "chain_encodings", lambda chain, count, start=0: starts.append(start) or chain_encodings(chain, count, start))
+    chain.extend(make_chain(5)[3:])
+    for block in chain[3:]:
+        digest = block_digest(digest, block)
+    saved.save(4, digest, chain)
+
+    assert saved.resume_point(chain) == (5, digest)
+    # A different chain object is hashed from genesis
+    assert saved.resume_point(list(chain)) == (5, digest)
+    assert starts == [5, 0]
@@ -0,0 +1,152 @@
+import threading
+import pytest
+
+
+def stored_files(imagechain, bucket="fs"):
+    return imagechain.db[f"{bucket}.files"].count_documents({})
+
+
+@pytest.mark.parametrize("eager_renditions", [False, True])
+def test_failed_batch_removes_every_stored_image(imagechain, make_image, monkeypatch, eager_renditions):
+    imagechain.eager_renditions = eager_renditions
+    seal_block = imagechain.seal_block
+    failed = threading.Event()
+
+    def seal_or_fail(image, block, filename=None):
+        if block["index"] == 1:
+            failed.set()
+            raise ValueError("disk full")
+        # Still sealing when the failure is raised
+        failed.wait()
+        return seal_block(image, block, filename)
+
+    monkeypatch.setattr(imagechain, "seal_block", seal_or_fail)
+    with pytest.raises(ValueError, match="disk full"):
+        imagechain.add_blocks([make_image(seed) for seed in range(4)], {"signature": "sig", "message": "msg"})
+
+    assert len(imagechain.chain) == 0
+    assert imagechain.store.count() == 0
+    assert stored_files(imagechain) == 0
+    assert stored_files(imagechain, "renditions") == 0
+
+
+def test_batch_commits_consecutive_blocks(imagechain, make_image):
+    blocks = imagechain.add_blocks([make_image(seed) for seed in range(3)], {"signature": "sig", "message": "msg"})
+
+    assert [block["index"] for block in blocks] == [0, 1, 2]
+    assert stored_files(imagechain) == 3
+    assert imagechain.verify_chain_real_time(full_audit=True)
+
+
+def other_writer(imagechain):
+    from imagechain import ImageChain
+
+    other = ImageChain(client=imagechain.client, db_name=imagechain.db_name, snapshot_path=False)
+    other.difficulty_bits = imagechain.difficulty_bits
+    return other
+
+
+def test_add_block_catches_up_with_another_writer(imagechain, make_image):
+    imagechain.create_genesis_block(make_image(0), "sig", "msg")
+    other_writer(imagechain).add_block(make_image(1), "sig", "msg")
+
+    block = imagechain.add_block(make_image(2), "sig", "msg")
+    assert block["index"] == 2
+    assert [block["index"] for block in imagechain.chain] == [0, 1, 2]
+    assert stored_files(imagechain) == 3
+
+
+def test_batch_catches_up_with_another_writer(imagechain, make_image):
+    imagechain.create_genesis_block(make_image(0), "sig", "msg")
+    other_writer(imagechain).add_block(make_image(1), "sig", "msg")
+
+    blocks = imagechain.add_blocks([make_image(seed) for seed in (2, 3)], {"signature": "sig", "message": "msg"})
+    assert [block["index"] for block in blocks] == [2, 3]
+    assert stored_files(imagechain) == 4
+    assert imagechain.verify_chain_real_time(full_audit=True)
+
+
+def test_batch_bounds_the_decoded_images(imagechain, make_image, monkeypatch):
+    prepare_image, seal_block = imagechain.prepare_image, imagechain.seal_block
+    lock = threading.Lock()
+    decoded = [0, 0]  # held now, most held at once
+
+    def prepare(source):
+        result = prepare_image(source)
+        with lock:
+            decoded[0] += 1
+            decoded[1] = max(decoded)
+        return result
+
+    def seal(image, block, filename=None):
+        seal_block(image, block, filename)
+        with lock:
+            decoded[0] -= 1
+
+    monkeypatch.setattr(imagechain, "prepare_image", prepare)
+    monkeypatch.setattr(imagechain, "seal_block", seal)
+    blocks = imagechain.add_blocks([make_image(seed) for seed in range(12)], {}, workers=2)
+
+    assert len(blocks) == 12
+    assert decoded[0] == 0
+    assert decoded[1] <= 4
+
+
+def test_merkle_proof_catches_up_with_another_writer(imagechain, make_image):
+    from merkle import verify_proof
+
+    imagechain.create_genesis_block(make_image(0), "sig", "msg")
+    block = other_writer(imagechain).add_block(make_image(1), "sig", "msg")
+
+    inclusion = imagechain.merkle_proof(1)
+    assert inclusion["block"]["file_hash"] == block["file_hash"]
+    assert verify_proof(inclusion["block"], inclusion["proof"], inclusion["root"])
+    with pytest.raises(IndexError):
+        imagechain.merkle_proof(2)
+
+
+def test_mining_does_not_hold_the_chain_lock(imagechain, make_image, monkeypatch):
+    imagechain.create_genesis_block(make_image(0), "sig", "msg")
+    proof_of_work = imagechain.proof_of_work
+    free = []
+
+    def take_lock():
+        if imagechain.lock.acquire(timeout=1):
+            imagechain.lock.release()
+            free.append(True)
+
+    def mine(previous_hash):
+        # Another thread can take the lock (e.g. to save a block) while this one mines
+        other = threading.Thread(target=take_lock)
+        other.start()
+        other.join()
+        return proof_of_work(previous_hash)
+
+    monkeypatch.setattr(imagechain, "proof_of_work", mine)
+    imagechain.add_block(make_image(1), "sig", "msg")
+    assert free == [True]
+
+
+def test_image_etag_does_not_wait_for_the_chain_lock(imagechain, make_image):
+    block = imagechain.create_genesis_block(make_image(0), "sig", "msg")
+    etags = []
+    with imagechain.lock:
+        # Held by a writer; image requests still answer
+        reader = threading.Thread(target=lambda: etags.append(imagechain.image_etag(block["file_id"])))
+        reader.start()
+        reader.join(timeout=5)
+    assert etags == [block["file_hash"]]
+
+
+def test_concurrent_add_block_calls_all_land(imagechain, make_image):
+    imagechain.create_genesis_block(make_image(0), "sig", "msg")
+    paths = [make_image(seed) for seed in range(1, 7)]
+    threads = [threading.Thread(target=imagechain.add_block, args=(path, "sig", "msg")) for path in paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [block["index"] for block in imagechain.chain] == list(range(7))
+    assert stored_files(imagechain) == 7
+    assert imagechain.verify_chain_real_time(full_audit=True)
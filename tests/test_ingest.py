@@ -0,0 +1,63 @@
+import time
+import pytest
+import ingest
+from ingest import COMMITTED, FAILED, IngestionPipeline
+from storage import ChainConflictError
+
+
+def wait_for(pipeline, job, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not job.done:
+        assert time.monotonic() < deadline, f"job stuck in {job.status}"
+        time.sleep(0.01)
+    return pipeline.status(job.id)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(ingest, "SEQUENCER_ERROR_DELAY", 0)
+
+
+def test_commits_uploads_in_order(imagechain, make_image):
+    pipeline = IngestionPipeline(imagechain, workers=2)
+    jobs = [pipeline.submit(make_image(seed), "sig", "msg") for seed in range(3)]
+
+    assert [wait_for(pipeline, job)["index"] for job in jobs] == [0, 1, 2]
+    assert imagechain.store.count() == 3
+
+
+def test_sequencer_survives_errors_while_recovering(imagechain, make_image, monkeypatch):
+    pipeline = IngestionPipeline(imagechain, workers=2)
+    wait_for(pipeline, pipeline.submit(make_image(0), "sig", "msg"))
+
+    def conflict(block):
+        raise ChainConflictError("tip moved")
+
+    def unreachable():
+        raise ConnectionError("MongoDB is unreachable")
+
+    # A conflict makes the sequencer reload the chain, which fails as well
+    with monkeypatch.context() as patch:
+        patch.setattr(imagechain, "save_block", conflict)
+        patch.setattr(imagechain, "reload_chain", unreachable)
+        failed = wait_for(pipeline, pipeline.submit(make_image(1), "sig", "msg"))
+    assert failed["status"] == FAILED
+    assert "unreachable" in failed["error"]
+
+    # The sequencer is still running and later uploads are committed
+    later = wait_for(pipeline, pipeline.submit(make_image(2), "sig", "msg"))
+    assert later["status"] == COMMITTED
+    assert later["index"] == 1
+
+
+def test_other_workers_see_job_status(imagechain, make_image):
+    pipeline = IngestionPipeline(imagechain, workers=2)
+    job = pipeline.submit(make_image(0), "sig", "msg")
+    wait_for(pipeline, job)
+
+    other_worker = IngestionPipeline(imagechain, workers=1)
+    status = other_worker.status(job.id)
+    assert status["status"] == COMMITTED
+    assert status["index"] == 0
+    assert status == pipeline.status(job.id)
+    assert other_worker.status("unknown") is None
@@ -0,0 +1,64 @@
+import json
+import os
+import numpy as np
+import pytest
+from PIL import Image
+import lsb_codec
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "stegano_block.png")
+# The block header stegano's lsb.hide embedded into the fixture
+FIXTURE_HEADER = {
+    "file_hash": "QmcXEdYtNyVWm9UT3Q5JchiDxRHmuyQiAxxiUYqV7HiFz6",
+    "index": 0,
+    "message": "café ✓",
+    "nonce": 0,
+    "previous_hash": "0",
+    "signature": "df",
+    "timestamp": "2025-03-17 19:19:42.424807",
+}
+
+
+def cover(seed=3, size=(32, 24), mode="RGB"):
+    channels = len(mode)
+    pixels = np.random.default_rng(seed).integers(0, 255, (size[1], size[0], channels), dtype=np.uint8)
+    return Image.fromarray(pixels, mode)
+
+
+def test_reads_images_written_by_stegano():
+    assert json.loads(lsb_codec.reveal(FIXTURE)) == FIXTURE_HEADER
+
+
+def test_writes_the_same_pixels_as_stegano():
+    with Image.open(FIXTURE) as expected:
+        hidden = lsb_codec.hide(cover(), json.dumps(FIXTURE_HEADER, sort_keys=True))
+        assert np.array_equal(np.asarray(hidden), np.asarray(expected))
+
+
+def test_round_trip_with_alpha_leaves_alpha_untouched():
+    image = cover(mode="RGBA")
+    hidden = lsb_codec.hide(image, "hello")
+    assert lsb_codec.reveal(hidden) == "hello"
+    assert np.array_equal(np.asarray(hidden)[..., 3], np.asarray(image)[..., 3])
+
+
+def test_live_round_trip_with_stegano(tmp_path):
+    lsb = pytest.importorskip("stegano.lsb")
+    path = str(tmp_path / "cover.png")
+    cover(seed=7).save(path)
+
+    ours = str(tmp_path / "ours.png")
+    lsb_codec.hide(path, "written by lsb_codec").save(ours)
+    assert lsb.reveal(ours) == "written by lsb_codec"
+    theirs = str(tmp_path / "theirs.png")
+    lsb.hide(path, "written by stegano").save(theirs)
+    assert lsb_codec.reveal(theirs) == "written by stegano"
+
+
+def test_rejects_messages_that_do_not_fit():
+    with pytest.raises(ValueError, match="too long"):
+        lsb_codec.hide(cover(size=(4, 4)), "x" * 100)
+
+
+def test_rejects_images_without_a_message():
+    with pytest.raises(ValueError, match="Impossible to detect message"):
+        lsb_codec.reveal(Image.new("RGB", (32, 24)))
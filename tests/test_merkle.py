@@ -0,0 +1,79 @@
+import hashlib
+import pytest
+from block import Block
+from merkle import EMPTY_ROOT, LEAF_PREFIX, NODE_PREFIX, MerkleTree, leaf_hash, verify_proof
+
+
+def blocks(count, offset=0):
+    return [
+        Block(index=index, file_hash=f"{index + offset:064x}", previous_hash="0", nonce=index,
+              timestamp="2024-01-01 00:00:00", signature="sig", message="msg")
+        for index in range(count)
+    ]
+
+
+def naive_root(chain):
+    """Root computed level by level, carrying an odd node up unchanged."""
+    level = [leaf_hash(block) for block in chain]
+    while len(level) > 1:
+        level = [
+            hashlib.sha256(NODE_PREFIX + level[i] + level[i + 1]).digest() if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)
+        ]
+    return level[0].hex()
+
+
+def test_empty_tree():
+    tree = MerkleTree()
+    assert tree.root == EMPTY_ROOT
+    assert len(tree) == 0
+    with pytest.raises(IndexError):
+        tree.proof(0)
+
+
+def test_leaf_is_the_prefixed_header_hash():
+    block = blocks(1)[0]
+    assert leaf_hash(block) == hashlib.sha256(LEAF_PREFIX + block.header_bytes).digest()
+    assert MerkleTree([block]).root == leaf_hash(block).hex()
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 5, 7, 8, 9, 16, 17])
+def test_root_and_proofs(count):
+    chain = blocks(count)
+    tree = MerkleTree(chain)
+    assert tree.root == naive_root(chain)
+
+    for index, block in enumerate(chain):
+        proof = tree.proof(index)
+        assert verify_proof(block, proof, tree.root)
+        # A proof only holds for its own block
+        assert not verify_proof(chain[(index + 1) % count], proof, tree.root) or count == 1
+    with pytest.raises(IndexError):
+        tree.proof(count)
+
+
+def test_tampered_block_fails():
+    chain = blocks(5)
+    tree = MerkleTree(chain)
+    tampered = Block(dict(chain[2].to_dict(), message="other"))
+    assert not verify_proof(tampered, tree.proof(2), tree.root)
+
+
+def test_appending_matches_building_at_once():
+    chain = blocks(11)
+    tree = MerkleTree()
+    for count, block in enumerate(chain, 1):
+        tree.append(block)
+        assert tree.root == MerkleTree(chain[:count]).root
+
+
+def test_update_rebuilds_a_replaced_chain():
+    tree = MerkleTree(blocks(6))
+    replaced = blocks(4, offset=100)
+    tree.update(replaced)
+    assert tree.root == naive_root(replaced)
+    assert len(tree) == 4
+
+    grown = replaced + blocks(3, offset=200)
+    tree.update(grown)
+    assert tree.root == naive_root(grown)
@@ -0,0 +1,41 @@
+import hashlib
+import pytest
+from miner import Miner, check_proof, difficulty_target
+
+# Blocks from blockchain.json, mined with the original "leading zero hex digits" loop (difficulty 4)
+EXISTING_BLOCKS = [
+    ("QmcXEdYtNyVWm9UT3Q5JchiDxRHmuyQiAxxiUYqV7HiFz6", 23270),
+    ("QmczaNSaGAbCjBwQUmmNrYTwxZNVKdDDst8GKKuChTepmZ", 253927),
+]
+
+
+def original_proof_of_work(previous_hash, difficulty):
+    nonce = 0
+    while True:
+        if hashlib.sha256(f"{previous_hash}{nonce}".encode()).hexdigest()[:difficulty] == "0" * difficulty:
+            return nonce
+        nonce += 1
+
+
+@pytest.mark.parametrize("previous_hash, nonce", EXISTING_BLOCKS)
+def test_existing_nonces_still_verify(previous_hash, nonce):
+    assert check_proof(previous_hash, nonce, 16)
+    assert not check_proof(previous_hash, nonce + 1, 16)
+
+
+def test_target_counts_leading_zero_bits():
+    assert difficulty_target(0) is None
+    assert difficulty_target(8) == b"\x01" + b"\x00" * 31
+    assert difficulty_target(12) == b"\x00\x10" + b"\x00" * 30
+
+
+def test_inline_mining_finds_the_original_nonce():
+    result = Miner(workers=1).mine("QmcXEdYtNyVWm9UT3Q5JchiDxRHmuyQiAxxiUYqV7HiFz6", 12)
+    assert result.nonce == original_proof_of_work("QmcXEdYtNyVWm9UT3Q5JchiDxRHmuyQiAxxiUYqV7HiFz6", 3)
+
+
+def test_parallel_mining_finds_a_valid_nonce():
+    miner = Miner(workers=2, batch_size=1000, inline_bits=4)
+    result = miner.mine("previous", 14)
+    assert check_proof("previous", result.nonce, 14)
+    assert result.attempts > 0
@@ -0,0 +1,120 @@
+import asyncio
+import socket
+import time
+from imagechain import ImageChain
+from p2p import P2PNode
+from p2p_async import AsyncP2PNode
+from sync import ChainSync
+from wire import recv_message, send_message
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def local_chain(client, name):
+    imagechain = ImageChain(client=client, db_name=name, snapshot_path=False)
+    imagechain.difficulty_bits = 4
+    imagechain.verify_processes = 1
+    return imagechain
+
+
+def node(client, name):
+    return AsyncP2PNode("127.0.0.1", free_port(), imagechain=local_chain(client, name))
+
+
+async def until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.02)
+
+
+def test_gossiped_blocks_are_stored_with_local_images(client, make_image):
+    a, b = node(client, "node_a"), node(client, "node_b")
+
+    async def run():
+        await a.start()
+        await b.start()
+        await a.connect_to_peer(b.host, b.port)
+        await b.connect_to_peer(a.host, a.port)
+        try:
+            for seed, add in enumerate([a.imagechain.create_genesis_block, a.imagechain.add_block]):
+                block = await asyncio.to_thread(add, make_image(seed), "sig", "msg")
+                await a.broadcast_block(block.to_dict())
+                await until(lambda: b.imagechain.store.count() == seed + 1)
+        finally:
+            await a.stop()
+            await b.stop()
+
+    asyncio.run(run())
+
+    stored = b.imagechain.store.load_all()
+    assert [block["file_hash"] for block in stored] == [block["file_hash"] for block in a.imagechain.chain]
+    assert [block.to_dict() for block in b.imagechain.chain] == [block.to_dict() for block in stored]
+    # B keeps its own copy of every image, checked against its embedded header
+    for block in stored:
+        assert b.imagechain.read_image_from_mongodb(block["file_id"], use_cache=False)
+    assert b.imagechain.verify_chain_real_time(full_audit=True)
+    # B's chain tip is the stored one, so it can keep extending it
+    assert b.imagechain.add_block(make_image(9), "sig", "msg")["index"] == 2
+
+
+def test_gossiped_block_with_unreachable_image_is_rejected(client, make_image):
+    a, b = node(client, "node_a"), node(client, "node_b")
+    block = a.imagechain.create_genesis_block(make_image(0), "sig", "msg")
+
+    # Nobody can serve the image, so the block is not added
+    assert not b.chain_sync.accept_gossip(block.to_dict(), f"127.0.0.1:{free_port()}")
+    assert b.imagechain.store.count() == 0
+    assert len(b.imagechain.chain) == 0
+
+
+def test_node_reuses_its_chain_sync(client, make_image, monkeypatch):
+    a, b = node(client, "node_a"), node(client, "node_b")
+    created = []
+    init = ChainSync.__init__
+    monkeypatch.setattr(ChainSync, "__init__", lambda self, *args, **kwargs: created.append(self) or init(self, *args, **kwargs))
+
+    async def run():
+        await a.start()
+        await b.start()
+        await a.connect_to_peer(b.host, b.port)
+        await b.connect_to_peer(a.host, a.port)
+        try:
+            for seed in range(3):
+                add = a.imagechain.add_block if seed else a.imagechain.create_genesis_block
+                await a.broadcast_block((await asyncio.to_thread(add, make_image(seed), "sig", "msg")).to_dict())
+                await until(lambda: b.imagechain.store.count() == seed + 1)
+        finally:
+            await a.stop()
+            await b.stop()
+
+    asyncio.run(run())
+    assert created == [b.chain_sync]
+
+
+def test_idle_connections_do_not_hold_threaded_node_slots(client):
+    server = P2PNode("127.0.0.1", free_port(), max_connections=2, imagechain=local_chain(client, "node_a"))
+    server.start()
+    idle = []
+    try:
+        deadline = time.monotonic() + 5
+        while len(idle) < 3:
+            try:
+                idle.append(socket.create_connection((server.host, server.port), timeout=5))
+            except ConnectionRefusedError:
+                assert time.monotonic() < deadline
+                time.sleep(0.02)
+
+        # More peers are connected than there are slots, and a new one is still answered
+        with socket.create_connection((server.host, server.port), timeout=5) as peer:
+            send_message(peer, {"type": "get_tip"})
+            assert recv_message(peer)["data"]["index"] == -1
+            send_message(peer, {"type": "get_tip"})
+            assert recv_message(peer)["type"] == "tip"
+    finally:
+        for sock in idle:
+            sock.close()
@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+
+def test_concurrent_requests_generate_a_rendition_once(imagechain, make_image, monkeypatch):
+    block = imagechain.create_genesis_block(make_image(0, size=(400, 300)), "sig", "msg")
+    renditions = imagechain.renditions
+    store = renditions._store
+    generating = threading.Event()
+    calls = []
+
+    def slow_store(*args):
+        calls.append(args[:3])
+        generating.set()
+        time.sleep(0.2)
+        return store(*args)
+
+    monkeypatch.setattr(renditions, "_store", slow_store)
+
+    def request():
+        return renditions.get(block["file_id"], "thumb", "jpeg")
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        first = pool.submit(request)
+        generating.wait()
+        # Requests arriving while the first one is still generating wait for it
+        later = [pool.submit(request) for _ in range(6)]
+        results = [first.result()] + [future.result() for future in later]
+
+    assert len(calls) == 1
+    assert len(set(results)) == 1
+    assert imagechain.db["renditions.files"].count_documents({}) == 1
+    assert renditions._locks == {}
@@ -0,0 +1,117 @@
+import pytest
+from imagechain import ImageChain
+from snapshot import SnapshotChain
+from sync import handle_sync_message
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    return str(tmp_path / "chain.snapshot")
+
+
+def open_chain(client, db, snapshot_path):
+    imagechain = ImageChain(client=client, db_name=db.name, snapshot_path=snapshot_path)
+    imagechain.difficulty_bits = 4
+    imagechain.verify_processes = 1
+    return imagechain
+
+
+@pytest.fixture
+def snapshotted(client, db, snapshot_path, make_image):
+    """A verified 4-block chain with a snapshot of all of it."""
+    imagechain = open_chain(client, db, snapshot_path)
+    imagechain.add_blocks([make_image(seed) for seed in range(4)], {"signature": "sig", "message": "msg"})
+    assert imagechain.verify_chain_real_time()
+    imagechain.save_snapshot()
+    return imagechain
+
+
+def tamper(db, index):
+    db["blocks"].update_one({"index": index}, {"$set": {"message": "forged"}})
+
+
+@pytest.mark.parametrize("full_audit", [False, True])
+def test_tampering_below_the_snapshot_tip_is_detected(client, db, snapshot_path, snapshotted, full_audit):
+    if not full_audit:
+        # Blocks the verification checkpoint does not cover are read back from MongoDB
+        snapshotted.checkpoint.clear()
+    tamper(db, 1)
+    imagechain = open_chain(client, db, snapshot_path)
+    assert isinstance(imagechain.chain, SnapshotChain)
+
+    assert not imagechain.verify_chain_real_time(full_audit=full_audit)
+    # The chain was reloaded from MongoDB, so everything derived from it matches the stored blocks
+    stored = imagechain.store.load_all()
+    assert imagechain.chain[1]["message"] == "forged"
+    assert imagechain.merkle_root() == open_chain(client, db, False).merkle_root()
+    tip = handle_sync_message(imagechain, {"type": "get_tip"})["data"]
+    assert tip["hash"] == stored[-1]["file_hash"]
+    # The stale snapshot is not trusted by the next process either
+    assert not open_chain(client, db, snapshot_path).verify_chain_real_time()
+
+
+def test_full_audit_checks_stored_blocks_not_the_loaded_chain(client, db, snapshotted):
+    # Tampered after this process loaded (and verified) the chain
+    tamper(db, 2)
+
+    report = snapshotted.verify_chain_report(full_audit=True)
+    assert [result["index"] for result in report.failures] == [2]
+    assert snapshotted.chain[2]["message"] == "forged"
+
+
+def test_edited_snapshot_is_replaced_by_the_stored_chain(client, db, snapshot_path, snapshotted):
+    with open(snapshot_path, "r+b") as f:
+        data = f.read()
+        f.seek(data.index(b'"msg"'))
+        f.write(b'"MSG"')
+
+    imagechain = open_chain(client, db, snapshot_path)
+    assert imagechain.verify_chain_real_time()
+    assert [block.to_dict() for block in imagechain.chain] == [block.to_dict() for block in imagechain.store.load_all()]
+
+
+def test_checkpointed_snapshot_is_not_read_back(client, db, snapshot_path, snapshotted, make_image, monkeypatch):
+    snapshotted.add_block(make_image(7), "sig", "msg")
+    imagechain = open_chain(client, db, snapshot_path)
+    ranges = []
+    store_range = imagechain.store.range
+    monkeypatch.setattr(imagechain.store, "range", lambda start=0, stop=None: ranges.append((start, stop)) or store_range(start, stop))
+
+    assert imagechain.verify_chain_real_time()
+    # Only the block after the snapshot was loaded; the checkpoint vouches for the rest
+    assert ranges == [(4, None)]
+    assert imagechain.store.count() == 5
+
+
+def test_snapshot_indexes_without_decoding(snapshot_path, monkeypatch):
+    from block import Block
+    from headers import HeaderIndex
+    from merkle import MerkleTree
+    from snapshot import open_snapshot, write_snapshot
+
+    blocks = [
+        Block(index=index, file_hash=f"{index:064x}", previous_hash=f"{index - 1:064x}" if index else "0",
+              nonce=index, timestamp="2024-01-01 00:00:00", signature="sig", message="msg", file_id=f"id{index}")
+        for index in range(500)
+    ]
+    write_snapshot(snapshot_path, blocks[:400])
+    chain = SnapshotChain(open_snapshot(snapshot_path), blocks[400:])
+    decoded = []
+    from_encoding = Block.from_encoding
+    monkeypatch.setattr(Block, "from_encoding", classmethod(lambda cls, encoding: decoded.append(1) or from_encoding(encoding)))
+
+    tree, headers = MerkleTree(chain), HeaderIndex(chain)
+    assert tree.root == MerkleTree(blocks).root
+    assert headers.find(f"{123:064x}").index == 123
+    assert headers.find_file_id("id456").index == 456
+    assert headers.find("missing") is None and headers.find_file_id("missing") is None
+    assert tree.proof(7) == MerkleTree(blocks).proof(7)
+    # A few decodes per lookup, none for indexing the 400 snapshot blocks
+    assert len(decoded) <= 4
+
+    # A snapshot written from this chain reuses the stored leaves and tables
+    write_snapshot(snapshot_path, chain)
+    reopened = SnapshotChain(open_snapshot(snapshot_path))
+    assert MerkleTree(reopened).root == tree.root
+    assert HeaderIndex(reopened).find_file_id("id450").index == 450
+    assert not HeaderIndex(reopened).validate(0)
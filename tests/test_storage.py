@@ -0,0 +1,129 @@
+import threading
+import time
+import pytest
+import storage
+from storage import LEGACY_CHAIN_ID, LEGACY_MIGRATION_ID, BlockStore, ChainConflictError, LegacyChainError
+
+
+def legacy_block(index, file_hash, previous_hash):
+    return {
+        "index": index,
+        "file_hash": file_hash,
+        "previous_hash": previous_hash,
+        "nonce": index,
+        "timestamp": "2025-01-01 00:00:00",
+        "signature": "sig",
+        "message": "msg",
+        "file_id": f"file{index}",
+    }
+
+
+def legacy_chain(*file_hashes):
+    blocks, previous = [], "0"
+    for index, file_hash in enumerate(file_hashes):
+        blocks.append(legacy_block(index, file_hash, previous))
+        previous = file_hash
+    return blocks
+
+
+def store_legacy(db, blocks):
+    db["blockchain"].insert_one({"_id": LEGACY_CHAIN_ID, "chain": blocks})
+
+
+def test_migrates_legacy_chain_once(db):
+    store_legacy(db, legacy_chain("a", "b", "c"))
+    store = BlockStore(db)
+
+    assert store.migrate_from_single_document() == 3
+    assert [block["file_hash"] for block in store.load_all()] == ["a", "b", "c"]
+    assert store.migrated()
+    # Completion is recorded, so a new store does not migrate again
+    assert BlockStore(db).migrate_from_single_document() == 0
+
+
+def test_migrates_legacy_chain_holding_an_image_twice(db):
+    # The same image uploaded twice: blocks 1 and 3 share a file_hash, blocks 2 and 4 a previous_hash
+    store_legacy(db, legacy_chain("a", "b", "c", "b", "d"))
+    store = BlockStore(db)
+
+    assert store.migrate_from_single_document() == 5
+    assert [block["file_hash"] for block in store.load_all()] == ["a", "b", "c", "b", "d"]
+    assert store.find_by_file_hash("b")["index"] == 1
+    # Blocks added after the migration are still unique
+    reopened = BlockStore(db)
+    reopened.append(legacy_block(5, "e", "d"))
+    with pytest.raises(ChainConflictError):
+        reopened.append(legacy_block(6, "e", "e"))
+    assert reopened.count() == 6
+
+
+def test_forked_legacy_chain_names_the_fork(db):
+    blocks = legacy_chain("a", "b")
+    blocks.append(legacy_block(1, "c", "a"))
+    store_legacy(db, blocks)
+
+    with pytest.raises(LegacyChainError, match=r"index 1 at positions \[1, 2\]"):
+        BlockStore(db).migrate_from_single_document()
+    assert BlockStore(db).count() == 0
+    # The claim is released, so a fixed chain can be migrated later
+    assert db["migrations"].count_documents({}) == 0
+
+
+def test_resumes_interrupted_migration(db):
+    blocks = legacy_chain("a", "b", "c", "d")
+    store_legacy(db, blocks)
+    store = BlockStore(db)
+    store.collection.insert_many([dict(block) for block in blocks[:2]])
+
+    assert store.migrate_from_single_document() == 2
+    assert [block["index"] for block in store.load_all()] == [0, 1, 2, 3]
+    with pytest.raises(ValueError):
+        store.append(legacy_block(2, "x", "d"))
+
+
+def test_chain_grown_after_migration_is_kept(db):
+    blocks = legacy_chain("a", "b", "c")
+    store_legacy(db, blocks)
+    store = BlockStore(db)
+    store.collection.insert_many([dict(block) for block in blocks])
+    store.append(legacy_block(3, "d", "c"))
+
+    assert store.migrate_from_single_document() == 0
+    assert store.count() == 4
+
+
+def test_waits_for_a_migration_claimed_by_another_process(db, monkeypatch):
+    monkeypatch.setattr(storage, "MIGRATION_POLL_SECONDS", 0.01)
+    store_legacy(db, legacy_chain("a", "b"))
+    db["migrations"].insert_one({"_id": LEGACY_MIGRATION_ID, "state": "running", "owner": "other", "expires": time.time() + 60})
+
+    def other_process_finishes():
+        time.sleep(0.1)
+        BlockStore(db).collection.insert_many([dict(block) for block in legacy_chain("a", "b")])
+        db["migrations"].update_one({"_id": LEGACY_MIGRATION_ID}, {"$set": {"state": "done"}})
+
+    finisher = threading.Thread(target=other_process_finishes)
+    finisher.start()
+    store = BlockStore(db)
+    assert store.migrate_from_single_document() == 0
+    finisher.join()
+    assert store.migrated()
+    assert store.count() == 2
+
+
+def test_takes_over_an_expired_claim(db):
+    store_legacy(db, legacy_chain("a", "b"))
+    db["migrations"].insert_one({"_id": LEGACY_MIGRATION_ID, "state": "running", "owner": "crashed", "expires": time.time() - 1})
+
+    assert BlockStore(db).migrate_from_single_document() == 2
+
+
+def test_image_chain_refuses_to_load_unmigratable_chain(client, db):
+    from imagechain import ImageChain
+
+    blocks = legacy_chain("a", "b")
+    blocks.append(legacy_block(1, "c", "a"))
+    store_legacy(db, blocks)
+    imagechain = ImageChain(client=client, db_name=db.name, snapshot_path=False)
+    with pytest.raises(LegacyChainError):
+        imagechain.chain
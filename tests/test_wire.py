@@ -0,0 +1,64 @@
+import asyncio
+import socket
+import pytest
+import wire
+from wire import CODEC_JSON, CODEC_MSGPACK, HEADER, FrameError, encode_frame, read_message, recv_message
+
+MESSAGE = {"type": "image", "data": {"file_hash": "ab" * 32, "image": b"\x89PNG\x00\xff", "index": 7}}
+
+
+def exchange(frame):
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(frame)
+        a.shutdown(socket.SHUT_WR)
+        return recv_message(b)
+
+
+def read_async(frame):
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(frame)
+        reader.feed_eof()
+        return await read_message(reader)
+
+    return asyncio.run(read())
+
+
+@pytest.mark.parametrize("codec", [CODEC_JSON, CODEC_MSGPACK])
+def test_round_trip_keeps_bytes(codec):
+    if codec == CODEC_MSGPACK:
+        pytest.importorskip("msgpack")
+    frame = encode_frame(MESSAGE, codec)
+
+    assert HEADER.unpack(frame[:HEADER.size]) == (len(frame) - HEADER.size, codec)
+    assert exchange(frame) == MESSAGE
+    assert read_async(frame) == MESSAGE
+
+
+def test_oversize_frames_are_refused(monkeypatch):
+    monkeypatch.setattr(wire, "MAX_FRAME_SIZE", 16)
+    with pytest.raises(FrameError):
+        encode_frame(MESSAGE, CODEC_JSON)
+
+    # A peer announcing a frame over the limit is refused before its payload is read
+    header = HEADER.pack(17, CODEC_JSON)
+    with pytest.raises(FrameError):
+        exchange(header)
+    with pytest.raises(FrameError):
+        read_async(header)
+
+
+def test_truncated_frames_are_errors():
+    frame = encode_frame(MESSAGE, CODEC_JSON)
+    with pytest.raises(ConnectionError):
+        exchange(frame[:-3])
+    with pytest.raises(ConnectionError):
+        exchange(frame[:2])
+    with pytest.raises(asyncio.IncompleteReadError):
+        read_async(frame[:-3])
+
+
+def test_unknown_codec_is_refused():
+    with pytest.raises(FrameError):
+        exchange(HEADER.pack(2, 9) + b"{}")
@@ -0,0 +1,165 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+import json
+import os
+import lsb_codec
+from block import Block, encode_header
+from metrics import metrics
+
+OK = "ok"
+RETRIEVAL_FAILED = "retrieval_failed"
+EXTRACTION_FAILED = "extraction_failed"
+HASH_MISMATCH = "hash_mismatch"
+TAMPERED = "tampered"
+INVALID_HEADER = "invalid_header"
+
+
+def extract_json_from_bytes(image_bytes):
+    """Extract hidden JSON metadata from encoded PNG bytes."""
+    return json.loads(lsb_codec.reveal(BytesIO(image_bytes)))
+
+
+def _extract_worker(image_bytes):
+    """Process pool entry point: return (extracted JSON, error message)."""
+    try:
+        return extract_json_from_bytes(image_bytes), None
+    except Exception as e:
+        return None, f"Failed to extract JSON: {e}"
+
+
+def check_block(block, extracted_json):
+    """Compare JSON extracted from a block's image with the stored block.
+
+    Returns a (status, detail) tuple.
+    """
+    if extracted_json.get("file_hash") != block["file_hash"]:
+        return HASH_MISMATCH, f"Stored Hash: {block['file_hash']} Extracted Hash: {extracted_json.get('file_hash')}"
+
+    # Compare against the block without file_id (it is not embedded)
+    if encode_header(extracted_json) != encode_header(block):
+        return TAMPERED, f"Block {block['index']} does not match the JSON embedded in its image"
+
+    return OK, None
+
+
+class VerificationReport:
+    """Per-block outcome of a chain verification run."""
+
+    def __init__(self):
+        self.results = []
+
+    def add(self, index, status, detail=None):
+        self.results.append({"index": index, "status": status, "detail": detail})
+
+    def flag(self, index, status, detail=None):
+        """Record a failure for index, replacing an OK result or inserting it in index order."""
+        for result in self.results:
+            if result["index"] == index:
+                if result["status"] == OK:
+                    result.update(status=status, detail=detail)
+                return
+        self.add(index, status, detail)
+        self.results.sort(key=lambda result: result["index"])
+
+    @property
+    def ok(self):
+        return all(result["status"] == OK for result in self.results)
+
+    @property
+    def failures(self):
+        return [result for result in self.results if result["status"] != OK]
+
+    def verified_prefix(self):
+        """Number of leading results that verified successfully."""
+        count = 0
+        for result in self.results:
+            if result["status"] != OK:
+                break
+            count += 1
+        return count
+
+    def to_dict(self):
+        return {"ok": self.ok, "checked": len(self.results), "failures": self.failures}
+
+
+class ChainVerifier:
+    """Verifies blocks by fanning image work out to thread and process pools.
+
+    GridFS reads run on a thread pool so they overlap with decoding, while the
+    PNG decode and LSB reveal run on a process pool. At most `window` blocks
+    are in flight at once, which bounds the number of images held in memory.
+    Small batches (below `parallel_threshold`) are extracted in-process to
+    avoid paying the pool start-up cost for one or two new blocks. With
+    use_cache, images and extracted JSON go through the ImageChain caches.
+    """
+
+    def __init__(self, imagechain, processes=None, io_threads=8, window=None, parallel_threshold=8, use_cache=True):
+        self.imagechain = imagechain
+        self.use_cache = use_cache
+        self.processes = processes or os.cpu_count() or 1
+        self.io_threads = io_threads
+        self.window = window or self.processes * 4
+        self.parallel_threshold = parallel_threshold
+
+    def verify(self, blocks):
+        """Verify every block and return a VerificationReport (never stops early)."""
+        blocks = list(blocks)
+        report = VerificationReport()
+        if not blocks:
+            return report
+
+        with ThreadPoolExecutor(max_workers=self.io_threads) as io_pool:
+            if len(blocks) < self.parallel_threshold:
+                self._run(blocks, report, io_pool, None)
+            else:
+                with ProcessPoolExecutor(max_workers=self.processes) as cpu_pool:
+                    self._run(blocks, report, io_pool, cpu_pool)
+        return report
+
+    def _run(self, blocks, report, io_pool, cpu_pool):
+        in_flight = deque()
+        for block in blocks:
+            if len(in_flight) >= self.window:
+                self._collect(report, *in_flight.popleft())
+            future = io_pool.submit(self._fetch_and_extract, block["file_id"], cpu_pool)
+            in_flight.append((block, future))
+        while in_flight:
+            self._collect(report, *in_flight.popleft())
+
+    def _fetch_and_extract(self, file_id, cpu_pool):
+        """Read the image on an I/O thread and hand it to the process pool."""
+        if self.use_cache:
+            extracted_json = self.imagechain.metadata_cache.get(file_id)
+            if extracted_json is not None:
+                return extracted_json, None
+        with metrics.timer("imagechain_verify_stage_seconds", stage="fetch"):
+            image_bytes = self.imagechain.read_image_from_mongodb(file_id, use_cache=self.use_cache)
+        if cpu_pool is None:
+            return _extract_worker(image_bytes)
+        return cpu_pool.submit(_extract_worker, image_bytes)
+
+    def _collect(self, report, block, future):
+        index = block["index"]
+        try:
+            extraction = future.result()
+        except Exception as e:
+            report.add(index, RETRIEVAL_FAILED, str(e))
+            return
+
+        if not isinstance(extraction, tuple):
+            try:
+                extraction = extraction.result()
+            except Exception as e:
+                report.add(index, EXTRACTION_FAILED, str(e))
+                return
+        extracted_json, error = extraction
+        if error:
+            report.add(index, EXTRACTION_FAILED, error)
+            return
+        # Cached as a Block, so re-verifying compares two cached encodings
+        extracted_json = Block.from_dict(extracted_json)
+        self.imagechain.metadata_cache.put(block["file_id"], extracted_json)
+
+        status, detail = check_block(block, extracted_json)
+        report.add(index, status, detail)
@@ -0,0 +1,218 @@
+import base64
+from collections.abc import Mapping
+import json
+import socket
+import struct
+import threading
+import time
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; JSON frames are always understood
+    msgpack = None
+
+# Every frame is a 4-byte big-endian payload length, a 1-byte codec id and the payload
+HEADER = struct.Struct("!IB")
+CODEC_JSON = 0
+CODEC_MSGPACK = 1
+DEFAULT_CODEC = CODEC_MSGPACK if msgpack else CODEC_JSON
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+class FrameError(ValueError):
+    """Raised when a peer sends a malformed or oversized frame."""
+
+
+def _msgpack_default(value):
+    # Blocks and other mappings travel as plain maps
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} cannot be packed")
+
+
+def _json_default(value):
+    # msgpack carries bytes natively; JSON frames wrap them in base64
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _json_object_hook(value):
+    if len(value) == 1 and "__bytes__" in value:
+        return base64.b64decode(value["__bytes__"])
+    return value
+
+
+def encode_frame(message, codec=DEFAULT_CODEC):
+    """Serialize a message into a length-prefixed frame."""
+    if codec == CODEC_MSGPACK:
+        payload = msgpack.packb(message, use_bin_type=True, default=_msgpack_default)
+    else:
+        payload = json.dumps(message, default=_json_default).encode()
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError(f"Message of {len(payload)} bytes exceeds the frame limit")
+    return HEADER.pack(len(payload), codec) + payload
+
+
+def decode_payload(codec, payload):
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise FrameError("Received a msgpack frame but msgpack is not installed")
+        return msgpack.unpackb(payload, raw=False)
+    if codec == CODEC_JSON:
+        return json.loads(payload, object_hook=_json_object_hook)
+    raise FrameError(f"Unknown codec {codec}")
+
+
+def recv_exactly(sock, size):
+    """Read exactly size bytes, raising ConnectionError if the peer hangs up."""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("Connection closed by peer")
+        received += count
+    return bytes(buffer)
+
+
+def send_message(sock, message, codec=DEFAULT_CODEC):
+    sock.sendall(encode_frame(message, codec))
+
+
+def recv_message(sock):
+    """Read one complete frame and return the decoded message."""
+    length, codec = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame of {length} bytes exceeds the frame limit")
+    return decode_payload(codec, recv_exactly(sock, length))
+
+
+async def read_message(reader):
+    """Read one complete frame from an asyncio StreamReader."""
+    length, codec = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame of {length} bytes exceeds the frame limit")
+    return decode_payload(codec, await reader.readexactly(length))
+
+
+async def write_message(writer, message, codec=DEFAULT_CODEC):
+    writer.write(encode_frame(message, codec))
+    await writer.drain()
+
+
+class PeerConnection:
+    """A long-lived connection to one peer, reconnecting with exponential backoff.
+
+    A stale socket is replaced once straight away; after that, failures make
+    the connection refuse new attempts until the backoff delay has passed.
+    """
+
+    def __init__(self, address, timeout=5.0, initial_backoff=0.5, max_backoff=30.0):
+        host, port = address.rsplit(":", 1)
+        self.address = address
+        self.host_port = (host, int(port))
+        self.timeout = timeout
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.backoff = 0
+        self.retry_at = 0
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        """Send a message without waiting for a reply."""
+        self.send_frame(encode_frame(message))
+
+    def send_frame(self, frame):
+        """Send an already encoded frame (lets a broadcast encode only once)."""
+        with self._lock:
+            self._call(lambda sock: sock.sendall(frame))
+
+    def request(self, message):
+        """Send a message and wait for the peer's reply frame."""
+        def exchange(sock):
+            send_message(sock, message)
+            return recv_message(sock)
+
+        with self._lock:
+            return self._call(exchange)
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+    def _call(self, operation):
+        if self._sock is None and time.monotonic() < self.retry_at:
+            raise ConnectionError(f"Backing off from {self.address} for {self.retry_at - time.monotonic():.1f}s")
+
+        reused = self._sock is not None
+        try:
+            return operation(self._connect())
+        except (OSError, ValueError):
+            self._disconnect()
+            if not reused:
+                self._fail()
+                raise
+        # The pooled socket had gone stale; retry once on a fresh connection
+        try:
+            return operation(self._connect())
+        except (OSError, ValueError):
+            self._disconnect()
+            self._fail()
+            raise
+
+    def _connect(self):
+        if self._sock is None:
+            self._sock = socket.create_connection(self.host_port, timeout=self.timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.backoff = 0
+        return self._sock
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def _fail(self):
+        self.backoff = min(self.max_backoff, self.backoff * 2 or self.initial_backoff)
+        self.retry_at = time.monotonic() + self.backoff
+
+
+class ConnectionPool:
+    """Keeps one PeerConnection per peer address."""
+
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def get(self, address):
+        with self._lock:
+            connection = self._connections.get(address)
+            if connection is None:
+                connection = PeerConnection(address, timeout=self.timeout)
+                self._connections[address] = connection
+            return connection
+
+    def send(self, address, message):
+        self.get(address).send(message)
+
+    def send_frame(self, address, frame):
+        self.get(address).send_frame(frame)
+
+    def request(self, address, message):
+        return self.get(address).request(message)
+
+    def close_all(self):
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for connection in connections:
+            connection.close()